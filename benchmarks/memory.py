@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+"""
+Measures the peak and retained memory of each stage of compiling generated
+documents of increasing size, and compares them against the baseline in
+memory-baseline.json. Growth is only reported if it's above both the
+relative threshold and the minimum growth in bytes, so that small, noisy
+measurements don't fail.
+
+    python benchmarks/memory.py            # compare against the baseline
+    python benchmarks/memory.py --update   # write a new baseline
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from diffdoc import compiler, parser, rst
+
+
+_baseline_path = os.path.join(os.path.dirname(__file__), "memory-baseline.json")
+_sizes = (1000, 10000, 100000, 1000000)
+
+
+def main():
+    args = _parse_args()
+
+    results = {}
+    for size in _sizes:
+        if size > args.max_lines:
+            continue
+        print("{} lines".format(size), file=sys.stderr)
+        results[str(size)] = _measure(generate_document(size))
+
+    if args.update:
+        with open(_baseline_path, "wt", encoding="utf-8") as baseline_fileobj:
+            json.dump(results, baseline_fileobj, indent=2, sort_keys=True)
+            baseline_fileobj.write("\n")
+        return
+
+    with open(_baseline_path, "rt", encoding="utf-8") as baseline_fileobj:
+        baseline = json.load(baseline_fileobj)
+
+    regressions = _compare(baseline, results, threshold=args.threshold, min_growth=args.min_growth)
+    for regression in regressions:
+        print(regression)
+    if regressions:
+        sys.exit(1)
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--update", action="store_true")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    parser.add_argument("--min-growth", type=int, default=64 * 1024)
+    parser.add_argument("--max-lines", type=int, default=max(_sizes))
+    return parser.parse_args()
+
+
+def _measure(source_text):
+    results = {}
+
+    rst_elements, results["rst.loads"] = _measure_stage(lambda: rst.loads(source_text))
+    del rst_elements
+    source, results["parser.loads"] = _measure_stage(lambda: parser.loads(source_text))
+    output, results["compiler.compile"] = _measure_stage(lambda: compiler.compile(source))
+    _, results["rst.dumps"] = _measure_stage(lambda: rst.dumps(output))
+
+    return results
+
+
+def _measure_stage(func):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        result = func()
+        gc.collect()
+        after, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return result, {"peak": peak - before, "retained": after - before}
+
+
+def _compare(baseline, results, threshold, min_growth):
+    regressions = []
+
+    for size, stages in sorted(results.items(), key=lambda item: int(item[0])):
+        for stage, measurements in sorted(stages.items()):
+            for measurement, value in sorted(measurements.items()):
+                baseline_value = baseline.get(size, {}).get(stage, {}).get(measurement)
+                if (
+                    baseline_value is not None and
+                    value > baseline_value * (1 + threshold) and
+                    value - baseline_value > min_growth
+                ):
+                    regressions.append("{} lines, {}, {}: {} bytes, baseline {} bytes (+{:.0%})".format(
+                        size,
+                        stage,
+                        measurement,
+                        value,
+                        baseline_value,
+                        value / max(baseline_value, 1) - 1,
+                    ))
+
+    return regressions
+
+
+def generate_document(line_count):
+    """
+    Generates a document of roughly the given number of lines, made up of
+    many names with large code blocks that are each patched, rendered and
+    replaced.
+    """
+    parts = []
+    lines = 0
+    name_index = 0
+
+    while lines < line_count:
+        name = "example{}".format(name_index)
+        code_lines = ["x{} = {}\n".format(index, index) for index in range(200)]
+        new_code_lines = ["x0 = -1\n"] + code_lines[1:]
+
+        parts.append("Section {}\n\n".format(name_index))
+        parts.append(rst.DiffdocBlock(
+            arguments=("start", name),
+            options={"language": "python", "render": "True"},
+            content="".join(code_lines),
+        ).dumps())
+        parts.append("\n")
+        parts.append(rst.DiffdocBlock(
+            arguments=("diff", name),
+            options={"render": "True"},
+            content="---\n+++\n@@ -1,2 +1,2 @@\n-x0 = 0\n+x0 = -1\n x1 = 1\n",
+        ).dumps())
+        parts.append("\n")
+        parts.append(rst.DiffdocBlock(
+            arguments=("render", name),
+            options={},
+            content="".join(new_code_lines[:10]),
+        ).dumps())
+        parts.append("\n")
+        parts.append(rst.DiffdocBlock(
+            arguments=("replace", name),
+            options={"render": "True"},
+            content="".join(code_lines),
+        ).dumps())
+        parts.append("\n")
+
+        lines += 2 * len(code_lines) + 30
+        name_index += 1
+
+    return "".join(parts)
+
+
+if __name__ == "__main__":
+    main()
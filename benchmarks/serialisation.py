@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+"""
+Times rst.dumps on a generated document with large code blocks, compared
+against the previous implementation that built a string for each element,
+and checks that both produce identical output. Most of the time is spent
+indenting block content, which both implementations do the same way, so
+the timings are usually within noise of each other.
+
+    python benchmarks/serialisation.py
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from diffdoc import rst
+
+
+def main():
+    elements = generate_elements(block_count=200, block_lines=500)
+
+    if rst.dumps(elements) != _reference_dumps(elements):
+        print("output differs from reference implementation")
+        sys.exit(1)
+
+    for name, func in (
+        ("reference", lambda: _reference_dumps(elements)),
+        ("rst.dumps", lambda: rst.dumps(elements)),
+    ):
+        duration = min(timeit.repeat(func, number=5, repeat=5)) / 5
+        print("{}: {:.1f} ms".format(name, duration * 1000))
+
+
+def generate_elements(block_count, block_lines):
+    code = "".join(
+        "def f{}(x):  \n    return x + {}\n\n".format(index, index)
+        for index in range(block_lines // 3)
+    )
+    elements = []
+    for index in range(block_count):
+        elements.append(rst.Text("Section {}\n\n".format(index)))
+        elements.append(rst.CodeBlock(language="python", content=code))
+        elements.append(rst.Text("\n"))
+        elements.append(rst.LiteralBlock(content=code))
+        elements.append(rst.Text("\n"))
+        elements.append(rst.DiffdocBlock(
+            arguments=("start", "example{}".format(index)),
+            options={"language": "python", "render": "True"},
+            content=code,
+        ))
+        elements.append(rst.Text("\n"))
+    return elements
+
+
+def _reference_dumps(elements):
+    return "".join(map(_reference_dumps_element, elements))
+
+
+def _reference_dumps_element(element):
+    if isinstance(element, rst.CodeBlock):
+        return _reference_dumps_directive("code-block", (element.language, ), {}, element.content)
+    elif isinstance(element, rst.LiteralBlock):
+        return "::\n{}".format(_reference_indent("\n" + element.content))
+    elif isinstance(element, rst.DiffdocBlock):
+        return _reference_dumps_directive("diff-doc", element.arguments, element.options, element.content)
+    else:
+        return element.text
+
+
+def _reference_dumps_directive(name, arguments, options, content):
+    arguments_str = " ".join(arguments)
+    options_str = "".join(
+        _reference_indent("\n:{}: {}".format(option_name, option_value))
+        for option_name, option_value in sorted(options.items())
+    )
+    if content:
+        content_str = _reference_indent("\n" + content)
+    else:
+        content_str = ""
+    return ".. {}:: {}{}\n{}".format(name, arguments_str, options_str, content_str)
+
+
+def _reference_indent(value):
+    return "\n".join(
+        line.rstrip()
+        for line in value.replace("\n", "\n" + rst.indentation).splitlines(keepends=False)
+    )
+
+
+if __name__ == "__main__":
+    main()
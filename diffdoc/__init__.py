@@ -1,13 +1,63 @@
-from . import compiler, parser, rst
+import os
 
 
-def compile(source_text):
-    source = parser.loads(source_text)
-    output = compiler.compile(source)
-    return rst.dumps(output)
+__version__ = "0.1.0"
+
+
+# Imported after __version__ is set, since the cache module depends on it.
+# The compiler and the modules that depend on it are imported when they're
+# first used, so that a compile whose output is cached doesn't import them.
+from .includes import Includes
+from .metrics import Metrics
+
+
+def Document(source_text, includes=None):
+    from . import document
+
+    return document.Document(source_text, includes=includes)
+
+
+def compile(
+    source_text,
+    runner=None,
+    metrics=None,
+    profile=None,
+    includes=None,
+    interpreters=None,
+    keep_going=False,
+    lockfile=None,
+    line_range=None,
+    source_name=None,
+):
+    from . import compiler, parser, rst
+
+    if metrics is None:
+        metrics = Metrics()
+    if includes is None:
+        includes = Includes(base_directory=os.getcwd())
+
+    with metrics.time("parse_seconds"):
+        source = parser.loads(source_text)
+    with metrics.time("compile_seconds"):
+        output = compiler.compile(
+            source,
+            runner=runner,
+            metrics=metrics,
+            profile=profile,
+            includes=includes,
+            interpreters=interpreters,
+            keep_going=keep_going,
+            lockfile=lockfile,
+            line_range=line_range,
+            source_name=source_name,
+        )
+    with metrics.time("serialise_seconds"):
+        return rst.dumps(output)
 
 
 def convert_block(source_text, line_number, block_type):
+    from . import compiler, parser, rst
+
     source = parser.loads(source_text)
     output = compiler.convert_block(
         source=source,
@@ -15,3 +65,22 @@ def convert_block(source_text, line_number, block_type):
         block_type=block_type,
     )
     return rst.dumps([element.to_rst() for element in output])
+
+
+def export_git(source_text, repository_path, includes=None):
+    from . import gitexport, parser
+
+    source = parser.loads(source_text)
+    gitexport.export(source, repository_path=repository_path, includes=includes)
+
+
+def rebase(base_source_text, source_text):
+    """
+    Rebases the diff blocks of a source after an earlier block has been
+    edited, given the source before the edit. Returns the text of the rebased
+    source, and a description of each block that couldn't be rebased.
+    """
+    from . import parser, rebasing, rst
+
+    rebased_source, problems = rebasing.rebase(parser.loads(base_source_text), parser.loads(source_text))
+    return rst.dumps([element.to_rst() for line_number, element in rebased_source]), problems
@@ -0,0 +1,111 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from . import __version__
+from .interpreters import default_interpreters
+
+
+def default_directory():
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "diff-doc")
+
+
+def document_key(source_text, dependency_keys=(), interpreters=None, source_name=None):
+    # The source name is shown in tracebacks, so it's part of the key when
+    # it's given.
+    if source_name is not None:
+        dependency_keys = ("source-name:" + source_name, ) + tuple(dependency_keys)
+    return _hash((environment_key(interpreters=interpreters), source_text) + tuple(dependency_keys))
+
+
+def environment_key(interpreters=None):
+    """
+    Identifies everything other than the source that compiled output depends
+    on: the version of diff-doc and the interpreters used to run programs.
+    """
+    if interpreters is None:
+        interpreters = default_interpreters
+
+    return _hash((
+        "diff-doc {}".format(__version__),
+        sys.version,
+    ) + tuple(map(_interpreter_identity, interpreters)))
+
+
+def _hash(parts):
+    key_hash = hashlib.sha256()
+    for part in parts:
+        key_hash.update(part.encode("utf-8"))
+        key_hash.update(b"\0")
+    return key_hash.hexdigest()
+
+
+def _interpreter_identity(command):
+    if command not in _interpreter_identities:
+        _interpreter_identities[command] = _find_interpreter_identity(command)
+    return _interpreter_identities[command]
+
+
+# Finding the interpreter behind a command can mean running it, so each
+# command is only looked up once.
+_interpreter_identities = {}
+
+
+def _find_interpreter_identity(command):
+    path = shutil.which(command)
+    if path is None:
+        return command
+
+    # The command might be a wrapper, such as a pyenv shim, that runs a
+    # different interpreter depending on the environment, so the interpreter
+    # is asked for its own path and version.
+    if os.path.realpath(path) == os.path.realpath(sys.executable):
+        executable, version = sys.executable, sys.version
+    else:
+        try:
+            output = subprocess.run(
+                [path, "-c", "import sys; print(sys.executable); print(sys.version)"],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                check=True,
+                universal_newlines=True,
+            ).stdout
+        except (OSError, subprocess.CalledProcessError):
+            output = ""
+        executable, _, version = output.partition("\n")
+        if not executable:
+            executable, version = path, ""
+
+    executable = os.path.realpath(executable)
+    stat = os.stat(executable)
+    return "{}:{}:{}:{}".format(executable, stat.st_size, stat.st_mtime_ns, version.strip())
+
+
+class Cache(object):
+    def __init__(self, directory):
+        self._directory = directory
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rt", encoding="utf-8", newline="") as fileobj:
+                return fileobj.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, value):
+        os.makedirs(self._directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self._directory)
+        try:
+            with open(fd, "wt", encoding="utf-8", newline="") as fileobj:
+                fileobj.write(value)
+            os.replace(temp_path, self._path(key))
+        except:
+            os.unlink(temp_path)
+            raise
+
+    def _path(self, key):
+        return os.path.join(self._directory, key)
@@ -1,6 +1,13 @@
 import argparse
+import os
+import subprocess
+import sys
 
-from . import compile, convert_block
+from . import cache, compile, convert_block, export_git, rebase
+from .includes import Includes
+from .lockfile import Lockfile
+from .metrics import Metrics
+from .profiling import ResourceProfile
 
 
 def main():
@@ -13,16 +20,138 @@ class CompileCommand(object):
 
     def add_arguments(self, parser):
         parser.add_argument("source")
+        parser.add_argument("--cache-dir", default=None)
+        parser.add_argument("--no-cache", dest="use_cache", action="store_false")
+        parser.add_argument("--spool-size", type=int, default=None)
+        parser.add_argument("--max-output-size", type=int, default=None)
+        parser.add_argument("--keep-going", action="store_true")
+        parser.add_argument("--interpreter", dest="interpreters", action="append", default=None)
+        parser.add_argument("--metrics", default=None)
+        parser.add_argument("--metrics-format", choices=("prometheus", "json"), default=None)
+        parser.add_argument("--profile", default=None)
+        parser.add_argument("--lines", dest="line_range", type=_line_range, default=None)
+        parser.add_argument("--source-name", default=None)
+        lockfile_group = parser.add_mutually_exclusive_group()
+        lockfile_group.add_argument("--record", action="store_true")
+        lockfile_group.add_argument("--frozen", action="store_true")
+        self._parser = parser
 
     def execute(self, args):
+        # The lockfile is written for the whole source, so it can't be
+        # recorded from a line range.
+        if args.record and args.line_range is not None:
+            self._parser.error("argument --record: not allowed with argument --lines")
+
         with open(args.source, "rt", encoding="utf-8") as source_fileobj:
             source = source_fileobj.read()
 
-        output = compile(source)
+        lockfile_path = args.source + ".lock"
+        if args.record:
+            lockfile = Lockfile()
+        elif args.frozen:
+            with open(lockfile_path, "rt", encoding="utf-8") as lockfile_fileobj:
+                lockfile = Lockfile.loads(lockfile_fileobj.read(), frozen=True)
+        else:
+            lockfile = None
+
+        metrics = Metrics()
+        profile = ResourceProfile()
+        # Cached output wasn't recorded or verified against the lockfile.
+        if args.use_cache and lockfile is None:
+            result_cache = cache.Cache(args.cache_dir or cache.default_directory())
+        else:
+            result_cache = None
+        # Cached output is for the whole source, but compiled includes can
+        # still be used when compiling a line range.
+        if args.line_range is None:
+            document_cache = result_cache
+        else:
+            document_cache = None
+        includes = Includes(
+            base_directory=os.path.dirname(os.path.abspath(args.source)),
+            result_cache=result_cache,
+        )
+
+        def compile_source():
+            # Imported here so that output from the cache is written without
+            # importing the modules used to run programs.
+            from . import execution
+
+            runner = execution.Runner(
+                spool_size=args.spool_size,
+                max_output_size=args.max_output_size,
+            )
+            return compile(
+                source,
+                runner=runner,
+                metrics=metrics,
+                profile=profile,
+                includes=includes,
+                interpreters=args.interpreters,
+                keep_going=args.keep_going,
+                lockfile=lockfile,
+                line_range=args.line_range,
+                source_name=args.source_name,
+            )
+
+        try:
+            if document_cache is not None:
+                key = includes.document_key(
+                    source,
+                    interpreters=args.interpreters,
+                    source_name=args.source_name,
+                )
+                output = document_cache.get(key)
+                if output is None:
+                    metrics.increment("cache_misses_total")
+                    output = compile_source()
+                    document_cache.put(key, output)
+                else:
+                    metrics.increment("cache_hits_total")
+            else:
+                output = compile_source()
+        finally:
+            if args.metrics is not None:
+                _write_metrics(metrics, path=args.metrics, format=args.metrics_format)
+            if args.profile is not None:
+                _write_profile(profile, path=args.profile)
+
+        if args.record:
+            with open(lockfile_path, "wt", encoding="utf-8") as lockfile_fileobj:
+                lockfile_fileobj.write(lockfile.dumps())
 
         print(output)
 
 
+def _line_range(value):
+    start, separator, end = value.partition("-")
+    try:
+        line_range = (int(start), int(end))
+    except ValueError:
+        line_range = None
+
+    if line_range is None or line_range[0] > line_range[1]:
+        raise argparse.ArgumentTypeError("invalid line range: {}".format(value))
+
+    return line_range
+
+
+def _write_metrics(metrics, path, format):
+    if format is None:
+        format = "json" if path.endswith(".json") else "prometheus"
+
+    with open(path, "wt", encoding="utf-8") as metrics_fileobj:
+        metrics_fileobj.write(metrics.dumps(format))
+
+
+def _write_profile(profile, path):
+    if path == "-":
+        sys.stderr.write(profile.report())
+    else:
+        with open(path, "wt", encoding="utf-8") as profile_fileobj:
+            profile_fileobj.write(profile.report())
+
+
 class ConvertBlockCommand(object):
     name = "convert-block"
 
@@ -45,6 +174,59 @@ class ConvertBlockCommand(object):
             source_fileobj.write(output)
 
 
+class ExportGitCommand(object):
+    name = "export-git"
+
+    def add_arguments(self, parser):
+        parser.add_argument("source")
+        parser.add_argument("repository")
+
+    def execute(self, args):
+        with open(args.source, "rt", encoding="utf-8") as source_fileobj:
+            source = source_fileobj.read()
+
+        if not os.path.exists(args.repository):
+            subprocess.check_call(["git", "init", "--quiet", args.repository])
+
+        export_git(
+            source,
+            repository_path=args.repository,
+            includes=Includes(base_directory=os.path.dirname(os.path.abspath(args.source))),
+        )
+
+
+class RebaseCommand(object):
+    name = "rebase"
+
+    def add_arguments(self, parser):
+        parser.add_argument("source")
+        parser.add_argument("--base", default=None)
+
+    def execute(self, args):
+        with open(args.source, "rt", encoding="utf-8") as source_fileobj:
+            source = source_fileobj.read()
+
+        if args.base is None:
+            source_directory, source_name = os.path.split(os.path.abspath(args.source))
+            base_source = subprocess.check_output(
+                ["git", "show", "HEAD:./" + source_name],
+                cwd=source_directory,
+            ).decode("utf-8")
+        else:
+            with open(args.base, "rt", encoding="utf-8") as base_fileobj:
+                base_source = base_fileobj.read()
+
+        output, problems = rebase(base_source, source)
+
+        with open(args.source, "wt", encoding="utf-8") as source_fileobj:
+            source_fileobj.write(output)
+
+        for problem in problems:
+            print(problem, file=sys.stderr)
+        if problems:
+            sys.exit(1)
+
+
 def _parse_args():
     parser = argparse.ArgumentParser()
     subparsers = parser.add_subparsers()
@@ -52,6 +234,8 @@ def _parse_args():
     for command in (
         CompileCommand(),
         ConvertBlockCommand(),
+        ExportGitCommand(),
+        RebaseCommand(),
     ):
         subparser = subparsers.add_parser(command.name)
         command.add_arguments(subparser)
@@ -1,18 +1,472 @@
-import subprocess
+import collections
+import concurrent.futures
 
-from . import parser, rst
-from .diff import apply_patch, generate_diff
+from . import execution, parser, rst
+from .contentstore import ContentStore, StoredContent
+from .metrics import Metrics
+from .diff import PatchError, apply_patch, generate_diff, read_file_patches, read_hunks
+from .workspace import Workspace, check_path
 
 
-def compile(source):
-    state = {}
+def compile(
+    source,
+    runner=None,
+    metrics=None,
+    profile=None,
+    includes=None,
+    interpreters=None,
+    keep_going=False,
+    lockfile=None,
+    line_range=None,
+    source_name=None,
+):
+    result, state = compile_with_state(
+        source,
+        runner=runner,
+        metrics=metrics,
+        profile=profile,
+        includes=includes,
+        interpreters=interpreters,
+        keep_going=keep_going,
+        lockfile=lockfile,
+        line_range=line_range,
+        source_name=source_name,
+    )
+    return result
+
+
+def compile_with_state(
+    source,
+    runner=None,
+    metrics=None,
+    profile=None,
+    includes=None,
+    interpreters=None,
+    keep_going=False,
+    lockfile=None,
+    line_range=None,
+    source_name=None,
+    check_outputs=True,
+):
+    """
+    Compiles the source, returning the compiled elements and the final state.
+
+    If a lockfile is given, each Output block whose program matches its
+    output is recorded in it. If the lockfile is frozen, Output blocks are
+    verified against it instead, and no programs are run.
+
+    If a line range is given as an inclusive pair of line numbers, only the
+    elements starting in that range are compiled and returned. The state
+    before the range is found without running any programs.
+
+    If a source name is given, tracebacks from programs show the source
+    name and the line number of the Output block rather than ``<string>``.
+    """
+    context = _Context(
+        runner=runner,
+        metrics=metrics,
+        profile=profile,
+        includes=includes,
+        interpreters=interpreters,
+        use_sessions=True,
+        lockfile=lockfile,
+        source_name=source_name,
+    )
+    try:
+        state = {}
+        if line_range is not None:
+            start_line_number, end_line_number = line_range
+            for line_number, element in source:
+                if line_number >= start_line_number:
+                    break
+                if not isinstance(element, parser.Output):
+                    state, _ = _execute(
+                        state,
+                        element,
+                        line_number=line_number,
+                        context=context,
+                        check_include_outputs=False,
+                    )
+
+            source = [
+                (line_number, element)
+                for line_number, element in source
+                if start_line_number <= line_number <= end_line_number
+            ]
+
+        return _compile_with_context(
+            source,
+            context=context,
+            keep_going=keep_going,
+            state=state,
+            check_outputs=check_outputs,
+        )
+    finally:
+        context.close()
+
+
+def _compile_with_context(source, context, keep_going, state, check_outputs=True):
+    """
+    Compiles the source in two passes. The first pass applies every state
+    transition and checks each Output block for pending lines, so that
+    structural errors are reported before any program is run. Included
+    sources are compiled in the same way, without running their programs.
+    The second pass runs the programs for included sources and then for
+    Output blocks.
+
+    If check_outputs is false, the second pass is skipped, and Output blocks
+    are compiled as though their programs matched.
+    """
     result = []
+    errors = []
+    # Names whose state couldn't be updated: later blocks for these names
+    # are skipped rather than reporting errors caused by the first one.
+    broken_names = set()
+    start_line_numbers = {}
+    deferred_outputs = []
+    deferred_includes = []
 
     for line_number, element in source:
-        state, transformed_element = _execute(state, element, line_number=line_number)
+        context.metrics.increment("elements_total", type=type(element).__name__.lower())
+
+        if isinstance(element, parser.Start):
+            broken_names.discard(element.name)
+            start_line_numbers[element.name] = line_number
+        elif isinstance(element, parser.Replace) and element.name in state:
+            # A Replace block gives the whole content, so later blocks can be
+            # checked against it even if earlier blocks failed.
+            broken_names.discard(element.name)
+        elif getattr(element, "name", None) in broken_names:
+            result.append(empty)
+            continue
+
+        if isinstance(element, parser.Output):
+            try:
+                code = _lookup(state, element, line_number=line_number)
+                code.raise_if_pending(operation="render output", line_number=line_number)
+            except PendingLinesError as error:
+                if not keep_going:
+                    raise
+
+                errors.append((line_number, error))
+                # Treat the pending lines as rendered so that the output can
+                # still be checked.
+                code = code.render_content()
+                state = {**state, element.name: code}
+            except ValueError as error:
+                if not keep_going:
+                    raise
+
+                errors.append((line_number, error))
+                broken_names.add(element.name)
+                result.append(empty)
+                continue
+
+            deferred_outputs.append(_DeferredOutput(
+                index=len(result),
+                line_number=line_number,
+                element=element,
+                code=code,
+                start_line_number=start_line_numbers.get(element.name),
+            ))
+            result.append(None)
+            continue
+
+        try:
+            state, transformed_element = _execute(
+                state,
+                element,
+                line_number=line_number,
+                context=context,
+                check_include_outputs=False,
+            )
+        except ValueError as error:
+            if not keep_going:
+                raise
+
+            errors.append((line_number, error))
+            state, transformed_element = _recover(
+                state,
+                element,
+                line_number=line_number,
+                errors=errors,
+                broken_names=broken_names,
+                context=context,
+            )
+        else:
+            if isinstance(element, parser.Include):
+                deferred_includes.append((len(result), line_number, element))
+
         result.append(transformed_element)
 
-    return tuple(result)
+    if not check_outputs:
+        for deferred_output in deferred_outputs:
+            result[deferred_output.index] = _output_element(deferred_output.element)
+        return tuple(result), state
+
+    for index, line_number, element in deferred_includes:
+        try:
+            context.includes.load(element.path, line_number=line_number, context=context)
+        except ValueError as error:
+            if not keep_going:
+                raise
+
+            errors.append((line_number, error))
+            result[index] = empty
+
+    outcomes_by_interpreter = _run_deferred_outputs(deferred_outputs, context=context, keep_going=keep_going)
+
+    for index, deferred_output in enumerate(deferred_outputs):
+        output_errors = []
+        for interpreter, outcomes in zip(context.interpreters, outcomes_by_interpreter):
+            outcome = outcomes[index]
+            # Outcomes are missing when an interpreter stopped after an
+            # earlier error.
+            if outcome is not None:
+                try:
+                    _report_outcome(deferred_output.element, deferred_output.line_number, interpreter, outcome, context)
+                except ValueError as error:
+                    output_errors.append(error)
+
+        if output_errors:
+            if not keep_going:
+                if len(output_errors) == 1:
+                    raise output_errors[0]
+                else:
+                    raise CompileError(output_errors)
+
+            errors += [(deferred_output.line_number, error) for error in output_errors]
+            result[deferred_output.index] = empty
+        else:
+            result[deferred_output.index] = _output_element(deferred_output.element)
+
+    if errors:
+        raise CompileError([
+            error
+            for line_number, error in sorted(errors, key=lambda error: error[0])
+        ])
+
+    return tuple(result), state
+
+
+class _DeferredOutput(object):
+    def __init__(self, index, line_number, element, code, start_line_number):
+        self.index = index
+        self.line_number = line_number
+        self.element = element
+        self.code = code
+        self.start_line_number = start_line_number
+
+
+def _run_deferred_outputs(deferred_outputs, context, keep_going):
+    """
+    Runs the programs for Output blocks on each interpreter. Interpreters run
+    concurrently, and each interpreter runs its programs in document order so
+    that sessions only ever see code being appended.
+
+    Returns the outcomes for each interpreter, in the same order as the
+    deferred outputs.
+    """
+    if len(context.interpreters) == 1:
+        interpreter, = context.interpreters
+        return [_run_deferred_outputs_on_interpreter(
+            deferred_outputs,
+            interpreter=interpreter,
+            context=context,
+            keep_going=keep_going,
+        )]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(context.interpreters)) as executor:
+        futures = [
+            executor.submit(
+                _run_deferred_outputs_on_interpreter,
+                deferred_outputs,
+                interpreter=interpreter,
+                context=context,
+                keep_going=keep_going,
+            )
+            for interpreter in context.interpreters
+        ]
+        return [future.result() for future in futures]
+
+
+def _run_deferred_outputs_on_interpreter(deferred_outputs, interpreter, context, keep_going):
+    outcomes = [None] * len(deferred_outputs)
+    # Output blocks for the same code and output only need to be run once.
+    previous_outcomes = {}
+    session_start_line_numbers = {}
+
+    for index, deferred_output in enumerate(deferred_outputs):
+        element = deferred_output.element
+        # A new Start block for a name begins a new program, so it needs a new
+        # session.
+        start_line_number = deferred_output.start_line_number
+        if session_start_line_numbers.setdefault(element.name, start_line_number) != start_line_number:
+            context.end_session(element.name, interpreter=interpreter)
+            session_start_line_numbers[element.name] = start_line_number
+
+        code = deferred_output.code
+        # Tracebacks show the line number of the block when there's a source
+        # name, so the output then depends on it.
+        key = (
+            code.path,
+            tuple(sorted(code.files.items())),
+            code.content_key,
+            element.content,
+            context.filename(deferred_output.line_number),
+        )
+        previous_outcome = previous_outcomes.get(key)
+        if previous_outcome is None:
+            outcome = previous_outcomes[key] = _run_program(
+                code,
+                element,
+                deferred_output.line_number,
+                interpreter,
+                context,
+            )
+        else:
+            outcome = _Outcome(result=previous_outcome.result, error=previous_outcome.error, is_repeat=True)
+        outcomes[index] = outcome
+
+        if not keep_going and not outcome.is_success:
+            break
+
+    return outcomes
+
+
+class _Outcome(object):
+    def __init__(self, result=None, error=None, is_repeat=False):
+        self.result = result
+        self.error = error
+        self.is_repeat = is_repeat
+
+    @property
+    def is_success(self):
+        return self.error is None and self.result.matches
+
+
+class _Context(object):
+    def __init__(
+        self,
+        runner=None,
+        metrics=None,
+        profile=None,
+        includes=None,
+        interpreters=None,
+        use_sessions=False,
+        lockfile=None,
+        source_name=None,
+    ):
+        if runner is None:
+            runner = execution.Runner()
+        if metrics is None:
+            metrics = Metrics()
+        if not interpreters:
+            interpreters = execution.default_interpreters
+
+        self.runner = runner
+        self.metrics = metrics
+        self.profile = profile
+        self.includes = includes
+        self.interpreters = tuple(interpreters)
+        self.lockfile = lockfile
+        self.source_name = source_name
+        self.workspace = Workspace()
+        # Stored contents outlive the context, since they're part of the
+        # states it returns.
+        self.content_store = ContentStore()
+        # Sessions are only used when compiling a whole source, since a
+        # session is only useful for a name with more than one Output block.
+        self._sessions = {} if use_sessions else None
+
+    def filename(self, line_number):
+        """
+        Returns the filename shown in tracebacks for a program given as
+        source: the source name and the line number of the block that ran it,
+        or None for the default of ``<string>``.
+        """
+        if self.source_name is None:
+            return None
+        else:
+            return "{}:{}".format(self.source_name, line_number)
+
+    def run(self, name, code, expected_output, interpreter, line_number):
+        filename = self.filename(line_number)
+
+        # Sessions run code as source, so only support single files.
+        if code.session and code.path is None and self._sessions is not None:
+            session = self._sessions.get((interpreter, name))
+            if session is None:
+                session = self._sessions[(interpreter, name)] = self.runner.start_session(interpreter=interpreter)
+            return session.run(code.content, expected_output=expected_output, filename=filename)
+        else:
+            return code.run(
+                self.runner,
+                expected_output=expected_output,
+                interpreter=interpreter,
+                workspace=self.workspace,
+                filename=filename,
+            )
+
+    def end_session(self, name, interpreter):
+        if self._sessions is not None:
+            session = self._sessions.pop((interpreter, name), None)
+            if session is not None:
+                session.close()
+
+    def close(self):
+        if self._sessions is not None:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+        self.workspace.close()
+
+
+def _recover(state, element, line_number, errors, broken_names, context):
+    error = errors[-1][1]
+    if isinstance(error, PendingLinesError):
+        # Treat the pending lines as rendered so that the block itself can
+        # still be checked.
+        state = {**state, element.name: state[element.name].render_content()}
+        try:
+            return _execute(
+                state,
+                element,
+                line_number=line_number,
+                context=context,
+            )
+        except ValueError as retry_error:
+            errors.append((line_number, retry_error))
+
+    if isinstance(element, (parser.Diff, parser.Replace)):
+        broken_names.add(element.name)
+    elif isinstance(element, parser.Include) and context.includes is not None:
+        broken_names.update(context.includes.started_names(element.path))
+
+    return state, empty
+
+
+def _lookup(state, element, line_number):
+    try:
+        return state[element.name]
+    except KeyError:
+        raise ValueError("unknown name {} on line number {}, there is no earlier start block for it".format(
+            element.name,
+            line_number,
+        ))
+
+
+class CompileError(ValueError):
+    def __init__(self, errors):
+        super().__init__("{} errors:\n\n{}".format(
+            len(errors),
+            "\n\n".join(str(error) for error in errors),
+        ))
+        self.errors = errors
+
+
+class PendingLinesError(ValueError):
+    pass
 
 
 def convert_block(source, line_number, block_type):
@@ -23,42 +477,172 @@ def convert_block(source, line_number, block_type):
         if element_line_number < line_number:
             state, transformed_element = _execute(state, element, line_number=element_line_number)
         elif element_line_number == line_number:
-            if isinstance(element, parser.Diff) and block_type == "replace":
-                state, transformed_element = _execute(state, element, line_number=element_line_number)
-                element = parser.Replace(
-                    name=element.name,
-                    render=element.render,
-                    content=state[element.name].content,
-                )
-            elif isinstance(element, parser.Replace) and block_type == "diff":
-                diff = generate_diff(
-                    state[element.name].content,
-                    element.content,
-                )
-                element = parser.Diff(
-                    name=element.name,
-                    render=element.render,
-                    content=diff,
-                )
-            else:
-                # TODO: raise a better exception
-                raise Exception("cannot convert from {} to {}".format(type(element), block_type))
+            element = convert_element(state, element, line_number=element_line_number, block_type=block_type)
 
         # TODO: raise error if element not found
         result.append(element)
 
     return tuple(result)
 
-def _execute(state, element, line_number):
+
+def convert_element(state, element, line_number, block_type):
+    """
+    Converts a Diff element to a Replace element or vice versa, given the
+    state before the element.
+    """
+    if isinstance(element, parser.Diff) and block_type == "replace":
+        new_state, transformed_element = _execute(state, element, line_number=line_number)
+        # A Replace block only gives the content of the file that's run.
+        old_files = state[element.name].files
+        new_files = new_state[element.name].files
+        changed_paths = sorted(
+            path
+            for path in set(old_files) | set(new_files)
+            if old_files.get(path) != new_files.get(path)
+        )
+        if changed_paths:
+            raise ValueError("cannot convert diff on line number {} to replace, diff changes other files: {}".format(
+                line_number,
+                ", ".join(changed_paths),
+            ))
+        return parser.Replace(
+            name=element.name,
+            render=element.render,
+            content=new_state[element.name].content,
+        )
+    elif isinstance(element, parser.Replace) and block_type == "diff":
+        code = state[element.name]
+        diff = generate_diff(
+            code.content,
+            element.content,
+            path=code.path,
+        )
+        return parser.Diff(
+            name=element.name,
+            render=element.render,
+            content=diff,
+        )
+    else:
+        # TODO: raise a better exception
+        raise Exception("cannot convert from {} to {}".format(type(element), block_type))
+
+
+class Replay(object):
+    """
+    Replays the state transitions of a source up to a given line without
+    running any programs, so that a single element can be checked on its own.
+    Replaying continues from the last position when lines are requested in
+    order. Included sources are loaded from the includes, if given.
+    """
+
+    def __init__(self, source, includes=None):
+        self._source = tuple(source)
+        self._includes = includes
+        self._elements = dict(self._source)
+        self._index = 0
+        self._state = {}
+
+    def element_at(self, line_number):
+        element = self._elements.get(line_number)
+        if element is None:
+            raise ValueError("no element on line number {}".format(line_number))
+        return element
+
+    def state_before(self, line_number):
+        if self._index > 0 and self._source[self._index - 1][0] >= line_number:
+            self._index = 0
+            self._state = {}
+
+        while self._index < len(self._source) and self._source[self._index][0] < line_number:
+            element_line_number, element = self._source[self._index]
+            self._state = transition(
+                self._state,
+                element,
+                line_number=element_line_number,
+                includes=self._includes,
+            )
+            self._index += 1
+
+        return self._state
+
+    def execute(self, line_number, runner=None):
+        state = self.state_before(line_number)
+        return execute(state, self.element_at(line_number), line_number=line_number, runner=runner)
+
+
+def execute(state, element, line_number, runner=None):
+    """
+    Executes a single element, returning the new state and the rst element
+    to output.
+    """
+    context = _Context(runner=runner)
+    try:
+        return _execute(state, element, line_number=line_number, context=context)
+    finally:
+        context.close()
+
+
+def transition(state, element, line_number, includes=None):
+    """
+    Returns the state after an element without running any programs.
+    """
+    if isinstance(element, parser.Output):
+        return state
+    else:
+        new_state, _ = _execute(
+            state,
+            element,
+            line_number=line_number,
+            context=_Context(includes=includes),
+            check_include_outputs=False,
+        )
+        return new_state
+
+
+def _execute(state, element, line_number, context=None, check_include_outputs=True):
+    if context is None:
+        context = _Context()
+
     if isinstance(element, parser.Text):
         return state, element
 
+    elif isinstance(element, parser.Include):
+        if context.includes is None:
+            raise ValueError("cannot include {} on line number {}, includes are not enabled".format(
+                element.path,
+                line_number,
+            ))
+
+        included = context.includes.load(
+            element.path,
+            line_number=line_number,
+            context=context,
+            check_outputs=check_include_outputs,
+        )
+
+        if element.render:
+            new_element = rst.Text(included.output)
+        else:
+            new_element = empty
+
+        new_state = {
+            **state,
+            **included.state,
+        }
+
+        return new_state, new_element
+
     elif isinstance(element, parser.Diff):
-        old_code = state[element.name]
+        old_code = _lookup(state, element, line_number=line_number)
         old_code.raise_if_pending(operation="apply diff", line_number=line_number)
 
         try:
-            code = old_code.patch(element.content)
+            with context.metrics.time("patch_seconds"):
+                code = old_code.patch(element.content)
+        except ValueError as error:
+            # Includes PatchError, and errors in the file headers of a patch
+            # for code with files.
+            raise ValueError("cannot apply diff on line number {}, {}".format(line_number, error))
         except:
             raise ValueError("cannot apply diff on line number {}, invalid patch".format(line_number))
 
@@ -76,32 +660,18 @@ def _execute(state, element, line_number):
         return new_state, new_element
 
     elif isinstance(element, parser.Output):
-        code = state[element.name]
+        code = _lookup(state, element, line_number=line_number)
         code.raise_if_pending(operation="render output", line_number=line_number)
 
-        result = code.run()
-        actual_output = result.stdout.decode("utf-8")
-        if actual_output.strip() != element.content.strip():
-            raise ValueError("output on line number {} is incorrect\nDocumented output:\n{}\nActual output:\n{}".format(
-                line_number,
-                element.content,
-                actual_output,
-            ))
-
-        if element.render:
-            new_element = rst.LiteralBlock(element.content)
-        else:
-            new_element = empty
-
-        return state, new_element
+        return state, _run_output(code, element, line_number=line_number, context=context)
 
     elif isinstance(element, parser.Render):
-        code = state[element.name]
+        code = _lookup(state, element, line_number=line_number)
 
-        content_lines = frozenset(line.lstrip() for line in code.content.splitlines())
         rendered_lines = element.content.splitlines()
+        line_index = code.line_index.snapshot()
         for rendered_line in rendered_lines:
-            if rendered_line.lstrip() not in content_lines:
+            if not line_index.contains_ignoring_indentation(rendered_line):
                 raise ValueError("cannot render on line number {}, line is not in content:\n{}".format(
                     line_number,
                     rendered_line,
@@ -118,7 +688,7 @@ def _execute(state, element, line_number):
         )
 
     elif isinstance(element, parser.Replace):
-        old_code = state[element.name]
+        old_code = _lookup(state, element, line_number=line_number)
         old_code.raise_if_pending(operation="replace", line_number=line_number)
 
         code = old_code.replace(element.content)
@@ -140,7 +710,17 @@ def _execute(state, element, line_number):
         return new_state, new_element
 
     elif isinstance(element, parser.Start):
-        code = Code.blank(language=element.language).replace(element.content)
+        if element.path is None:
+            path = None
+        else:
+            path = check_path(element.path)
+        code = Code.blank(
+            language=element.language,
+            session=element.session,
+            path=path,
+            subinterpreter=element.subinterpreter,
+            store=context.content_store,
+        ).replace(element.content)
 
         if element.render:
             code = code.render_content()
@@ -162,15 +742,187 @@ def _execute(state, element, line_number):
         raise Exception("Unhandled element: {}".format(element))
 
 
+def _run_output(code, element, line_number, context):
+    interpreter = context.interpreters[0]
+    outcome = _run_program(code, element, line_number, interpreter, context)
+    _report_outcome(element, line_number, interpreter, outcome, context)
+    return _output_element(element)
+
+
+def _run_program(code, element, line_number, interpreter, context):
+    lockfile = context.lockfile
+    filename = context.filename(line_number)
+    if lockfile is not None and lockfile.frozen:
+        if lockfile.contains(code, interpreter=interpreter, expected_output=element.content, filename=filename):
+            # Nothing was run, so there are no resources to report.
+            return _Outcome(result=_recorded_result, is_repeat=True)
+        else:
+            return _Outcome(error="program or output has changed since the lockfile was recorded")
+
+    try:
+        result = context.run(
+            element.name,
+            code,
+            expected_output=element.content,
+            interpreter=interpreter,
+            line_number=line_number,
+        )
+    except execution.OutputTooLargeError as error:
+        return _Outcome(error=error)
+
+    if lockfile is not None and result.matches:
+        lockfile.record(code, interpreter=interpreter, expected_output=element.content, filename=filename)
+    return _Outcome(result=result)
+
+
+_recorded_result = execution.ExecutionResult(
+    matches=True,
+    documented_output=None,
+    actual_output=None,
+    output_size=0,
+    resources=None,
+)
+
+
+def _report_outcome(element, line_number, interpreter, outcome, context):
+    if len(context.interpreters) == 1:
+        incorrect_message = "output on line number {} is incorrect".format(line_number)
+        profile_name = element.name
+    else:
+        incorrect_message = "output on line number {} is incorrect with {}".format(line_number, interpreter)
+        profile_name = "{}, {}".format(element.name, interpreter)
+
+    if outcome.error is not None:
+        raise ValueError("{}, {}".format(incorrect_message, outcome.error))
+
+    result = outcome.result
+    if not outcome.is_repeat:
+        context.metrics.observe("program_run_seconds", result.resources.wall_time)
+        context.metrics.observe("program_output_bytes", result.output_size)
+        if result.resources.user_time is not None:
+            context.metrics.observe("program_cpu_seconds", result.resources.user_time + result.resources.system_time)
+        if result.resources.max_rss is not None:
+            context.metrics.observe("program_max_rss_bytes", result.resources.max_rss)
+        if context.profile is not None:
+            context.profile.record(
+                line_number=line_number,
+                name=profile_name,
+                resources=result.resources,
+                output_size=result.output_size,
+            )
+
+    if not result.matches:
+        raise ValueError("{}\nDocumented output:\n{}\nActual output:\n{}".format(
+            incorrect_message,
+            result.documented_output,
+            result.actual_output,
+        ))
+
+
+def _output_element(element):
+    if element.render:
+        return rst.LiteralBlock(element.content)
+    else:
+        return empty
+
+
 class Code(object):
+    """
+    The state of the code for a name. By default, the code is a single
+    program. If the code has a path, it's a tree of files: the content is
+    the content of the file at that path, which is the file that's run, and
+    the other files are in ``files``. Each state shares the content of
+    unchanged files with the previous state.
+
+    If the code has a content store, content larger than its spill size is
+    held in the store rather than in memory, and the lines of that content
+    are indexed when they're needed rather than for each state.
+    """
+
     @staticmethod
-    def blank(language):
-        return Code(language=language, content="", pending_lines=())
+    def blank(language, session=False, path=None, subinterpreter=False, store=None):
+        return Code(
+            language=language,
+            content="",
+            pending_lines=(),
+            session=session,
+            path=path,
+            subinterpreter=subinterpreter,
+            store=store,
+        )
+
+    def __init__(
+        self,
+        language,
+        content,
+        pending_lines,
+        line_index=None,
+        session=False,
+        path=None,
+        files=None,
+        subinterpreter=False,
+        store=None,
+    ):
+        if files is None:
+            files = {}
+
+        if store is not None and isinstance(content, str) and store.should_spill(content):
+            content = store.put(content)
+            line_index = None
+
+        if line_index is None:
+            if isinstance(content, StoredContent):
+                line_index = _StoredLineIndex(content, files)
+            else:
+                line_index = _LineIndex.from_lines(_all_lines(content.splitlines(), files))
+
+        if not isinstance(pending_lines, _PendingLines):
+            pending_lines = _PendingLines.of(pending_lines)
 
-    def __init__(self, language, content, pending_lines):
         self.language = language
-        self.content = content
-        self.pending_lines = pending_lines
+        self.line_index = line_index
+        self.session = session
+        self.path = path
+        self.files = files
+        self.subinterpreter = subinterpreter
+        self._content = content
+        self._store = store
+        self._pending_lines = pending_lines
+
+    @property
+    def content(self):
+        if isinstance(self._content, StoredContent):
+            return self._content.read()
+        else:
+            return self._content
+
+    @property
+    def content_key(self):
+        """
+        A key that's equal for equal contents, without reading stored content.
+        """
+        if isinstance(self._content, StoredContent):
+            return (StoredContent, self._content.digest)
+        else:
+            return self._content
+
+    def content_chunks(self):
+        """
+        Returns the content in chunks, so that stored content isn't read into
+        memory all at once.
+        """
+        if isinstance(self._content, StoredContent):
+            return self._content
+        else:
+            return (self._content, )
+
+    @property
+    def all_files(self):
+        return {**self.files, self.path: self.content}
+
+    @property
+    def pending_lines(self):
+        return self._pending_lines.evaluate()
 
     def raise_if_pending(self, operation, line_number):
         if self.pending_lines:
@@ -178,23 +930,104 @@ class Code(object):
                 "\n" + pending_line
                 for pending_line in self.pending_lines
             )
-            raise ValueError("cannot {} on line number {}, pending lines:{}".format(
+            raise PendingLinesError("cannot {} on line number {}, pending lines:{}".format(
                 operation,
                 line_number,
                 pending_lines_str,
             ))
 
     def patch(self, patch):
-        return self.replace(apply_patch(self.content, patch))
+        if self.path is None:
+            new_content = apply_patch(self._content, patch)
+            new_files = self.files
+        else:
+            new_content, new_files = self._patch_files(patch)
+
+        removed_lines = []
+        added_lines = []
+        for hunk in read_hunks(patch):
+            removed_lines += hunk.removed_lines
+            added_lines += hunk.added_lines
+
+        line_index = self.line_index.update(removed_lines=removed_lines, added_lines=added_lines)
+        if line_index is None:
+            return self._replace(new_content, new_files)
+
+        return Code(
+            language=self.language,
+            content=new_content,
+            pending_lines=_PendingLines(candidates=added_lines, old_line_index=self.line_index),
+            line_index=line_index,
+            session=self.session,
+            path=self.path,
+            files=new_files,
+            subinterpreter=self.subinterpreter,
+            store=self._store,
+        )
+
+    def _patch_files(self, patch):
+        file_patches = read_file_patches(patch)
+        if not file_patches:
+            raise ValueError("patch has no file headers")
+
+        files = self.all_files
+        for file_patch in file_patches:
+            if not file_patch.path:
+                raise ValueError("file header has no path, expected headers such as --- a/{0} and +++ b/{0}".format(
+                    self.path,
+                ))
+            try:
+                path = check_path(file_patch.path)
+            except ValueError as error:
+                raise ValueError("file header has {}".format(error))
+
+            if not file_patch.is_creation and path not in files:
+                raise ValueError("file does not exist: {}".format(path))
+
+            if file_patch.is_deletion:
+                if path == self.path:
+                    raise ValueError("cannot delete file that is run: {}".format(path))
+                del files[path]
+            else:
+                if file_patch.is_creation:
+                    if path in files:
+                        raise ValueError("file already exists: {}".format(path))
+                    old_content = ""
+                else:
+                    old_content = files[path]
+
+                try:
+                    files[path] = apply_patch(old_content, file_patch.patch)
+                except PatchError as error:
+                    raise error.for_path(path)
+
+        new_content = files.pop(self.path)
+        return new_content, files
 
     def replace(self, new_content):
-        old_lines = self.content.splitlines()
-        new_lines = new_content.splitlines()
-        pending_lines = tuple(filter(
-            lambda new_line: new_line not in old_lines,
-            new_lines,
-        ))
-        return Code(language=self.language, content=new_content, pending_lines=pending_lines)
+        return self._replace(new_content, self.files)
+
+    def _replace(self, new_content, new_files):
+        if self._store is not None and self._store.should_spill(new_content):
+            new_content = self._store.put(new_content)
+            new_lines = new_content.lines()
+            line_index = None
+        else:
+            # The lines are split once for both the pending lines and the index.
+            new_lines = new_content.splitlines()
+            line_index = _LineIndex.from_lines(_all_lines(new_lines, new_files))
+
+        return Code(
+            language=self.language,
+            content=new_content,
+            pending_lines=_PendingLines(candidates=new_lines, old_line_index=self.line_index),
+            line_index=line_index,
+            session=self.session,
+            path=self.path,
+            files=new_files,
+            subinterpreter=self.subinterpreter,
+            store=self._store,
+        )
 
     def render(self, rendered_content):
         # TODO: remove duplication with logic in Render handling
@@ -202,17 +1035,191 @@ class Code(object):
             rendered_line.lstrip()
             for rendered_line in rendered_content.splitlines()
         )
-        new_pending_lines = tuple(filter(
-            lambda pending_line: pending_line.lstrip() not in rendered_lines,
-            self.pending_lines,
-        ))
-        return Code(language=self.language, content=self.content, pending_lines=new_pending_lines)
+        return self._with_pending_lines(self._pending_lines.render(rendered_lines.__contains__))
 
     def render_content(self):
-        return self.render(self.content)
+        line_index = self.line_index.snapshot()
+        pending_lines = self._pending_lines.render(line_index.contains_ignoring_indentation)
+        if line_index is not self.line_index:
+            # Evaluate the pending lines now, rather than keeping the
+            # snapshot of stored content until they're needed.
+            pending_lines.evaluate()
+        return self._with_pending_lines(pending_lines)
+
+    def _with_pending_lines(self, pending_lines):
+        return Code(
+            language=self.language,
+            content=self._content,
+            pending_lines=pending_lines,
+            line_index=self.line_index,
+            session=self.session,
+            path=self.path,
+            files=self.files,
+            subinterpreter=self.subinterpreter,
+            store=self._store,
+        )
+
+    def run(self, runner, expected_output, interpreter="python", workspace=None, filename=None):
+        if self.path is None:
+            return runner.run_source(
+                interpreter,
+                self.content,
+                expected_output=expected_output,
+                filename=filename,
+                subinterpreter=self.subinterpreter,
+            )
+
+        with workspace.materialise(self.all_files) as directory:
+            return runner.run([interpreter, self.path], expected_output=expected_output, cwd=directory)
+
+
+def _all_lines(lines, files):
+    if not files:
+        return lines
+
+    lines = list(lines)
+    for file_content in files.values():
+        lines += file_content.splitlines()
+    return lines
+
+
+class _LineIndex(object):
+    """
+    Multisets of the lines in some content, both exactly and with leading
+    whitespace removed, so that membership tests don't need to rescan the
+    content.
+    """
+
+    @staticmethod
+    def from_lines(lines):
+        return _LineIndex(
+            lines=collections.Counter(lines),
+            stripped_lines=collections.Counter(line.lstrip() for line in lines),
+        )
+
+    def __init__(self, lines, stripped_lines):
+        self._lines = lines
+        self._stripped_lines = stripped_lines
+
+    def snapshot(self):
+        return self
+
+    def __contains__(self, line):
+        return line in self._lines
+
+    def contains_ignoring_indentation(self, line):
+        return line.lstrip() in self._stripped_lines
+
+    def update(self, removed_lines, added_lines):
+        """
+        Returns a new index with the given lines removed and added, or None if
+        a removed line isn't in this index.
+        """
+        lines = self._lines.copy()
+        stripped_lines = self._stripped_lines.copy()
+
+        for line in removed_lines:
+            if not _counter_remove(lines, line):
+                return None
+            _counter_remove(stripped_lines, line.lstrip())
+
+        for line in added_lines:
+            lines[line] += 1
+            stripped_lines[line.lstrip()] += 1
+
+        return _LineIndex(lines=lines, stripped_lines=stripped_lines)
+
+
+class _StoredLineIndex(object):
+    """
+    The lines of stored content, which are only indexed when they're needed,
+    so that an index isn't held in memory for each state. Use ``snapshot()``
+    to index the lines once for many membership tests.
+    """
+
+    def __init__(self, content, files):
+        self._content = content
+        self._files = files
+
+    def snapshot(self):
+        lines = list(self._content.lines())
+        for file_content in self._files.values():
+            lines += file_content.splitlines()
+        return _LineIndex.from_lines(lines)
+
+    def __contains__(self, line):
+        return line in self.snapshot()
+
+    def contains_ignoring_indentation(self, line):
+        return self.snapshot().contains_ignoring_indentation(line)
+
+    def update(self, removed_lines, added_lines):
+        # Indexing the new content is no cheaper than updating this index.
+        return None
+
+
+def _counter_remove(counter, key):
+    count = counter.get(key, 0)
+    if count == 0:
+        return False
+    elif count == 1:
+        del counter[key]
+    else:
+        counter[key] = count - 1
+    return True
+
+
+class _PendingLines(object):
+    """
+    Pending lines are the candidate lines that weren't in the old content,
+    excluding any lines that have since been rendered. They're only computed
+    when they're asked for.
+    """
+
+    @staticmethod
+    def of(lines):
+        return _PendingLines(candidates=tuple(lines), old_line_index=_empty_line_index, renders=())
+
+    def __init__(self, candidates, old_line_index, renders=()):
+        self._candidates = candidates
+        self._old_line_index = old_line_index
+        self._renders = renders
+        self._lines = None
+
+    def render(self, is_rendered):
+        if not self._candidates:
+            return self
+        elif self._lines is not None:
+            return _PendingLines.of(
+                line
+                for line in self._lines
+                if not is_rendered(line.lstrip())
+            )
+        return _PendingLines(
+            candidates=self._candidates,
+            old_line_index=self._old_line_index,
+            renders=self._renders + (is_rendered, ),
+        )
+
+    def evaluate(self):
+        if self._lines is None:
+            old_line_index = self._old_line_index.snapshot()
+            self._lines = tuple(
+                line
+                for line in self._candidates
+                if line not in old_line_index and not any(
+                    is_rendered(line.lstrip())
+                    for is_rendered in self._renders
+                )
+            )
+            # The old content is no longer needed once the lines are known.
+            self._candidates = self._lines
+            self._old_line_index = None
+            self._renders = ()
+        return self._lines
+
 
-    def run(self):
-        return subprocess.run(["python", "-c", self.content], stderr=subprocess.STDOUT, stdout=subprocess.PIPE)
+_empty_line_index = _LineIndex.from_lines(())
 
 
 empty = parser.Text("")
@@ -0,0 +1,181 @@
+import bisect
+import codecs
+import collections
+import hashlib
+import mmap
+import tempfile
+import threading
+import weakref
+
+
+class ContentStore(object):
+    """
+    Stores contents larger than the spill size in a temporary file, so that
+    large code states are held on disk rather than in memory. Stored contents
+    are read through a memory map of the file, either in full, in chunks, or
+    a line at a time.
+
+    Once a stored content is no longer used, its space in the file is reused
+    for later contents, and the file is truncated if the space is at the end.
+    The file is removed once the store and all of its contents are no longer
+    used.
+    """
+
+    def __init__(self, spill_size=None):
+        if spill_size is None:
+            spill_size = default_spill_size
+
+        self.spill_size = spill_size
+        self._fileobj = None
+        self._size = 0
+        self._mapping = None
+        # Sorted (offset, length) pairs of space in the file that's no longer
+        # used.
+        self._free_regions = []
+        # Regions are freed when a content is garbage collected, which can
+        # happen while the lock is held, so they're queued rather than freed
+        # straight away.
+        self._released_regions = collections.deque()
+        # Contents are read from the threads running programs for each
+        # interpreter.
+        self._lock = threading.Lock()
+
+    def should_spill(self, content):
+        return len(content) > self.spill_size
+
+    @property
+    def file_size(self):
+        return self._size
+
+    def put(self, content):
+        encoded_content = content.encode("utf-8")
+        digest = hashlib.sha256(encoded_content).hexdigest()
+
+        with self._lock:
+            if self._fileobj is None:
+                self._fileobj = tempfile.TemporaryFile(prefix="diffdoc-content-")
+
+            # The mapping is remapped on the next read, since the file might
+            # be truncated or extended.
+            if self._mapping is not None:
+                self._mapping.close()
+                self._mapping = None
+
+            self._free_released_regions()
+            offset = self._allocate(len(encoded_content))
+            self._fileobj.seek(offset)
+            self._fileobj.write(encoded_content)
+            self._fileobj.flush()
+
+        stored_content = StoredContent(self, offset=offset, length=len(encoded_content), digest=digest)
+        weakref.finalize(stored_content, self._released_regions.append, (offset, len(encoded_content)))
+        return stored_content
+
+    def _allocate(self, length):
+        for index, (offset, free_length) in enumerate(self._free_regions):
+            if free_length >= length:
+                if free_length == length:
+                    del self._free_regions[index]
+                else:
+                    self._free_regions[index] = (offset + length, free_length - length)
+                return offset
+
+        offset = self._size
+        self._size += length
+        return offset
+
+    def _free_released_regions(self):
+        while self._released_regions:
+            offset, length = self._released_regions.popleft()
+            index = bisect.bisect(self._free_regions, (offset, length))
+            # Merge with the neighbouring free regions.
+            if index < len(self._free_regions) and self._free_regions[index][0] == offset + length:
+                length += self._free_regions.pop(index)[1]
+            if index > 0 and sum(self._free_regions[index - 1]) == offset:
+                index -= 1
+                previous_offset, previous_length = self._free_regions.pop(index)
+                offset, length = previous_offset, previous_length + length
+            self._free_regions.insert(index, (offset, length))
+
+        if self._free_regions and sum(self._free_regions[-1]) == self._size:
+            self._size, _ = self._free_regions.pop()
+            self._fileobj.truncate(self._size)
+
+    def _read(self, offset, length):
+        with self._lock:
+            if self._mapping is None:
+                self._mapping = mmap.mmap(self._fileobj.fileno(), self._size, access=mmap.ACCESS_READ)
+            return self._mapping[offset:offset + length]
+
+
+default_spill_size = 1024 * 1024
+
+
+class StoredContent(object):
+    """
+    A content held in a content store. Iterating over a stored content gives
+    its text in chunks, without reading all of it into memory at once. The
+    digest is a hash of the content, for comparing contents without reading
+    them.
+    """
+
+    def __init__(self, store, offset, length, digest):
+        self._store = store
+        self._offset = offset
+        self._length = length
+        self.digest = digest
+
+    def read(self):
+        return self._store._read(self._offset, self._length).decode("utf-8")
+
+    def lines(self):
+        return StoredLines(self)
+
+    def __iter__(self):
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        for chunk in self._chunks():
+            text = decoder.decode(chunk)
+            if text:
+                yield text
+
+        text = decoder.decode(b"", final=True)
+        if text:
+            yield text
+
+    def _chunks(self):
+        for chunk_offset in range(0, self._length, _chunk_size):
+            yield self._store._read(
+                self._offset + chunk_offset,
+                min(_chunk_size, self._length - chunk_offset),
+            )
+
+
+_chunk_size = 1024 * 1024
+
+
+class StoredLines(object):
+    """
+    The lines of stored content, split in the same way as ``str.splitlines``.
+    Lines are read from the store each time they're iterated over, rather
+    than being held in memory.
+    """
+
+    def __init__(self, content):
+        self._content = content
+
+    def __bool__(self):
+        return self._content._length > 0
+
+    def __iter__(self):
+        remainder = ""
+
+        for text in self._content:
+            lines = (remainder + text).splitlines(keepends=True)
+            # The last line might continue in the next chunk, including a
+            # "\r" that's followed by "\n".
+            remainder = lines.pop() if lines else ""
+            for line in lines:
+                yield line.splitlines()[0]
+
+        for line in remainder.splitlines():
+            yield line
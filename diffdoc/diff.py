@@ -1,28 +1,335 @@
+import collections
 import difflib
+import re
 import subprocess
 import tempfile
 
 
-def generate_diff(old, new):
+def generate_diff(old, new, path=None):
+    """
+    Generates a diff between two contents. If a path is given, the diff has
+    file headers for that path, so that it can be applied to code with files.
+    """
     diff = tuple(difflib.unified_diff(
         old.splitlines(keepends=True),
         new.splitlines(keepends=True),
     ))
     assert diff[0].startswith("---")
     assert diff[1].startswith("+++")
-    return "---\n+++\n" + "".join(diff[2:])
+    if path is None:
+        headers = "---\n+++\n"
+    else:
+        headers = "--- a/{0}\n+++ b/{0}\n".format(path)
+    return headers + "".join(diff[2:])
 
 
 def apply_patch(old, patch):
+    """
+    Applies a patch to some content. The content is either a string, or an
+    iterable of chunks of the content that can be iterated over more than
+    once, so that large content can be patched without reading it all.
+    """
     with tempfile.NamedTemporaryFile("w+t") as content_fileobj:
-        content_fileobj.write(old)
+        if isinstance(old, str):
+            content_fileobj.write(old)
+        else:
+            for chunk in old:
+                content_fileobj.write(chunk)
         content_fileobj.flush()
 
         with tempfile.NamedTemporaryFile("w+t") as patch_fileobj:
             patch_fileobj.write(patch)
             patch_fileobj.flush()
 
-            subprocess.run(["patch", content_fileobj.name, patch_fileobj.name, "--quiet"], check=True)
+            result = subprocess.run(
+                [
+                    "patch", content_fileobj.name, patch_fileobj.name,
+                    "--quiet", "--reject-file=-", "--no-backup-if-mismatch",
+                ],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+            )
+            if result.returncode != 0:
+                if not isinstance(old, str):
+                    old = "".join(old)
+                raise PatchError(describe_failure(old, patch))
 
         with open(content_fileobj.name, "rt") as new_content_fileobj:
             return new_content_fileobj.read()
+
+
+class PatchError(ValueError):
+    def __init__(self, hunk_descriptions, path=None):
+        if path is None:
+            message = "invalid patch"
+        else:
+            message = "invalid patch for {}".format(path)
+        super().__init__("\n".join([message] + list(hunk_descriptions)))
+        self.hunk_descriptions = hunk_descriptions
+        self.path = path
+
+    def for_path(self, path):
+        return PatchError(self.hunk_descriptions, path=path)
+
+
+def describe_failure(old, patch):
+    """
+    Describes each hunk of a patch that doesn't match some content. Hunks are
+    located using an index from each line of the content to its line
+    numbers: every line of a hunk votes for the position that the hunk would
+    start at, and the position with the most votes is the closest match.
+    """
+    index = _LineIndex(old.splitlines())
+    descriptions = []
+
+    for hunk_number, hunk in enumerate(read_hunks(patch), 1):
+        description = _describe_hunk_failure(index, hunk)
+        if description is not None:
+            descriptions.append("hunk {} ({}) {}".format(hunk_number, hunk.header, description))
+
+    return descriptions
+
+
+def _describe_hunk_failure(index, hunk):
+    expected_lines = hunk.old_lines
+    expected_start = max(hunk.old_start - 1, 0)
+
+    if not expected_lines:
+        if expected_start > len(index.lines):
+            return "starts after the end of the content, which has {} lines".format(len(index.lines))
+        else:
+            return None
+
+    start = index.closest_match(expected_lines, expected_start=expected_start)
+    if start is None:
+        return "doesn't match any lines in the content"
+
+    differing_lines = [
+        (start + line_index, expected_line, index.line(start + line_index))
+        for line_index, expected_line in enumerate(expected_lines)
+        if index.line(start + line_index) != expected_line
+    ]
+    if not differing_lines:
+        return None
+
+    description_lines = [
+        "doesn't match the content, closest match is on line {} (offset {}, {} of {} lines match):".format(
+            start + 1,
+            start - expected_start,
+            len(expected_lines) - len(differing_lines),
+            len(expected_lines),
+        ),
+    ]
+    for line_index, expected_line, actual_line in differing_lines[:_max_differing_lines]:
+        description_lines.append("  line {}:".format(line_index + 1))
+        description_lines.append("    expected: {}".format(expected_line))
+        if actual_line is None:
+            description_lines.append("    actual:   (end of content)")
+        else:
+            description_lines.append("    actual:   {}".format(actual_line))
+    if len(differing_lines) > _max_differing_lines:
+        description_lines.append("  ...")
+
+    return "\n".join(description_lines)
+
+
+_max_differing_lines = 10
+
+
+class _LineIndex(object):
+    def __init__(self, lines):
+        self.lines = lines
+        self._positions = {}
+        for position, line in enumerate(lines):
+            self._positions.setdefault(line, []).append(position)
+
+    def line(self, position):
+        if 0 <= position < len(self.lines):
+            return self.lines[position]
+        else:
+            return None
+
+    def closest_match(self, expected_lines, expected_start):
+        votes = collections.Counter()
+        for line_index, expected_line in enumerate(expected_lines):
+            positions = self._positions.get(expected_line, ())
+            # Lines such as blank lines that appear very often don't say much
+            # about where a hunk belongs, and would make voting slow.
+            if len(positions) <= _max_votes_per_line:
+                votes.update(position - line_index for position in positions)
+
+        if not votes:
+            return None
+
+        return max(votes, key=lambda start: (votes[start], -abs(start - expected_start)))
+
+
+_max_votes_per_line = 100
+
+
+def read_hunks(patch):
+    hunks = []
+    lines = patch.splitlines()
+    index = 0
+
+    while index < len(lines):
+        header_match = _hunk_header_regex.match(lines[index])
+        index += 1
+        if header_match is None:
+            continue
+
+        old_start, old_length, new_start, new_length = (
+            _hunk_range_part(header_match.group(group_index))
+            for group_index in range(1, 5)
+        )
+        old_remaining = old_length
+        new_remaining = new_length
+        hunk_lines = []
+
+        while (old_remaining > 0 or new_remaining > 0) and index < len(lines):
+            line = lines[index]
+            index += 1
+            if line.startswith("\\"):
+                continue
+            elif line.startswith("-"):
+                old_remaining -= 1
+                hunk_lines.append(("-", line[1:]))
+            elif line.startswith("+"):
+                new_remaining -= 1
+                hunk_lines.append(("+", line[1:]))
+            else:
+                old_remaining -= 1
+                new_remaining -= 1
+                hunk_lines.append((" ", line[1:]))
+
+        hunks.append(Hunk(
+            old_start=old_start,
+            old_length=old_length,
+            new_start=new_start,
+            new_length=new_length,
+            lines=tuple(hunk_lines),
+        ))
+
+    return hunks
+
+
+def read_file_patches(patch):
+    """
+    Splits a patch into a patch for each file, using the ``---`` and ``+++``
+    headers before the hunks for each file.
+    """
+    file_patches = []
+    lines = patch.splitlines(keepends=True)
+    index = 0
+    old_remaining = 0
+    new_remaining = 0
+
+    while index < len(lines):
+        line = lines[index]
+
+        if old_remaining > 0 or new_remaining > 0:
+            if line.startswith("-"):
+                old_remaining -= 1
+            elif line.startswith("+"):
+                new_remaining -= 1
+            elif not line.startswith("\\"):
+                old_remaining -= 1
+                new_remaining -= 1
+            file_patches[-1].lines.append(line)
+            index += 1
+            continue
+
+        if line.startswith("---") and index + 1 < len(lines) and lines[index + 1].startswith("+++"):
+            old_path, new_path = _header_paths(line[3:], lines[index + 1][3:])
+            file_patches.append(FilePatch(old_path=old_path, new_path=new_path, lines=[line, lines[index + 1]]))
+            index += 2
+            continue
+
+        header_match = _hunk_header_regex.match(line)
+        if header_match is not None and file_patches:
+            _, old_remaining, _, new_remaining = (
+                _hunk_range_part(header_match.group(group_index))
+                for group_index in range(1, 5)
+            )
+            file_patches[-1].lines.append(line)
+
+        index += 1
+
+    return file_patches
+
+
+def _header_paths(old_header, new_header):
+    old_path = _header_path(old_header)
+    new_path = _header_path(new_header)
+
+    if (old_path is None or old_path.startswith("a/")) and (new_path is None or new_path.startswith("b/")):
+        old_path = None if old_path is None else old_path[2:]
+        new_path = None if new_path is None else new_path[2:]
+
+    return old_path, new_path
+
+
+def _header_path(header):
+    path = header.split("\t", 1)[0].strip()
+    if path == "/dev/null":
+        return None
+    else:
+        return path
+
+
+class FilePatch(object):
+    def __init__(self, old_path, new_path, lines):
+        self.old_path = old_path
+        self.new_path = new_path
+        self.lines = lines
+
+    @property
+    def path(self):
+        return self.old_path if self.new_path is None else self.new_path
+
+    @property
+    def is_creation(self):
+        return self.old_path is None
+
+    @property
+    def is_deletion(self):
+        return self.new_path is None
+
+    @property
+    def patch(self):
+        return "".join(self.lines)
+
+
+def _hunk_range_part(value):
+    if value is None:
+        return 1
+    else:
+        return int(value)
+
+
+_hunk_header_regex = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+
+class Hunk(object):
+    def __init__(self, old_start, old_length, new_start, new_length, lines):
+        self.old_start = old_start
+        self.old_length = old_length
+        self.new_start = new_start
+        self.new_length = new_length
+        self.lines = lines
+
+    @property
+    def header(self):
+        return "@@ -{},{} +{},{} @@".format(self.old_start, self.old_length, self.new_start, self.new_length)
+
+    @property
+    def old_lines(self):
+        return tuple(text for tag, text in self.lines if tag != "+")
+
+    @property
+    def removed_lines(self):
+        return tuple(text for tag, text in self.lines if tag == "-")
+
+    @property
+    def added_lines(self):
+        return tuple(text for tag, text in self.lines if tag == "+")
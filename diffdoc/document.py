@@ -0,0 +1,125 @@
+import bisect
+import os
+
+from . import compiler, parser, rst
+from .includes import Includes
+
+
+class Document(object):
+    """
+    A source document that's parsed when first needed. The code state after
+    each element is computed at most once, and only when a query needs it, so
+    that many queries about the same document don't replay it repeatedly.
+    """
+
+    def __init__(self, source_text, includes=None):
+        if includes is None:
+            includes = Includes(base_directory=os.getcwd())
+
+        self._source_text = source_text
+        self._includes = includes
+        self._parsed = None
+        # The state after each element, for the elements replayed so far.
+        self._states = []
+        self._compiled = {}
+
+    @property
+    def source(self):
+        source, line_numbers = self._parse()
+        return source
+
+    def _parse(self):
+        if self._parsed is None:
+            source = tuple(parser.loads(self._source_text))
+            self._parsed = source, [line_number for line_number, element in source]
+        return self._parsed
+
+    def blocks(self, name=None, type=None):
+        """
+        Returns the line number and element of each diff-doc block, optionally
+        only those for a name or of a type, such as ``"diff"``.
+        """
+        return [
+            (line_number, element)
+            for line_number, element in self.source
+            if not isinstance(element, parser.Text) and
+            (name is None or getattr(element, "name", None) == name) and
+            (type is None or _block_type(element) == type)
+        ]
+
+    def state_at(self, line_number, name):
+        """
+        Returns the code for a name after every block starting on or before the
+        line number, without running any programs.
+        """
+        source, line_numbers = self._parse()
+        state = self._state_after_index(bisect.bisect_right(line_numbers, line_number) - 1)
+        code = state.get(name)
+        if code is None:
+            raise ValueError("no code named {} on line number {}".format(name, line_number))
+        return code
+
+    def compile(self, runner=None, metrics=None, profile=None, interpreters=None, keep_going=False):
+        """
+        Compiles the document. Output is kept, so compiling again with the
+        same interpreters doesn't run any programs.
+        """
+        key = (tuple(interpreters or ()), keep_going)
+        output = self._compiled.get(key)
+        if output is None:
+            output = self._compiled[key] = rst.dumps(compiler.compile(
+                self.source,
+                runner=runner,
+                metrics=metrics,
+                profile=profile,
+                includes=self._includes,
+                interpreters=interpreters,
+                keep_going=keep_going,
+            ))
+        return output
+
+    def convert_block(self, line_number, block_type):
+        """
+        Returns the text of the document with the block on the line number
+        converted to another type of block.
+        """
+        source, line_numbers = self._parse()
+        index = bisect.bisect_left(line_numbers, line_number)
+        if index == len(source) or line_numbers[index] != line_number:
+            raise ValueError("no element on line number {}".format(line_number))
+
+        converted_element = compiler.convert_element(
+            self._state_after_index(index - 1),
+            source[index][1],
+            line_number=line_number,
+            block_type=block_type,
+        )
+
+        return rst.dumps(
+            (converted_element if element_index == index else element).to_rst()
+            for element_index, (element_line_number, element) in enumerate(source)
+        )
+
+    def _state_after_index(self, index):
+        while len(self._states) <= index:
+            element_index = len(self._states)
+            previous_state = self._states[-1] if self._states else {}
+            element_line_number, element = self.source[element_index]
+            self._states.append(compiler.transition(
+                previous_state,
+                element,
+                line_number=element_line_number,
+                includes=self._includes,
+            ))
+
+        if index < 0:
+            return {}
+        else:
+            return self._states[index]
+
+
+def _block_type(element):
+    if isinstance(element, parser.Include):
+        return "include"
+    else:
+        return type(element).__name__.lower()
@@ -0,0 +1,652 @@
+import codecs
+import collections
+import contextlib
+import itertools
+import os
+import selectors
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from . import subinterpreters
+from .interpreters import default_interpreters
+
+
+class Runner(object):
+    def __init__(self, spool_size=None, max_output_size=None):
+        if spool_size is None:
+            spool_size = default_spool_size
+        if max_output_size is None:
+            max_output_size = default_max_output_size
+
+        self._spool_size = spool_size
+        self._max_output_size = max_output_size
+
+    def run(self, args, expected_output, cwd=None, pass_fds=()):
+        """
+        Runs a program, comparing its combined stdout and stderr against the
+        expected output as it's produced. Once the output can no longer match,
+        the program is killed after reading enough output to show some
+        context.
+
+        Output is spooled to a temporary file once it's larger than the spool
+        size, and the program is killed if its output is larger than the
+        maximum output size.
+        """
+        with tempfile.SpooledTemporaryFile(max_size=self._spool_size) as capture:
+            matcher = OutputMatcher(expected_output)
+            output_size, is_truncated, resources = self._capture(args, matcher, capture, cwd=cwd, pass_fds=pass_fds)
+
+            return _execution_result(
+                matcher,
+                expected_output=expected_output,
+                capture=capture,
+                output_size=output_size,
+                is_truncated=is_truncated,
+                resources=resources,
+            )
+
+    def run_source(self, interpreter, source, expected_output, filename=None, subinterpreter=False):
+        """
+        Runs the source of a program with the interpreter. The source is
+        passed to the interpreter in a memory file descriptor, or an unlinked
+        temporary file where those aren't supported, rather than as an
+        argument, so that its size isn't limited by the maximum argument
+        length. Tracebacks show the filename, or ``<string>`` by default.
+
+        If subinterpreter is true and sub-interpreters are available, the
+        program is first run in a fresh sub-interpreter of this process. If it
+        fails or its output doesn't match, it's run again in a new process, so
+        that the result, including any traceback, is the same as running it in
+        a new process. A sub-interpreter shares the process, so this is only
+        safe for programs that don't change the process, such as by changing
+        directory or writing to file descriptors directly.
+        """
+        if filename is None:
+            filename = "<string>"
+
+        if subinterpreter and subinterpreters.is_available(interpreter):
+            start_time = time.monotonic()
+            output_size = self._run_in_subinterpreter(source, expected_output, filename=filename)
+            if output_size is not None:
+                return ExecutionResult(
+                    matches=True,
+                    documented_output=None,
+                    actual_output=None,
+                    output_size=output_size,
+                    resources=Resources(
+                        wall_time=time.monotonic() - start_time,
+                        user_time=None,
+                        system_time=None,
+                        max_rss=None,
+                    ),
+                )
+
+        with _program_file(source) as program_fd:
+            return self.run(
+                [interpreter, "-c", _program_loader, str(program_fd), filename],
+                expected_output=expected_output,
+                pass_fds=(program_fd, ),
+            )
+
+    def _run_in_subinterpreter(self, source, expected_output, filename):
+        """
+        Returns the size of the output if the program succeeded and its output
+        matched, and None otherwise. Since a sub-interpreter can't be killed,
+        the program is stopped early by closing the pipe it writes to.
+        """
+        read_fd, write_fd = os.pipe()
+        outcomes = []
+
+        def run():
+            try:
+                outcomes.append(subinterpreters.run(source, output_fd=write_fd, filename=filename))
+            finally:
+                os.close(write_fd)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        matcher = OutputMatcher(expected_output)
+        output_size = 0
+        try:
+            while not matcher.is_mismatch:
+                chunk = os.read(read_fd, _chunk_size)
+                if not chunk:
+                    matcher.feed(decoder.decode(b"", final=True))
+                    break
+
+                output_size += len(chunk)
+                if output_size > self._max_output_size:
+                    return None
+
+                matcher.feed(decoder.decode(chunk))
+        finally:
+            os.close(read_fd)
+            thread.join()
+
+        if outcomes == [True] and matcher.finish():
+            return output_size
+        else:
+            return None
+
+    def start_session(self, interpreter=None):
+        if interpreter is None:
+            interpreter = default_interpreters[0]
+        return Session(self, interpreter=interpreter)
+
+    def _capture(self, args, matcher, capture, cwd, pass_fds):
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        output_size = 0
+        is_truncated = False
+
+        start_time = time.monotonic()
+        process = subprocess.Popen(
+            args,
+            stderr=subprocess.STDOUT,
+            stdout=subprocess.PIPE,
+            cwd=cwd,
+            pass_fds=pass_fds,
+        )
+        try:
+            context_deadline = None
+            while True:
+                if matcher.is_mismatch:
+                    if context_deadline is None:
+                        context_deadline = time.monotonic() + _context_timeout
+                    if not _wait_readable(process.stdout, context_deadline - time.monotonic()):
+                        is_truncated = True
+                        break
+
+                chunk = os.read(process.stdout.fileno(), _chunk_size)
+                if not chunk:
+                    matcher.feed(decoder.decode(b"", final=True))
+                    break
+
+                output_size += len(chunk)
+                if output_size > self._max_output_size:
+                    raise OutputTooLargeError(self._max_output_size)
+
+                capture.write(chunk)
+                matcher.feed(decoder.decode(chunk))
+
+                if matcher.is_mismatch and _has_context_after_mismatch(matcher):
+                    is_truncated = True
+                    break
+        except:
+            _kill(process)
+            raise
+        finally:
+            if is_truncated:
+                _kill(process)
+            process.stdout.close()
+            resources = _wait(process, start_time=start_time)
+
+        return output_size, is_truncated, resources
+
+
+@contextlib.contextmanager
+def _program_file(source):
+    if hasattr(os, "memfd_create"):
+        fd = os.memfd_create("diffdoc-program")
+    else:
+        fd, path = tempfile.mkstemp(prefix="diffdoc-program-")
+        os.unlink(path)
+
+    try:
+        with open(fd, "wb", closefd=False) as fileobj:
+            fileobj.write(source.encode("utf-8"))
+        os.lseek(fd, 0, os.SEEK_SET)
+        yield fd
+    finally:
+        os.close(fd)
+
+
+# Reads the program from a file descriptor, and runs it in __main__ as if it
+# had been given with -c, but compiled with the given filename. The loader's
+# own frame is left out of tracebacks.
+_program_loader = """
+def _load():
+    import os
+    import sys
+
+    with os.fdopen(int(sys.argv[1]), "rb") as program_fileobj:
+        source = program_fileobj.read()
+    filename = sys.argv[2]
+    sys.argv = ["-c"]
+    namespace = sys.modules["__main__"].__dict__
+    del namespace["_load"]
+
+    try:
+        exec(compile(source, filename, "exec"), namespace)
+    except SystemExit:
+        raise
+    except BaseException as error:
+        error.__traceback__ = error.__traceback__.tb_next
+        sys.excepthook(type(error), error, error.__traceback__)
+        sys.exit(1)
+
+_load()
+"""
+
+
+def _execution_result(matcher, expected_output, capture, output_size, is_truncated, resources):
+    if matcher.finish():
+        return ExecutionResult(
+            matches=True,
+            documented_output=None,
+            actual_output=None,
+            output_size=output_size,
+            resources=resources,
+        )
+    else:
+        capture.seek(0)
+        documented_window, actual_window = _mismatch_windows(
+            expected_output,
+            codecs.getreader("utf-8")(capture, errors="replace"),
+            is_truncated=is_truncated,
+        )
+        return ExecutionResult(
+            matches=False,
+            documented_output=documented_window,
+            actual_output=actual_window,
+            output_size=output_size,
+            resources=resources,
+        )
+
+
+class Session(object):
+    """
+    A live Python interpreter that keeps the namespace of the program run so
+    far. When a program only appends code to the previous program, just the
+    appended code is executed, and the output of the whole program so far is
+    compared against the expected output. Otherwise, the interpreter is
+    restarted and the whole program is executed.
+
+    If the appended code raises an exception or exits, or the output doesn't
+    match, the program is run again from scratch by the runner, so that the
+    output, including any traceback, is the same as running the program in a
+    fresh interpreter.
+    """
+
+    def __init__(self, runner, interpreter):
+        self._runner = runner
+        self._interpreter = interpreter
+        self._process = None
+        self._commands = None
+        self._capture = None
+        self._output_size = 0
+        self._source = ""
+        self._token = uuid.uuid4().hex
+
+    def run(self, source, expected_output, filename=None):
+        start_time = time.monotonic()
+
+        try:
+            if not self._can_append(source):
+                self.close()
+                self._start()
+
+            succeeded = self._execute(source[len(self._source):])
+        except:
+            self.close()
+            raise
+
+        if not succeeded:
+            return self._run_fresh(source, expected_output=expected_output, filename=filename)
+
+        self._source = source
+
+        matcher = OutputMatcher(expected_output)
+        self._capture.seek(0)
+        reader = codecs.getreader("utf-8")(self._capture, errors="replace")
+        while not matcher.is_mismatch:
+            text = reader.read(_chunk_size)
+            if not text:
+                break
+            matcher.feed(text)
+
+        result = _execution_result(
+            matcher,
+            expected_output=expected_output,
+            capture=self._capture,
+            output_size=self._output_size,
+            is_truncated=False,
+            resources=Resources(
+                wall_time=time.monotonic() - start_time,
+                user_time=None,
+                system_time=None,
+                max_rss=None,
+            ),
+        )
+        self._capture.seek(0, os.SEEK_END)
+
+        # Output that only a fresh interpreter produces, such as output from
+        # exit handlers, is missing from a live interpreter.
+        if not result.matches:
+            return self._run_fresh(source, expected_output=expected_output, filename=filename)
+
+        return result
+
+    def _run_fresh(self, source, expected_output, filename):
+        self.close()
+        return self._runner.run_source(
+            self._interpreter,
+            source,
+            expected_output=expected_output,
+            filename=filename,
+        )
+
+    def _can_append(self, source):
+        if self._process is None or not source.startswith(self._source):
+            return False
+
+        if self._source and not self._source.endswith("\n"):
+            return False
+
+        # Appended code that starts indented continues a block in the code
+        # that has already been executed.
+        appended = source[len(self._source):].lstrip("\r\n")
+        return not appended.startswith((" ", "\t"))
+
+    def _start(self):
+        commands_read_fd, commands_write_fd = os.pipe()
+        try:
+            self._process = subprocess.Popen(
+                [self._interpreter, "-c", _session_server, str(commands_read_fd), self._token],
+                stderr=subprocess.STDOUT,
+                stdout=subprocess.PIPE,
+                pass_fds=(commands_read_fd, ),
+            )
+        except:
+            os.close(commands_write_fd)
+            raise
+        finally:
+            os.close(commands_read_fd)
+
+        self._commands = os.fdopen(commands_write_fd, "wb")
+        self._capture = tempfile.SpooledTemporaryFile(max_size=self._runner._spool_size)
+        self._output_size = 0
+        self._source = ""
+
+    def _execute(self, code):
+        encoded_code = code.encode("utf-8")
+        try:
+            self._commands.write(b"%d\n" % len(encoded_code))
+            self._commands.write(encoded_code)
+            self._commands.flush()
+        except BrokenPipeError:
+            return False
+
+        markers = (
+            ("\0diffdoc-session-ok-{}\n".format(self._token).encode("ascii"), True),
+            ("\0diffdoc-session-error-{}\n".format(self._token).encode("ascii"), False),
+        )
+        # Keep enough unwritten output to find a marker split across reads.
+        keep_length = max(len(marker) for marker, succeeded in markers) - 1
+
+        buffer = b""
+        while True:
+            chunk = os.read(self._process.stdout.fileno(), _chunk_size)
+            if not chunk:
+                return False
+            buffer += chunk
+
+            for marker, succeeded in markers:
+                index = buffer.find(marker)
+                if index != -1:
+                    self._write_output(buffer[:index])
+                    return succeeded
+
+            split_index = max(0, len(buffer) - keep_length)
+            self._write_output(buffer[:split_index])
+            buffer = buffer[split_index:]
+
+    def _write_output(self, output):
+        self._output_size += len(output)
+        if self._output_size > self._runner._max_output_size:
+            raise OutputTooLargeError(self._runner._max_output_size)
+        self._capture.write(output)
+
+    def close(self):
+        if self._process is not None:
+            self._commands.close()
+            self._process.kill()
+            self._process.stdout.close()
+            self._process.wait()
+            self._capture.close()
+            self._process = None
+            self._commands = None
+            self._capture = None
+        self._source = ""
+
+
+_session_server = """
+import os
+import sys
+
+commands = os.fdopen(int(sys.argv[1]), "rb")
+token = sys.argv[2]
+sys.argv = ["-c"]
+namespace = {"__name__": "__main__", "__builtins__": __builtins__}
+
+while True:
+    header = commands.readline()
+    if not header:
+        break
+    code = commands.read(int(header)).decode("utf-8")
+
+    status = "ok"
+    try:
+        exec(compile(code, "<string>", "exec"), namespace)
+    except BaseException:
+        status = "error"
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.write(1, "\\0diffdoc-session-{}-{}\\n".format(status, token).encode("ascii"))
+"""
+
+
+default_spool_size = 1024 * 1024
+default_max_output_size = 64 * 1024 * 1024
+
+
+class OutputTooLargeError(Exception):
+    def __init__(self, max_output_size):
+        super().__init__("output is larger than the maximum of {} bytes".format(max_output_size))
+        self.max_output_size = max_output_size
+
+
+_chunk_size = 64 * 1024
+_context_lines = 5
+_max_context_length = 16 * 1024
+_context_timeout = 0.5
+
+
+def _wait_readable(fileobj, timeout):
+    if timeout <= 0:
+        return False
+
+    with selectors.DefaultSelector() as selector:
+        selector.register(fileobj, selectors.EVENT_READ)
+        return bool(selector.select(timeout))
+
+
+def _kill(process):
+    if hasattr(os, "wait4"):
+        # Popen.kill() polls the process first, which can reap it before
+        # _wait() reads its resource usage.
+        os.kill(process.pid, signal.SIGKILL)
+    else:
+        process.kill()
+
+
+def _wait(process, start_time):
+    if hasattr(os, "wait4"):
+        _, status, rusage = os.wait4(process.pid, 0)
+        if os.WIFSIGNALED(status):
+            process.returncode = -os.WTERMSIG(status)
+        else:
+            process.returncode = os.WEXITSTATUS(status)
+        return Resources(
+            wall_time=time.monotonic() - start_time,
+            user_time=rusage.ru_utime,
+            system_time=rusage.ru_stime,
+            max_rss=rusage.ru_maxrss * _max_rss_unit,
+        )
+    else:
+        process.wait()
+        return Resources(
+            wall_time=time.monotonic() - start_time,
+            user_time=None,
+            system_time=None,
+            max_rss=None,
+        )
+
+
+# ru_maxrss is in bytes on macOS, and kilobytes elsewhere
+_max_rss_unit = 1 if sys.platform == "darwin" else 1024
+
+
+class ExecutionResult(object):
+    def __init__(self, matches, documented_output, actual_output, output_size, resources):
+        self.matches = matches
+        self.documented_output = documented_output
+        self.actual_output = actual_output
+        self.output_size = output_size
+        self.resources = resources
+
+
+class Resources(object):
+    """
+    Resources used by a program. CPU times and maximum resident set size are
+    None on platforms without wait4.
+    """
+
+    def __init__(self, wall_time, user_time, system_time, max_rss):
+        self.wall_time = wall_time
+        self.user_time = user_time
+        self.system_time = system_time
+        self.max_rss = max_rss
+
+
+class OutputMatcher(object):
+    """
+    Incrementally checks whether output could still be equal to the expected
+    output once leading and trailing whitespace is stripped from both.
+    """
+
+    def __init__(self, expected_output):
+        self._expected = expected_output.strip()
+        self._is_started = False
+        self._position = 0
+        self.is_mismatch = False
+        self.context_length = 0
+        self.context_lines = 0
+
+    def feed(self, text):
+        if self.is_mismatch:
+            self._add_context(text)
+            return
+
+        start = 0
+        if not self._is_started:
+            start = len(text) - len(text.lstrip())
+            if start == len(text):
+                return
+            self._is_started = True
+
+        expected_remaining = self._expected[self._position:self._position + len(text) - start]
+        if text[start:start + len(expected_remaining)] != expected_remaining:
+            mismatch_index = next(
+                index
+                for index, expected_char in enumerate(expected_remaining)
+                if text[start + index] != expected_char
+            )
+            self._set_mismatch(text[start + mismatch_index:])
+            return
+
+        self._position += len(expected_remaining)
+        rest = text[start + len(expected_remaining):]
+        if rest.strip():
+            self._set_mismatch(rest.lstrip())
+
+    def _set_mismatch(self, context):
+        self.is_mismatch = True
+        self._add_context(context)
+
+    def _add_context(self, text):
+        self.context_length += len(text)
+        self.context_lines += text.count("\n")
+
+    def finish(self):
+        return not self.is_mismatch and self._position == len(self._expected)
+
+
+def _has_context_after_mismatch(matcher):
+    return (
+        matcher.context_lines > _context_lines or
+        matcher.context_length >= _max_context_length
+    )
+
+
+def _mismatch_windows(expected_output, actual_lines, is_truncated):
+    """
+    Finds the first line where the expected and actual output differ, and
+    returns the lines around it. Actual lines are read lazily so that only the
+    window is held in memory.
+    """
+    expected_lines = expected_output.splitlines(keepends=True)
+    actual_lines = iter(actual_lines)
+    actual_lines_before = collections.deque(maxlen=_context_lines)
+    actual_window = []
+
+    mismatch_index = 0
+    for actual_line in actual_lines:
+        if (
+            mismatch_index < len(expected_lines) and
+            expected_lines[mismatch_index].rstrip("\r\n") == actual_line.rstrip("\r\n")
+        ):
+            actual_lines_before.append(actual_line)
+            mismatch_index += 1
+        else:
+            actual_window.append(actual_line)
+            break
+
+    actual_lines_after = list(itertools.islice(actual_lines, _context_lines + 1))
+    actual_window = list(actual_lines_before) + actual_window + actual_lines_after[:_context_lines]
+
+    start = max(0, mismatch_index - _context_lines)
+    end = mismatch_index + _context_lines + 1
+
+    return (
+        _window(
+            expected_lines[start:end],
+            has_lines_before=start > 0,
+            has_lines_after=end < len(expected_lines),
+        ),
+        _window(
+            actual_window,
+            has_lines_before=start > 0,
+            has_lines_after=len(actual_lines_after) > _context_lines or is_truncated,
+        ),
+    )
+
+
+def _window(lines, has_lines_before, has_lines_after):
+    window = "".join(lines)
+
+    if has_lines_before:
+        window = "...\n" + window
+    if has_lines_after:
+        if window and not window.endswith("\n"):
+            window += "\n"
+        window += "...\n"
+
+    return window
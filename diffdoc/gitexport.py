@@ -0,0 +1,101 @@
+"""
+Exports the history of each code name in a source as a git repository. The
+state transitions of the source are replayed without running any programs,
+and a commit is streamed to ``git fast-import`` for each block that changes
+the content of a name, so the whole history is imported by a single process.
+
+Each name has its own branch. For a name with a tree of files, the branch
+contains those files, and otherwise a single file named after the name.
+Commits don't name their parent, so fast-import commits on top of the
+previous commit to the same branch in the stream.
+"""
+
+import subprocess
+import time
+
+from . import compiler
+
+
+def export(source, repository_path, includes=None, timestamp=None):
+    process = subprocess.Popen(
+        ["git", "fast-import", "--quiet"],
+        cwd=repository_path,
+        stdin=subprocess.PIPE,
+    )
+    try:
+        write_fast_import(source, process.stdin, includes=includes, timestamp=timestamp)
+    finally:
+        process.stdin.close()
+        return_code = process.wait()
+
+    if return_code != 0:
+        raise ValueError("git fast-import failed with exit code {}".format(return_code))
+
+
+def write_fast_import(source, fileobj, includes=None, timestamp=None):
+    if timestamp is None:
+        timestamp = int(time.time())
+
+    state = {}
+    committed_files = {}
+
+    for line_number, element in source:
+        previous_state = state
+        state = compiler.transition(state, element, line_number=line_number, includes=includes)
+
+        for name, code in state.items():
+            if previous_state.get(name) is code:
+                continue
+
+            files = _files(name, code)
+            previous_files = committed_files.get(name, {})
+            if files != previous_files:
+                _write_commit(
+                    fileobj,
+                    branch=name,
+                    files=files,
+                    previous_files=previous_files,
+                    message="{} on line number {}\n".format(type(element).__name__, line_number),
+                    timestamp=timestamp,
+                )
+                committed_files[name] = files
+
+
+def _files(name, code):
+    if code.path is None:
+        return {file_name(name, language=code.language): code.content}
+    else:
+        return code.all_files
+
+
+def file_name(name, language):
+    return name + _extensions.get(language, "")
+
+
+_extensions = {
+    "javascript": ".js",
+    "python": ".py",
+    "ruby": ".rb",
+    "shell": ".sh",
+}
+
+
+def _write_commit(fileobj, branch, files, previous_files, message, timestamp):
+    fileobj.write("commit refs/heads/{}\n".format(branch).encode("utf-8"))
+    fileobj.write("committer diff-doc <diff-doc> {} +0000\n".format(timestamp).encode("utf-8"))
+    _write_data(fileobj, message)
+    for path in sorted(previous_files):
+        if path not in files:
+            fileobj.write("D {}\n".format(path).encode("utf-8"))
+    for path, content in sorted(files.items()):
+        if previous_files.get(path) != content:
+            fileobj.write("M 100644 inline {}\n".format(path).encode("utf-8"))
+            _write_data(fileobj, content)
+    fileobj.write(b"\n")
+
+
+def _write_data(fileobj, value):
+    encoded_value = value.encode("utf-8")
+    fileobj.write("data {}\n".format(len(encoded_value)).encode("utf-8"))
+    fileobj.write(encoded_value)
+    fileobj.write(b"\n")
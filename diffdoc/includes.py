@@ -0,0 +1,216 @@
+import json
+import os
+import re
+
+from . import cache
+from .metrics import Metrics
+
+
+class Includes(object):
+    """
+    Loads included sources. Each included source is compiled from an empty
+    state, and its compiled output and final state are cached by a hash of
+    its text and the text of everything it includes, both in memory and, if
+    a result cache is given, on disk.
+    """
+
+    def __init__(self, base_directory, result_cache=None):
+        self._base_directory = base_directory
+        self._store = _Store(result_cache)
+        self._ancestors = ()
+
+    def document_key(self, source_text, interpreters=None, source_name=None):
+        dependency_keys = []
+        for path in _include_paths(source_text):
+            full_path = self._resolve(path)
+            if full_path in self._ancestors:
+                continue
+
+            try:
+                included_text = _read(full_path)
+            except OSError:
+                dependency_keys.append("missing:" + full_path)
+            else:
+                dependency_keys.append(self._nested(full_path).document_key(
+                    included_text,
+                    interpreters=interpreters,
+                    source_name=_included_source_name(path, source_name),
+                ))
+
+        return cache.document_key(
+            source_text,
+            dependency_keys=dependency_keys,
+            interpreters=interpreters,
+            source_name=source_name,
+        )
+
+    def load(self, path, line_number, context, check_outputs=True):
+        """
+        Loads an included source. If check_outputs is false, the source is
+        compiled without running the programs for its Output blocks, and the
+        result isn't cached.
+        """
+        full_path = self._resolve(path)
+        if full_path in self._ancestors:
+            raise ValueError("cannot include {} on line number {}, source includes itself".format(path, line_number))
+
+        try:
+            source_text = _read(full_path)
+        except OSError as error:
+            raise ValueError("cannot include {} on line number {}, {}".format(path, line_number, error.strerror))
+
+        nested = self._nested(full_path)
+        source_name = _included_source_name(path, context.source_name)
+        key = nested.document_key(source_text, interpreters=context.interpreters, source_name=source_name)
+        included = self._store.get(key)
+        if included is None:
+            from . import compiler, parser, rst
+
+            try:
+                elements, state = compiler.compile_with_state(
+                    parser.loads(source_text),
+                    runner=context.runner,
+                    # The source is compiled again once its programs are
+                    # run, so only that compile is measured.
+                    metrics=context.metrics if check_outputs else Metrics(),
+                    profile=context.profile if check_outputs else None,
+                    includes=nested,
+                    interpreters=context.interpreters,
+                    lockfile=context.lockfile,
+                    source_name=source_name,
+                    check_outputs=check_outputs,
+                )
+            except ValueError as error:
+                raise ValueError("cannot include {} on line number {}:\n{}".format(path, line_number, error))
+
+            included = IncludedSource(output=rst.dumps(elements), state=state)
+            if check_outputs:
+                self._store.put(key, included)
+
+        return included
+
+    def started_names(self, path):
+        """
+        Returns the names started by an included source and the sources it
+        includes, without compiling them. Sources that can't be read or parsed
+        are skipped.
+        """
+        from . import parser
+
+        full_path = self._resolve(path)
+        if full_path in self._ancestors:
+            return set()
+
+        try:
+            elements = parser.loads(_read(full_path))
+        except Exception:
+            return set()
+
+        nested = self._nested(full_path)
+        names = set()
+        for line_number, element in elements:
+            if isinstance(element, parser.Start):
+                names.add(element.name)
+            elif isinstance(element, parser.Include):
+                names.update(nested.started_names(element.path))
+        return names
+
+    def _resolve(self, path):
+        return os.path.normpath(os.path.join(self._base_directory, path))
+
+    def _nested(self, path):
+        nested = Includes(base_directory=os.path.dirname(path))
+        nested._store = self._store
+        nested._ancestors = self._ancestors + (path, )
+        return nested
+
+
+class IncludedSource(object):
+    def __init__(self, output, state):
+        self.output = output
+        self.state = state
+
+
+def _included_source_name(path, including_source_name):
+    # Tracebacks in an included source only show its path if tracebacks in
+    # the including source show a source name.
+    if including_source_name is None:
+        return None
+    else:
+        return path
+
+
+def _read(path):
+    with open(path, "rt", encoding="utf-8") as fileobj:
+        return fileobj.read()
+
+
+def _include_paths(source_text):
+    # Only the paths of includes are needed, so the source is scanned for
+    # include directives rather than parsed.
+    return _include_pattern.findall(source_text)
+
+
+_include_pattern = re.compile(r"^\.\. diff-doc-include::[ \t]*([^\s]+)", re.MULTILINE)
+
+
+class _Store(object):
+    def __init__(self, result_cache):
+        self._result_cache = result_cache
+        self._loaded = {}
+
+    def get(self, key):
+        included = self._loaded.get(key)
+        if included is None and self._result_cache is not None:
+            value = self._result_cache.get(_cache_key(key))
+            if value is not None:
+                included = self._loaded[key] = _loads_included(value)
+        return included
+
+    def put(self, key, included):
+        self._loaded[key] = included
+        if self._result_cache is not None:
+            self._result_cache.put(_cache_key(key), _dumps_included(included))
+
+
+def _cache_key(key):
+    return "include-" + key
+
+
+def _dumps_included(included):
+    return json.dumps({
+        "output": included.output,
+        "state": {
+            name: {
+                "language": code.language,
+                "content": code.content,
+                "pending_lines": list(code.pending_lines),
+                "session": code.session,
+                "path": code.path,
+                "files": code.files,
+                "subinterpreter": code.subinterpreter,
+            }
+            for name, code in included.state.items()
+        },
+    })
+
+
+def _loads_included(value):
+    from . import compiler
+
+    value = json.loads(value)
+    return IncludedSource(
+        output=value["output"],
+        state={
+            name: compiler.Code(
+                language=code["language"],
+                content=code["content"],
+                pending_lines=tuple(code["pending_lines"]),
+                session=code.get("session", False),
+                path=code.get("path"),
+                files=code.get("files"),
+                subinterpreter=code.get("subinterpreter", False),
+            )
+            for name, code in value["state"].items()
+        },
+    )
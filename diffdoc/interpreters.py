@@ -0,0 +1,3 @@
+# Kept apart from the execution module, so that cache keys can be computed
+# without importing the modules used to run programs.
+default_interpreters = ("python", )
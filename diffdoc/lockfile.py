@@ -0,0 +1,88 @@
+import hashlib
+import json
+import threading
+
+
+class Lockfile(object):
+    """
+    Records each Output block whose program was run and matched the output,
+    as a hash of the code, the interpreter, and a hash of the output. Entries
+    don't depend on line numbers, so editing the text around blocks doesn't
+    invalidate them, unless tracebacks show a filename with the line number
+    of the block, in which case the filename is part of the hash of the code.
+
+    A frozen lockfile verifies Output blocks against the recorded entries
+    instead of running their programs.
+    """
+
+    @staticmethod
+    def loads(text, frozen=False):
+        value = json.loads(text)
+        if value.get("version") != _version:
+            raise ValueError("unsupported lockfile version: {}".format(value.get("version")))
+
+        return Lockfile(
+            entries=(
+                (output["code"], output["interpreter"], output["output"])
+                for output in value["outputs"]
+            ),
+            frozen=frozen,
+        )
+
+    def __init__(self, entries=(), frozen=False):
+        self.frozen = frozen
+        self._entries = set(entries)
+        # Outputs are recorded from the threads running programs for each
+        # interpreter.
+        self._lock = threading.Lock()
+
+    def record(self, code, interpreter, expected_output, filename=None):
+        entry = _entry(code, interpreter=interpreter, expected_output=expected_output, filename=filename)
+        with self._lock:
+            self._entries.add(entry)
+
+    def contains(self, code, interpreter, expected_output, filename=None):
+        return _entry(code, interpreter=interpreter, expected_output=expected_output, filename=filename) in self._entries
+
+    def dumps(self):
+        return json.dumps(
+            {
+                "version": _version,
+                "outputs": [
+                    {"code": code_hash, "interpreter": interpreter, "output": output_hash}
+                    for code_hash, interpreter, output_hash in sorted(self._entries)
+                ],
+            },
+            indent=2,
+        ) + "\n"
+
+
+_version = 1
+
+
+def _entry(code, interpreter, expected_output, filename):
+    # Leading and trailing whitespace is ignored when output is compared, so
+    # it's ignored here too.
+    return code_hash(code, filename=filename), interpreter, _hash(expected_output.strip())
+
+
+def code_hash(code, filename=None):
+    """
+    Hashes the same text as ``json.dumps([path, files, content])``, with the
+    content encoded a chunk at a time so that stored content isn't read all
+    at once. If a filename is given, it's appended to the list.
+    """
+    text_hash = hashlib.sha256()
+    text_hash.update(json.dumps([code.path, sorted(code.files.items())])[:-1].encode("utf-8"))
+    text_hash.update(b', "')
+    for chunk in code.content_chunks():
+        text_hash.update(json.encoder.encode_basestring_ascii(chunk)[1:-1].encode("utf-8"))
+    text_hash.update(b'"')
+    if filename is not None:
+        text_hash.update(", {}".format(json.dumps(filename)).encode("utf-8"))
+    text_hash.update(b"]")
+    return text_hash.hexdigest()
+
+
+def _hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
@@ -0,0 +1,73 @@
+import difflib
+
+
+def merge3(base, ours, theirs):
+    """
+    Merges the changes from base to ours and from base to theirs, line by
+    line. Returns the merged text, and a list of the ranges of base lines,
+    as zero-based ``(start, end)`` pairs, that were changed differently in
+    ours and theirs. Conflicting regions use our lines.
+    """
+    base_lines = base.splitlines(keepends=True)
+    our_lines = ours.splitlines(keepends=True)
+    their_lines = theirs.splitlines(keepends=True)
+
+    merged_lines = []
+    conflicts = []
+    base_position = our_position = their_position = 0
+
+    for base_start, base_end, our_start, their_start in _sync_regions(base_lines, our_lines, their_lines):
+        base_chunk = base_lines[base_position:base_start]
+        our_chunk = our_lines[our_position:our_start]
+        their_chunk = their_lines[their_position:their_start]
+
+        if our_chunk == base_chunk:
+            merged_lines += their_chunk
+        elif their_chunk == base_chunk or our_chunk == their_chunk:
+            merged_lines += our_chunk
+        else:
+            conflicts.append((base_position, base_start))
+            merged_lines += our_chunk
+
+        merged_lines += base_lines[base_start:base_end]
+        base_position = base_end
+        our_position = our_start + base_end - base_start
+        their_position = their_start + base_end - base_start
+
+    return "".join(merged_lines), conflicts
+
+
+def _sync_regions(base_lines, our_lines, their_lines):
+    """
+    Yields the regions of base lines that are unchanged in both ours and
+    theirs, as ``(base_start, base_end, our_start, their_start)``, ending
+    with an empty region at the end of all three.
+    """
+    our_matches = _matching_blocks(base_lines, our_lines)
+    their_matches = _matching_blocks(base_lines, their_lines)
+
+    our_index = their_index = 0
+    while our_index < len(our_matches) and their_index < len(their_matches):
+        our_base_start, our_start, our_length = our_matches[our_index]
+        their_base_start, their_start, their_length = their_matches[their_index]
+
+        start = max(our_base_start, their_base_start)
+        end = min(our_base_start + our_length, their_base_start + their_length)
+        if start < end:
+            yield (
+                start,
+                end,
+                our_start + start - our_base_start,
+                their_start + start - their_base_start,
+            )
+
+        if our_base_start + our_length < their_base_start + their_length:
+            our_index += 1
+        else:
+            their_index += 1
+
+    yield len(base_lines), len(base_lines), len(our_lines), len(their_lines)
+
+
+def _matching_blocks(old_lines, new_lines):
+    return difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False).get_matching_blocks()
@@ -0,0 +1,159 @@
+import bisect
+import contextlib
+import json
+import time
+
+
+class Metrics(object):
+    """
+    Aggregate counters and histograms, written in the Prometheus text
+    exposition format or as JSON. Names are given without the ``diffdoc_``
+    prefix, which is added when the metrics are written.
+    """
+
+    def __init__(self):
+        self._counters = {}
+        self._histograms = {}
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, _labels_key(labels))
+        self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, _labels_key(labels))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = _Histogram(_buckets_for(name))
+        histogram.observe(value)
+
+    @contextlib.contextmanager
+    def time(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def dumps(self, format):
+        if format == "json":
+            return self.to_json()
+        elif format == "prometheus":
+            return self.to_prometheus()
+        else:
+            raise ValueError("unknown metrics format: {}".format(format))
+
+    def to_prometheus(self):
+        lines = []
+
+        for name, values in _group_by_name(self._counters):
+            full_name = _prefix + name
+            lines.append("# TYPE {} counter\n".format(full_name))
+            for labels, value in values:
+                lines.append("{}{} {}\n".format(full_name, _format_labels(labels), _format_number(value)))
+
+        for name, values in _group_by_name(self._histograms):
+            full_name = _prefix + name
+            lines.append("# TYPE {} histogram\n".format(full_name))
+            for labels, histogram in values:
+                for upper_bound, count in histogram.cumulative_buckets():
+                    bucket_labels = labels + (("le", _format_number(upper_bound)), )
+                    lines.append("{}_bucket{} {}\n".format(full_name, _format_labels(bucket_labels), count))
+                lines.append("{}_sum{} {}\n".format(full_name, _format_labels(labels), _format_number(histogram.sum)))
+                lines.append("{}_count{} {}\n".format(full_name, _format_labels(labels), histogram.count))
+
+        return "".join(lines)
+
+    def to_json(self):
+        return json.dumps(
+            {
+                "counters": {
+                    _prefix + name: [
+                        {"labels": dict(labels), "value": value}
+                        for labels, value in values
+                    ]
+                    for name, values in _group_by_name(self._counters)
+                },
+                "histograms": {
+                    _prefix + name: [
+                        {
+                            "labels": dict(labels),
+                            "count": histogram.count,
+                            "sum": histogram.sum,
+                            "buckets": [
+                                [_format_number(upper_bound), count]
+                                for upper_bound, count in histogram.cumulative_buckets()
+                            ],
+                        }
+                        for labels, histogram in values
+                    ]
+                    for name, values in _group_by_name(self._histograms)
+                },
+            },
+            indent=2,
+            sort_keys=True,
+        ) + "\n"
+
+
+_prefix = "diffdoc_"
+
+
+class _Histogram(object):
+    def __init__(self, upper_bounds):
+        self._upper_bounds = upper_bounds
+        self._counts = [0] * (len(upper_bounds) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self._counts[bisect.bisect_left(self._upper_bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_buckets(self):
+        total = 0
+        for upper_bound, count in zip(self._upper_bounds + (float("inf"), ), self._counts):
+            total += count
+            yield upper_bound, total
+
+
+def _buckets_for(name):
+    if name.endswith("_bytes"):
+        return _size_buckets
+    else:
+        return _duration_buckets
+
+
+_duration_buckets = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
+_size_buckets = (100, 1000, 10000, 100000, 1000000, 10000000, 100000000)
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _group_by_name(values):
+    grouped = {}
+    for (name, labels), value in sorted(values.items()):
+        grouped.setdefault(name, []).append((labels, value))
+    return sorted(grouped.items())
+
+
+def _format_labels(labels):
+    if labels:
+        return "{" + ",".join(
+            '{}="{}"'.format(key, _escape_label_value(value))
+            for key, value in labels
+        ) + "}"
+    else:
+        return ""
+
+
+def _escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_number(value):
+    if value == float("inf"):
+        return "+Inf"
+    else:
+        return repr(value)
@@ -15,6 +15,19 @@ class Diff(object):
         )
 
 
+class Include(object):
+    def __init__(self, path, render):
+        self.path = path
+        self.render = render
+
+    def to_rst(self):
+        return rst.DiffdocIncludeBlock(
+            arguments=(self.path, ),
+            options={"render": str(self.render)},
+            content="",
+        )
+
+
 class Output(object):
     def __init__(self, name, render, content):
         self.name = name
@@ -57,16 +70,27 @@ class Replace(object):
 
 
 class Start(object):
-    def __init__(self, name, language, render, content):
+    def __init__(self, name, language, render, content, session=False, path=None, subinterpreter=False):
         self.name = name
         self.language = language
         self.render = render
         self.content = content
+        self.session = session
+        self.path = path
+        self.subinterpreter = subinterpreter
 
     def to_rst(self):
+        options = {"language": self.language, "render": str(self.render)}
+        if self.session:
+            options["session"] = str(self.session)
+        if self.path is not None:
+            options["file"] = self.path
+        if self.subinterpreter:
+            options["subinterpreter"] = str(self.subinterpreter)
+
         return rst.DiffdocBlock(
             arguments=("start", self.name),
-            options={"language": self.language, "render": str(self.render)},
+            options=options,
             content=self.content,
         )
 
@@ -91,8 +115,21 @@ def _read_rst_element(element):
             kwargs["render"] = _bool_text[options.pop("render")]
         if element_type == "start":
             kwargs["language"] = options.pop("language")
+            if "session" in options:
+                kwargs["session"] = _bool_text[options.pop("session")]
+            if "file" in options:
+                kwargs["path"] = options.pop("file")
+            if "subinterpreter" in options:
+                kwargs["subinterpreter"] = _bool_text[options.pop("subinterpreter")]
         assert options == {}, "extra options: {}".format(options)
         return _element_types[element_type](**kwargs)
+    elif isinstance(element, rst.DiffdocIncludeBlock):
+        path, = element.arguments
+        options = element.options.copy()
+        render = _bool_text[options.pop("render")]
+        assert options == {}, "extra options: {}".format(options)
+        assert element.content == "", "include cannot have content"
+        return Include(path=path, render=render)
     else:
         return element
 
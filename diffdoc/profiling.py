@@ -0,0 +1,64 @@
+class ResourceProfile(object):
+    """
+    Records the resources used by the program run for each Output block, and
+    reports the blocks that were slowest and used the most memory.
+    """
+
+    def __init__(self):
+        self._entries = []
+
+    def record(self, line_number, name, resources, output_size):
+        self._entries.append(_Entry(
+            line_number=line_number,
+            name=name,
+            resources=resources,
+            output_size=output_size,
+        ))
+
+    def report(self, limit=10):
+        slowest = sorted(
+            self._entries,
+            key=lambda entry: entry.resources.wall_time,
+            reverse=True,
+        )[:limit]
+        largest = sorted(
+            (entry for entry in self._entries if entry.resources.max_rss is not None),
+            key=lambda entry: entry.resources.max_rss,
+            reverse=True,
+        )[:limit]
+
+        lines = ["Programs run: {}\n".format(len(self._entries))]
+        if self._entries:
+            lines.append("Total wall time: {:.2f} s\n".format(
+                sum(entry.resources.wall_time for entry in self._entries),
+            ))
+        if slowest:
+            lines.append("\nSlowest output blocks:\n")
+            lines += map(_format_entry, slowest)
+        if largest:
+            lines.append("\nLargest output blocks by maximum resident set size:\n")
+            lines += map(_format_entry, largest)
+
+        return "".join(lines)
+
+
+class _Entry(object):
+    def __init__(self, line_number, name, resources, output_size):
+        self.line_number = line_number
+        self.name = name
+        self.resources = resources
+        self.output_size = output_size
+
+
+def _format_entry(entry):
+    resources = entry.resources
+    parts = ["{:.2f} s wall".format(resources.wall_time)]
+    if resources.user_time is not None:
+        parts.append("{:.2f} s user".format(resources.user_time))
+    if resources.system_time is not None:
+        parts.append("{:.2f} s system".format(resources.system_time))
+    if resources.max_rss is not None:
+        parts.append("{:.1f} MiB max RSS".format(resources.max_rss / (1024 * 1024)))
+    parts.append("{} bytes of output".format(entry.output_size))
+
+    return "  line {} ({}): {}\n".format(entry.line_number, entry.name, ", ".join(parts))
@@ -0,0 +1,84 @@
+"""
+Collects diff-doc source files as tests, with one test item for each Output
+and Diff block. Each item replays the state transitions before its block
+without running programs, so items can be selected with ``-k`` and
+distributed across workers independently.
+
+Enable with ``--diff-doc``. Files are matched against the
+``diff_doc_patterns`` ini option, which defaults to ``*.src.rst``.
+Included sources are found relative to the directory of the including file.
+"""
+
+import fnmatch
+
+import pytest
+
+from . import compiler, execution, parser
+from .includes import Includes
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("diff-doc")
+    group.addoption(
+        "--diff-doc",
+        action="store_true",
+        dest="diff_doc",
+        help="collect diff-doc source files as tests",
+    )
+    parser.addini(
+        "diff_doc_patterns",
+        type="args",
+        default=["*.src.rst"],
+        help="glob patterns of diff-doc source files",
+    )
+
+
+def pytest_collect_file(file_path, parent):
+    config = parent.config
+    if config.getoption("diff_doc") and any(
+        fnmatch.fnmatch(file_path.name, pattern)
+        for pattern in config.getini("diff_doc_patterns")
+    ):
+        return DiffdocFile.from_parent(parent, path=file_path)
+
+
+class DiffdocFile(pytest.File):
+    def collect(self):
+        source = parser.loads(self.path.read_text(encoding="utf-8"))
+        self.replay = compiler.Replay(
+            source,
+            includes=Includes(base_directory=str(self.path.parent)),
+        )
+
+        for line_number, element in source:
+            element_type = _element_types.get(type(element))
+            if element_type is not None:
+                yield DiffdocItem.from_parent(
+                    self,
+                    name="{}-{}-line-{}".format(element.name, element_type, line_number),
+                    line_number=line_number,
+                )
+
+
+_element_types = {
+    parser.Diff: "diff",
+    parser.Output: "output",
+}
+
+
+class DiffdocItem(pytest.Item):
+    def __init__(self, *, line_number, **kwargs):
+        super().__init__(**kwargs)
+        self.line_number = line_number
+
+    def runtest(self):
+        self.parent.replay.execute(self.line_number, runner=execution.Runner())
+
+    def repr_failure(self, excinfo):
+        if isinstance(excinfo.value, ValueError):
+            return str(excinfo.value)
+        else:
+            return super().repr_failure(excinfo)
+
+    def reportinfo(self):
+        return self.path, self.line_number - 1, self.name
@@ -0,0 +1,151 @@
+"""
+Rebases diff blocks after an earlier block has been edited. The source
+before the edit and the edited source are replayed together in a single
+forward pass. Each diff whose text wasn't edited, but whose code was changed
+by an earlier edit, is re-derived by a three-way merge of the code before
+the diff in the old source, the code before the diff in the edited source,
+and the code after the diff in the old source.
+"""
+
+from . import parser
+from .diff import PatchError, apply_patch, generate_diff, read_hunks
+from .merge import merge3
+
+
+def rebase(base_source, source):
+    """
+    Returns the rebased source, and a description of each block that
+    couldn't be rebased.
+    """
+    base_blocks = _blocks(base_source)
+    blocks = _blocks(source)
+    _check_same_blocks(base_blocks, blocks)
+
+    base_contents = {}
+    contents = {}
+    # Names whose code is no longer known, because a diff conflicted or its
+    # code has several files.
+    broken_names = set()
+    file_names = set()
+    rebased_elements = {}
+    problems = []
+
+    for (base_line_number, base_element), (line_number, element) in zip(base_blocks, blocks):
+        if isinstance(element, parser.Start):
+            if element.path is None:
+                broken_names.discard(element.name)
+                file_names.discard(element.name)
+            else:
+                broken_names.add(element.name)
+                file_names.add(element.name)
+            base_contents[element.name] = base_element.content
+            contents[element.name] = element.content
+
+        elif isinstance(element, parser.Replace):
+            # A replace gives the whole code again, unless the code has
+            # several files.
+            if element.name not in file_names:
+                broken_names.discard(element.name)
+            base_contents[element.name] = base_element.content
+            contents[element.name] = element.content
+
+        elif isinstance(element, parser.Diff) and element.name in base_contents:
+            base_before = base_contents[element.name]
+            try:
+                base_after = base_contents[element.name] = apply_patch(base_before, base_element.content)
+            except PatchError:
+                base_after = base_contents[element.name] = base_before
+            if element.name in broken_names:
+                continue
+
+            before = contents[element.name]
+            if element.content != base_element.content or before == base_before:
+                try:
+                    contents[element.name] = apply_patch(before, element.content)
+                except PatchError as error:
+                    problems.append("diff on line number {} doesn't apply, {}".format(line_number, error))
+                    broken_names.add(element.name)
+                continue
+
+            after, conflicts = merge3(base_before, before, base_after)
+            if conflicts:
+                problems.append("diff on line number {} conflicts with earlier changes to {}".format(
+                    line_number,
+                    ", ".join(_format_lines(start, end) for start, end in conflicts),
+                ))
+                broken_names.add(element.name)
+                continue
+            if after == before:
+                problems.append("diff on line number {} has no changes once rebased".format(line_number))
+                broken_names.add(element.name)
+                continue
+
+            rebased_elements[line_number] = parser.Diff(
+                name=element.name,
+                render=element.render,
+                content=_rederive_diff(element.content, before, after),
+            )
+            contents[element.name] = after
+
+    rebased_source = [
+        (line_number, rebased_elements.get(line_number, element))
+        for line_number, element in source
+    ]
+    return rebased_source, problems
+
+
+def _blocks(source):
+    return [
+        (line_number, element)
+        for line_number, element in source
+        if not isinstance(element, parser.Text)
+    ]
+
+
+def _check_same_blocks(base_blocks, blocks):
+    for (base_line_number, base_element), (line_number, element) in zip(base_blocks, blocks):
+        if _block_key(base_element) != _block_key(element):
+            raise ValueError("cannot rebase, block on line number {} was changed to a different block".format(
+                line_number,
+            ))
+
+    if len(base_blocks) != len(blocks):
+        raise ValueError("cannot rebase, blocks were added or removed")
+
+
+def _block_key(element):
+    return type(element), getattr(element, "name", None)
+
+
+def _format_lines(start, end):
+    if end - start <= 1:
+        return "line {}".format(start + 1)
+    else:
+        return "lines {}-{}".format(start + 1, end)
+
+
+def _rederive_diff(original_diff, before, after):
+    # Keep the diff as it was written if its context still matches exactly
+    # and it gives the same code. patch applies diffs with stale context
+    # using fuzz, but the rendered diff would then show the old code.
+    try:
+        if _context_matches(before, original_diff) and apply_patch(before, original_diff) == after:
+            return original_diff
+    except PatchError:
+        pass
+
+    header_lines = original_diff.splitlines(keepends=True)[:2]
+    hunks = generate_diff(before, after)[len("---\n+++\n"):]
+    if len(header_lines) == 2 and header_lines[0].startswith("---") and header_lines[1].startswith("+++"):
+        return "".join(header_lines) + hunks
+    else:
+        return "---\n+++\n" + hunks
+
+
+def _context_matches(content, patch):
+    lines = content.splitlines()
+    for hunk in read_hunks(patch):
+        start = max(hunk.old_start - 1, 0)
+        if tuple(lines[start:start + len(hunk.old_lines)]) != hunk.old_lines:
+            return False
+    return True
@@ -1,10 +1,17 @@
+import io
+
+
 class CodeBlock(object):
     def __init__(self, language, content):
         self.language = language
         self.content = content
 
     def dumps(self):
-        return _dumps_directive(
+        return _dumps_element(self)
+
+    def write(self, fileobj):
+        _write_directive(
+            fileobj,
             name="code-block",
             arguments=(self.language, ),
             options={},
@@ -17,7 +24,11 @@ class LiteralBlock(object):
         self.content = content
 
     def dumps(self):
-        return "::\n{}".format(_indent("\n" + self.content))
+        return _dumps_element(self)
+
+    def write(self, fileobj):
+        fileobj.write("::\n\n")
+        _write_indented(fileobj, self.content)
 
 
 class DiffdocBlock(object):
@@ -27,7 +38,11 @@ class DiffdocBlock(object):
         self.content = content
 
     def dumps(self):
-        return _dumps_directive(
+        return _dumps_element(self)
+
+    def write(self, fileobj):
+        _write_directive(
+            fileobj,
             name="diff-doc",
             arguments=self.arguments,
             options=self.options,
@@ -35,17 +50,34 @@ class DiffdocBlock(object):
         )
 
 
-def _dumps_directive(name, arguments, options, content):
-    arguments_str = " ".join(arguments)
-    options_str = "".join(
-        _indent("\n:{}: {}".format(option_name, option_value))
-        for option_name, option_value in sorted(options.items())
-    )
+class DiffdocIncludeBlock(object):
+    def __init__(self, arguments, options, content):
+        self.arguments = arguments
+        self.options = options
+        self.content = content
+
+    def dumps(self):
+        return _dumps_element(self)
+
+    def write(self, fileobj):
+        _write_directive(
+            fileobj,
+            name="diff-doc-include",
+            arguments=self.arguments,
+            options=self.options,
+            content=self.content,
+        )
+
+
+def _write_directive(fileobj, name, arguments, options, content):
+    fileobj.write(".. {}:: {}".format(name, " ".join(arguments)))
+    for option_name, option_value in sorted(options.items()):
+        fileobj.write("\n")
+        _write_indented(fileobj, ":{}: {}".format(option_name, option_value))
+    fileobj.write("\n")
     if content:
-        content_str = _indent("\n" + content)
-    else:
-        content_str = ""
-    return ".. {}:: {}{}\n{}".format(name, arguments_str, options_str, content_str)
+        fileobj.write("\n")
+        _write_indented(fileobj, content)
 
 
 class Text(object):
@@ -55,16 +87,31 @@ class Text(object):
     def dumps(self):
         return self.text
 
+    def write(self, fileobj):
+        fileobj.write(self.text)
+
     def to_rst(self):
         return self
 
 
 def dumps(elements):
-    return "".join(element.dumps() for element in elements)
+    output = io.StringIO()
+    dump(elements, output)
+    return output.getvalue()
+
+
+def dump(elements, fileobj):
+    for element in elements:
+        element.write(fileobj)
+
+
+def _dumps_element(element):
+    output = io.StringIO()
+    element.write(output)
+    return output.getvalue()
 
 
 def loads(value):
-    block_prefix = ".. diff-doc::"
     # TODO: handle other indentation
     result = []
 
@@ -74,7 +121,8 @@ def loads(value):
     while index < len(lines):
         line_number = index + 1
         line = lines[index]
-        if line.startswith(block_prefix):
+        block_prefix, block_type = _find_block_type(line)
+        if block_type is not None:
             arguments = tuple(filter(None, map(
                 lambda argument: argument.strip(),
                 line[len(block_prefix):].split(" "),
@@ -104,7 +152,7 @@ def loads(value):
                 lines[block_start_index:last_block_line_index + 1],
             ))
 
-            element = DiffdocBlock(
+            element = block_type(
                 arguments=arguments,
                 options=options,
                 content=content,
@@ -118,6 +166,20 @@ def loads(value):
     return result
 
 
+def _find_block_type(line):
+    for block_prefix, block_type in _block_types:
+        if line.startswith(block_prefix):
+            return block_prefix, block_type
+
+    return None, None
+
+
+_block_types = (
+    (".. diff-doc::", DiffdocBlock),
+    (".. diff-doc-include::", DiffdocIncludeBlock),
+)
+
+
 def _read_option(text):
     key, value = text.split(" ", 1)
     assert key.startswith(":")
@@ -140,11 +202,17 @@ def _unindent(line):
         return line
 
 
-def _indent(value):
-    return "\n".join(
-        line.rstrip()
-        for line in value.replace("\n", "\n" + indentation).splitlines(keepends=False)
-    )
+def _write_indented(fileobj, value):
+    """
+    Writes every line of value indented, with trailing whitespace removed.
+
+    The lines are split and stripped using str methods rather than written
+    one at a time, since a Python loop over the lines is slower.
+    """
+    lines = value.replace("\n", "\n" + indentation).splitlines(keepends=False)
+    if lines:
+        lines[0] = indentation + lines[0]
+    fileobj.write("\n".join(map(str.rstrip, lines)))
 
 
 indentation = " " * 4
@@ -0,0 +1,174 @@
+"""
+Sphinx extension that handles diff-doc directives directly, so source files
+don't need to be compiled before running Sphinx. Enable it by adding
+``"diffdoc.sphinxext"`` to ``extensions`` in ``conf.py``.
+
+The result of each block is stored in the Sphinx environment, keyed by a hash
+of that block and every diff-doc block before it in the same document. When a
+document is read again, blocks whose key is unchanged reuse the stored result,
+so editing the text around blocks doesn't run any programs.
+
+Includes aren't supported, so a ``diff-doc-include`` directive is reported as
+an error. Compile sources that include other sources before running Sphinx.
+"""
+
+import hashlib
+
+from docutils import nodes
+from docutils.parsers.rst import Directive, directives
+
+from . import __version__, cache, compiler, parser, rst
+
+
+class DiffdocDirective(Directive):
+    required_arguments = 2
+    optional_arguments = 0
+    has_content = True
+    option_spec = {
+        "file": directives.unchanged,
+        "language": directives.unchanged,
+        "render": directives.unchanged,
+        "session": directives.unchanged,
+        "subinterpreter": directives.unchanged,
+    }
+
+    def run(self):
+        env = self.state.document.settings.env
+        reader = env.temp_data.get(_temp_data_key)
+        if reader is None:
+            reader = env.temp_data[_temp_data_key] = _DocumentReader(
+                previous_results=env.diffdoc_previous_results.pop(env.docname, {}),
+            )
+            env.diffdoc_results[env.docname] = reader.results
+
+        if self.content:
+            content = "\n".join(self.content) + "\n"
+        else:
+            content = ""
+        block = rst.DiffdocBlock(
+            arguments=tuple(self.arguments),
+            options=dict(self.options),
+            content=content,
+        )
+
+        try:
+            transformed_element = reader.read(block, line_number=self.lineno)
+        except ValueError as error:
+            raise self.error(str(error))
+
+        return _to_nodes(transformed_element)
+
+
+_temp_data_key = "diffdoc_reader"
+
+
+class DiffdocIncludeDirective(Directive):
+    required_arguments = 1
+    optional_arguments = 0
+    has_content = True
+    option_spec = {
+        "render": directives.unchanged,
+    }
+
+    def run(self):
+        raise self.error(
+            "cannot include {} on line number {}, includes are not supported by the Sphinx extension".format(
+                self.arguments[0],
+                self.lineno,
+            ),
+        )
+
+
+class _DocumentReader(object):
+    def __init__(self, previous_results):
+        self._previous_results = previous_results
+        self._key = cache.environment_key()
+        self._state = {}
+        # Elements whose results were reused, and whose state transitions
+        # haven't been applied yet.
+        self._unapplied_elements = []
+        self.results = {}
+
+    def read(self, block, line_number):
+        element = parser._read_rst_element(block)
+        self._key = _hash(self._key, block.dumps())
+
+        transformed_element = self._previous_results.get(self._key)
+        if transformed_element is None:
+            for unapplied_line_number, unapplied_element in self._unapplied_elements:
+                self._state = compiler.transition(
+                    self._state,
+                    unapplied_element,
+                    line_number=unapplied_line_number,
+                )
+            self._unapplied_elements = []
+
+            self._state, transformed_element = compiler.execute(
+                self._state,
+                element,
+                line_number=line_number,
+            )
+        else:
+            self._unapplied_elements.append((line_number, element))
+
+        self.results[self._key] = transformed_element
+        return transformed_element
+
+
+def _hash(key, value):
+    return hashlib.sha256("{}\0{}".format(key, value).encode("utf-8")).hexdigest()
+
+
+def _to_nodes(element):
+    if isinstance(element, rst.CodeBlock):
+        content = element.content.rstrip("\n")
+        node = nodes.literal_block(content, content)
+        node["language"] = element.language
+        return [node]
+    elif isinstance(element, rst.LiteralBlock):
+        content = element.content.rstrip("\n")
+        return [nodes.literal_block(content, content)]
+    else:
+        return []
+
+
+def _init_env(app, env, docnames):
+    if not hasattr(env, "diffdoc_results"):
+        env.diffdoc_results = {}
+    if not hasattr(env, "diffdoc_previous_results"):
+        env.diffdoc_previous_results = {}
+
+
+def _purge_doc(app, env, docname):
+    # Keep the results of documents that are about to be read again, so that
+    # unchanged blocks can reuse them.
+    results = env.diffdoc_results.pop(docname, None)
+    if results is not None:
+        env.diffdoc_previous_results[docname] = results
+
+
+def _merge_info(app, env, docnames, other):
+    for docname in docnames:
+        if docname in other.diffdoc_results:
+            env.diffdoc_results[docname] = other.diffdoc_results[docname]
+        env.diffdoc_previous_results.pop(docname, None)
+
+
+def _env_updated(app, env):
+    env.diffdoc_previous_results = {}
+
+
+def setup(app):
+    app.add_directive("diff-doc", DiffdocDirective)
+    app.add_directive("diff-doc-include", DiffdocIncludeDirective)
+    app.connect("env-before-read-docs", _init_env)
+    app.connect("env-purge-doc", _purge_doc)
+    app.connect("env-merge-info", _merge_info)
+    app.connect("env-updated", _env_updated)
+
+    return {
+        "version": __version__,
+        "env_version": 1,
+        "parallel_read_safe": True,
+        "parallel_write_safe": True,
+    }
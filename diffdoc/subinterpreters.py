@@ -0,0 +1,121 @@
+"""
+Runs Python programs in fresh sub-interpreters of the current process, which
+avoids starting a new process for each program. Sub-interpreters need Python
+3.12 or later, and are only used when the interpreter a program is run with
+is the interpreter running diffdoc.
+"""
+
+import contextlib
+import os
+import shutil
+import sys
+import threading
+
+# Earlier versions have an experimental module for sub-interpreters, but
+# they share the GIL and aren't any quicker to start than a new process.
+if sys.version_info < (3, 12):
+    _interpreters = None
+else:
+    try:
+        import _interpreters
+    except ImportError:
+        import _xxsubinterpreters as _interpreters
+
+
+def is_available(interpreter):
+    if _interpreters is None:
+        return False
+
+    path = shutil.which(interpreter)
+    return path is not None and os.path.realpath(path) == os.path.realpath(sys.executable)
+
+
+def run(source, output_fd, filename="<string>"):
+    """
+    Runs a program in a fresh sub-interpreter, writing its stdout and stderr
+    to the given file descriptor. Returns whether the program finished without
+    raising an exception.
+
+    Since the sub-interpreter shares this process, the program can't exit the
+    process or change its working directory: trying to do so raises an
+    exception, so the program fails and can be run in a new process instead.
+    """
+    with _redirect_lock, _redirect_output(output_fd):
+        interpreter_id = _interpreters.create()
+        try:
+            try:
+                error = _interpreters.run_string(interpreter_id, _script.format(
+                    source=repr(source),
+                    filename=repr(filename),
+                ))
+            except Exception:
+                # Python 3.12 raises an exception when the script fails, while
+                # later versions return a description of the exception.
+                return False
+            succeeded = error is None
+        finally:
+            try:
+                _interpreters.destroy(interpreter_id)
+            except Exception:
+                # Programs that leave threads running can't be destroyed.
+                succeeded = False
+
+    return succeeded
+
+
+# The file descriptors for stdout and stderr belong to the whole process, so
+# only one program is run at a time.
+_redirect_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def _redirect_output(output_fd):
+    """
+    Points stdout and stderr of this process at the output file descriptor,
+    so that output written directly to the file descriptors, such as by a
+    subprocess, is captured in the same way as for a program run in a new
+    process.
+    """
+    for stream in (sys.stdout, sys.stderr):
+        if stream is not None:
+            stream.flush()
+
+    saved_fds = [os.dup(1), os.dup(2)]
+    try:
+        os.dup2(output_fd, 1)
+        os.dup2(output_fd, 2)
+        yield
+    finally:
+        os.dup2(saved_fds[0], 1)
+        os.dup2(saved_fds[1], 2)
+        for saved_fd in saved_fds:
+            os.close(saved_fd)
+
+
+# stdout and stderr are buffered the same way as in a new process writing to
+# a pipe: stdout is block buffered, and stderr is line buffered.
+_script = """
+import os
+import sys
+
+def _unsupported(name):
+    def unsupported(*args, **kwargs):
+        raise RuntimeError("os.{{}} is not supported in a sub-interpreter".format(name))
+    return unsupported
+
+os._exit = _unsupported("_exit")
+os.chdir = _unsupported("chdir")
+os.fchdir = _unsupported("fchdir")
+del _unsupported
+
+sys.argv = ["-c"]
+sys.stdout = sys.__stdout__ = open(1, "w", encoding="utf-8", closefd=False)
+sys.stderr = sys.__stderr__ = open(2, "w", encoding="utf-8", errors="backslashreplace", buffering=1, closefd=False)
+namespace = {{"__name__": "__main__", "__builtins__": __builtins__}}
+
+try:
+    exec(compile({source}, {filename}, "exec"), namespace)
+finally:
+    sys.stdout.flush()
+    sys.stderr.flush()
+"""
@@ -0,0 +1,89 @@
+import contextlib
+import hashlib
+import os
+import shutil
+import stat
+import tempfile
+import threading
+
+
+class Workspace(object):
+    """
+    Materialises trees of files into working directories for running
+    programs. Each distinct file content is written once to a
+    content-addressed store, and hardlinked into each working directory, so
+    running successive states of a tree doesn't copy unchanged files. Stored
+    files are read-only, so that a program can't change the files seen by
+    later runs, although it can still replace them.
+    """
+
+    def __init__(self):
+        self._directory = None
+        self._stored_keys = set()
+        # Programs for different interpreters are run from different threads.
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def materialise(self, files):
+        with self._lock:
+            if self._directory is None:
+                self._directory = tempfile.mkdtemp(prefix="diffdoc-workspace-")
+                os.mkdir(os.path.join(self._directory, "store"))
+
+        working_directory = tempfile.mkdtemp(dir=self._directory, prefix="run-")
+        try:
+            for path, content in files.items():
+                destination_path = os.path.join(working_directory, path)
+                os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+                _link_or_copy(self._store(content), destination_path)
+
+            yield working_directory
+        finally:
+            shutil.rmtree(working_directory, ignore_errors=True)
+
+    def _store(self, content):
+        encoded_content = content.encode("utf-8")
+        key = hashlib.sha256(encoded_content).hexdigest()
+        stored_path = os.path.join(self._directory, "store", key)
+
+        with self._lock:
+            if key in self._stored_keys:
+                return stored_path
+            self._stored_keys.add(key)
+
+            file_descriptor, temporary_path = tempfile.mkstemp(dir=self._directory)
+            with os.fdopen(file_descriptor, "wb") as fileobj:
+                fileobj.write(encoded_content)
+            os.chmod(temporary_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            os.replace(temporary_path, stored_path)
+
+        return stored_path
+
+    def close(self):
+        if self._directory is not None:
+            shutil.rmtree(self._directory, ignore_errors=True)
+            self._directory = None
+            self._stored_keys.clear()
+
+
+def _link_or_copy(source_path, destination_path):
+    try:
+        os.link(source_path, destination_path)
+    except OSError:
+        shutil.copyfile(source_path, destination_path)
+
+
+def check_path(path):
+    """
+    Raises ValueError unless the path is a relative path inside a working
+    directory.
+    """
+    normalised_path = os.path.normpath(path)
+    if (
+        not path or
+        os.path.isabs(path) or
+        normalised_path == os.curdir or
+        normalised_path.split(os.sep)[0] == os.pardir
+    ):
+        raise ValueError("invalid file path: {}".format(path))
+    return normalised_path
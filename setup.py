@@ -19,7 +19,10 @@ setup(
     entry_points={
         "console_scripts": [
             "diff-doc=diffdoc.cli:main"
-        ]
+        ],
+        "pytest11": [
+            "diffdoc=diffdoc.pytest_plugin"
+        ],
     },
     keywords="diff doc example tutorial",
     classifiers=[
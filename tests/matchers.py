@@ -17,6 +17,13 @@ def is_diffdoc_block(arguments, options, content):
     )
 
 
+def is_diffdoc_include_block(arguments, options, content):
+    return all_of(
+        is_instance(rst.DiffdocIncludeBlock),
+        has_attrs(arguments=arguments, options=options, content=content),
+    )
+
+
 def is_diff(**kwargs):
     return all_of(
         is_instance(parser.Diff),
@@ -24,6 +31,13 @@ def is_diff(**kwargs):
     )
 
 
+def is_include(**kwargs):
+    return all_of(
+        is_instance(parser.Include),
+        has_attrs(**kwargs),
+    )
+
+
 def is_literal_block(**kwargs):
     return all_of(
         is_instance(rst.LiteralBlock),
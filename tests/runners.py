@@ -0,0 +1,24 @@
+from diffdoc import execution
+
+
+class CountingRunner(execution.Runner):
+    """
+    Runs programs, recording the interpreter used for each run.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.interpreters = []
+
+    def run(self, args, expected_output, **kwargs):
+        self.interpreters.append(args[0])
+        return super().run(args, expected_output=expected_output, **kwargs)
+
+
+class FailingRunner(execution.Runner):
+    """
+    Fails the test if any program is run.
+    """
+
+    def run(self, args, expected_output, **kwargs):
+        raise AssertionError("runner was used to run a program")
@@ -0,0 +1,66 @@
+import os
+import subprocess
+import sys
+
+from precisely import assert_that, contains_string, equal_to, not_
+
+from diffdoc import cache
+
+
+def test_get_returns_none_when_key_is_missing(tmp_path):
+    document_cache = cache.Cache(str(tmp_path))
+
+    assert_that(document_cache.get("missing"), equal_to(None))
+
+
+def test_get_returns_value_put_under_key(tmp_path):
+    document_cache = cache.Cache(str(tmp_path / "cache"))
+
+    document_cache.put("key", "Text one\r\nText two\n")
+
+    assert_that(document_cache.get("key"), equal_to("Text one\r\nText two\n"))
+
+
+def test_document_key_is_stable_for_same_source():
+    assert_that(cache.document_key("Text"), equal_to(cache.document_key("Text")))
+
+
+def test_document_key_changes_with_source():
+    assert_that(cache.document_key("Text one"), not_(equal_to(cache.document_key("Text two"))))
+
+
+def test_document_key_changes_with_source_name():
+    assert_that(cache.document_key("Text"), not_(equal_to(cache.document_key("Text", source_name="one.src.rst"))))
+    assert_that(
+        cache.document_key("Text", source_name="one.src.rst"),
+        not_(equal_to(cache.document_key("Text", source_name="two.src.rst"))),
+    )
+
+
+def test_document_key_is_computed_without_importing_execution_module():
+    output = subprocess.check_output(
+        [
+            sys.executable,
+            "-c",
+            "import sys; from diffdoc import cache; cache.document_key('Text'); print(sorted(sys.modules))",
+        ],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        universal_newlines=True,
+    )
+
+    assert_that(output, not_(contains_string("diffdoc.execution")))
+
+
+def test_environment_key_changes_with_interpreter_run_by_wrapper(tmp_path, monkeypatch):
+    wrapper_path = tmp_path / "python"
+    wrapper_path.write_text("#!/bin/sh\necho \"$0\"\necho \"$DIFFDOC_TEST_VERSION\"\n")
+    wrapper_path.chmod(0o755)
+    monkeypatch.setenv("PATH", str(tmp_path) + os.pathsep + os.environ["PATH"])
+
+    def environment_key(version):
+        monkeypatch.setenv("DIFFDOC_TEST_VERSION", version)
+        monkeypatch.setattr(cache, "_interpreter_identities", {})
+        return cache.environment_key(interpreters=("python", ))
+
+    assert_that(environment_key("3.12.1"), equal_to(environment_key("3.12.1")))
+    assert_that(environment_key("3.12.1"), not_(equal_to(environment_key("3.13.0"))))
@@ -1,9 +1,16 @@
-from precisely import assert_that, equal_to, has_attrs, is_mapping, is_sequence
+import os
+import sys
+
+from precisely import assert_that, contains_string, equal_to, has_attrs, has_feature, is_mapping, is_sequence, starts_with
 import pytest
 
-from diffdoc import compiler, parser
+from diffdoc import compiler, parser, subinterpreters
+from diffdoc.contentstore import ContentStore
+from diffdoc.lockfile import Lockfile
+from diffdoc.metrics import Metrics
 from .dedent import dedent
 from .matchers import is_code_block, is_diff, is_empty_element, is_literal_block, is_replace, is_start
+from .runners import CountingRunner, FailingRunner
 
 
 def test_text_is_preserved_without_state_change():
@@ -64,7 +71,14 @@ class TestDiff(object):
         }
 
         error = pytest.raises(ValueError, lambda: _execute(state, element, line_number=42))
-        assert_that(str(error.value), equal_to("cannot apply diff on line number 42, invalid patch"))
+        assert_that(str(error.value), equal_to(
+            "cannot apply diff on line number 42, invalid patch\n"
+            "hunk 1 (@@ -1,2 +1,2 @@) doesn't match the content, "
+            "closest match is on line 1 (offset 0, 1 of 2 lines match):\n"
+            "  line 1:\n"
+            "    expected: x = 3\n"
+            "    actual:   x = 1"
+        ))
 
     def test_diff_updates_code_using_content_as_patch(self):
         element = parser.Diff(
@@ -123,6 +137,35 @@ class TestDiff(object):
         assert_that(new_element, is_empty_element)
         assert_that(new_state["example"], has_attrs(pending_lines=is_sequence("x = 2")))
 
+    def test_lines_added_by_diff_that_are_already_in_content_are_not_pending(self):
+        element = parser.Diff(
+            name="example",
+            content=dedent("""
+                --- old
+                +++ new
+
+                @@ -1,2 +1,4 @@
+                 x = 1
+                 print(x)
+                +x = 2
+                +print(x)
+
+            """),
+            render=False,
+        )
+        state = {
+            "example": _create_code(
+                language="python",
+                content="x = 1\nprint(x)\n",
+            ),
+        }
+
+        new_state, new_element = _execute(state, element)
+        assert_that(new_state["example"], has_attrs(
+            content="x = 1\nprint(x)\nx = 2\nprint(x)\n",
+            pending_lines=is_sequence("x = 2"),
+        ))
+
     def test_diff_with_render_true_renders_content(self):
         # TODO: handle rendering when last_render is out of date
         content = dedent("""
@@ -153,6 +196,38 @@ class TestDiff(object):
         assert_that(new_state["example"], has_attrs(pending_lines=is_sequence()))
 
 
+class TestStoredContent(object):
+    def test_patching_stored_content_is_same_as_patching_content_in_memory(self):
+        patch = dedent("""
+            --- old
+            +++ new
+
+            @@ -1,2 +1,3 @@
+             x = 1
+            +y = 2
+             print(x)
+
+        """)
+        code = compiler.Code.blank(language="python", store=ContentStore(spill_size=0)).replace("x = 1\nprint(x)\n")
+
+        new_code = code.render_content().patch(patch)
+
+        assert_that(new_code, has_attrs(
+            content="x = 1\ny = 2\nprint(x)\n",
+            pending_lines=("y = 2", ),
+        ))
+
+    def test_rendering_stored_content_checks_lines_are_in_content(self):
+        code = compiler.Code.blank(language="python", store=ContentStore(spill_size=0)).replace("x = 1\nprint(x)\n")
+        state = {"example": code}
+
+        new_state, new_element = _execute(state, parser.Render(name="example", content="print(x)\n"))
+        error = pytest.raises(ValueError, lambda: _execute(state, parser.Render(name="example", content="y\n")))
+
+        assert_that(new_state["example"].pending_lines, equal_to(("x = 1", )))
+        assert_that(str(error.value), equal_to("cannot render on line number 1, line is not in content:\ny"))
+
+
 class TestOutput(object):
     def test_when_there_are_pending_lines_then_output_raises_error(self):
         element = parser.Output(
@@ -413,7 +488,6 @@ class TestReplace(object):
         assert_that(new_state["example"], has_attrs(pending_lines=is_sequence()))
 
 
-
 class TestStart(object):
     def test_start_initialises_state_for_name(self):
         # TODO: error if name already taken
@@ -463,6 +537,373 @@ class TestStart(object):
         assert_that(new_state["example"], has_attrs(pending_lines=is_sequence()))
 
 
+class TestFiles(object):
+    def test_diff_with_file_headers_patches_each_file(self):
+        start = parser.Start(name="example", language="python", render=True, content="import util\n", path="main.py")
+        state, _ = _execute({}, start)
+        state, _ = _execute(state, parser.Diff(name="example", render=True, content=dedent("""
+            --- /dev/null
+            +++ b/util.py
+            @@ -0,0 +1,2 @@
+            +def f():
+            +    return 1
+            --- a/main.py
+            +++ b/main.py
+            @@ -1 +1,2 @@
+             import util
+            +print(util.f())
+
+        """)))
+
+        assert_that(state["example"], has_attrs(
+            path="main.py",
+            content="import util\nprint(util.f())\n",
+            files=is_mapping({"util.py": "def f():\n    return 1\n"}),
+            pending_lines=is_sequence(),
+        ))
+
+    def test_unchanged_files_are_shared_between_states(self):
+        start = parser.Start(name="example", language="python", render=True, content="import util\n", path="main.py")
+        state, _ = _execute({}, start)
+        state, _ = _execute(state, parser.Diff(name="example", render=True, content=dedent("""
+            --- /dev/null
+            +++ b/util.py
+            @@ -0,0 +1 @@
+            +x = 1
+
+        """)))
+        new_state, _ = _execute(state, parser.Diff(name="example", render=True, content=dedent("""
+            --- a/main.py
+            +++ b/main.py
+            @@ -1 +1,2 @@
+             import util
+            +print(util.x)
+
+        """)))
+
+        assert_that(new_state["example"].files["util.py"] is state["example"].files["util.py"], equal_to(True))
+
+    def test_output_is_run_in_directory_containing_files(self):
+        source = (
+            (1, parser.Start(name="example", language="python", render=True, content="import util\n", path="main.py")),
+            (2, parser.Diff(name="example", render=True, content=dedent("""
+                --- /dev/null
+                +++ b/util.py
+                @@ -0,0 +1,2 @@
+                +def f():
+                +    return 1
+                --- a/main.py
+                +++ b/main.py
+                @@ -1 +1,2 @@
+                 import util
+                +print(util.f())
+
+            """))),
+            (3, parser.Output(name="example", render=True, content="1")),
+        )
+
+        result = compiler.compile(source)
+
+        assert_that(result[2], is_literal_block(content="1"))
+
+    def test_when_file_header_has_no_path_then_error_explains_expected_headers(self):
+        start = parser.Start(name="example", language="python", render=True, content="import util\n", path="main.py")
+        state, _ = _execute({}, start)
+
+        error = pytest.raises(ValueError, lambda: _execute(state, parser.Diff(name="example", render=True, content=dedent("""
+            ---
+            +++
+            @@ -1 +1 @@
+            -import util
+            +import other
+
+        """))))
+
+        assert_that(str(error.value), equal_to(
+            "cannot apply diff on line number 1, file header has no path, "
+            "expected headers such as --- a/main.py and +++ b/main.py"
+        ))
+
+
+class TestCompile(object):
+    def test_elements_are_counted_by_type(self):
+        metrics = Metrics()
+
+        compiler.compile(
+            (
+                (1, parser.Text("Text")),
+                (2, parser.Start(name="example", language="python", render=True, content="x = 1")),
+                (3, parser.Text("Text")),
+            ),
+            metrics=metrics,
+        )
+
+        assert_that(metrics.to_prometheus(), equal_to(
+            "# TYPE diffdoc_elements_total counter\n"
+            "diffdoc_elements_total{type=\"start\"} 1\n"
+            "diffdoc_elements_total{type=\"text\"} 2\n"
+        ))
+
+    def test_outputs_for_code_with_session_are_run_in_session(self):
+        source = (
+            (1, parser.Start(name="example", language="python", render=True, content="x = 1\nprint(x)\n", session=True)),
+            (2, parser.Output(name="example", render=False, content="1")),
+            (3, parser.Diff(name="example", render=False, content=dedent("""
+                --- old
+                +++ new
+                @@ -1,2 +1,3 @@
+                 x = 1
+                 print(x)
+                +print(x + 1)
+
+            """))),
+            (4, parser.Render(name="example", content="print(x + 1)\n")),
+            (5, parser.Output(name="example", render=False, content="1\n2")),
+        )
+
+        compiler.compile(source, runner=FailingRunner())
+
+    def test_outputs_are_run_in_new_process_by_default(self):
+        program = "import os\nprint(os.getpid() == {})\n".format(os.getpid())
+        source = (
+            (1, parser.Start(name="example", language="python", render=True, content=program)),
+            (2, parser.Output(name="example", render=False, content="False")),
+        )
+
+        compiler.compile(source, interpreters=[sys.executable])
+
+    @pytest.mark.skipif(
+        not subinterpreters.is_available(sys.executable),
+        reason="sub-interpreters are not available",
+    )
+    def test_outputs_for_code_with_subinterpreter_are_run_in_this_process(self):
+        program = "import os\nprint(os.getpid() == {})\n".format(os.getpid())
+        source = (
+            (1, parser.Start(name="example", language="python", render=True, content=program, subinterpreter=True)),
+            (2, parser.Output(name="example", render=False, content="True")),
+        )
+
+        compiler.compile(source, interpreters=[sys.executable])
+
+    def test_frozen_lockfile_verifies_recorded_outputs_without_running_programs(self):
+        source = (
+            (1, parser.Start(name="example", language="python", render=True, content="print(1)\n")),
+            (2, parser.Output(name="example", render=True, content="1")),
+        )
+        lockfile = Lockfile()
+        compiler.compile(source, lockfile=lockfile)
+
+        result = compiler.compile(
+            source,
+            runner=FailingRunner(),
+            lockfile=Lockfile.loads(lockfile.dumps(), frozen=True),
+        )
+
+        assert_that(result[1], is_literal_block(content="1"))
+
+    def test_frozen_lockfile_rejects_changed_programs(self):
+        lockfile = Lockfile()
+        compiler.compile(
+            (
+                (1, parser.Start(name="example", language="python", render=True, content="print(1)\n")),
+                (2, parser.Output(name="example", render=False, content="1")),
+            ),
+            lockfile=lockfile,
+        )
+        source = (
+            (1, parser.Start(name="example", language="python", render=True, content="print(2 - 1)\n")),
+            (2, parser.Output(name="example", render=False, content="1")),
+        )
+
+        error = pytest.raises(ValueError, lambda: compiler.compile(
+            source,
+            runner=FailingRunner(),
+            lockfile=Lockfile.loads(lockfile.dumps(), frozen=True),
+        ))
+
+        assert_that(str(error.value), equal_to(
+            "output on line number 2 is incorrect, program or output has changed since the lockfile was recorded"
+        ))
+
+    def test_line_range_only_compiles_elements_in_range(self):
+        source = (
+            (1, parser.Start(name="example", language="python", render=True, content="x = 1\nprint(x)\n")),
+            (5, parser.Output(name="example", render=True, content="wrong")),
+            (10, parser.Diff(name="example", render=True, content=dedent("""
+                --- old
+                +++ new
+                @@ -1,2 +1,2 @@
+                -x = 1
+                +x = 2
+                 print(x)
+
+            """))),
+            (20, parser.Output(name="example", render=True, content="2")),
+            (30, parser.Output(name="example", render=True, content="wrong")),
+        )
+        runner = CountingRunner()
+
+        result = compiler.compile(source, runner=runner, line_range=(10, 20))
+
+        assert_that(result, is_sequence(
+            is_literal_block(),
+            is_literal_block(content="2"),
+        ))
+        assert_that(runner.interpreters, equal_to(["python"]))
+
+    def test_tracebacks_show_source_name_and_line_number_of_output(self):
+        source = (
+            (1, parser.Start(name="example", language="python", render=True, content="raise Exception('bang')\n")),
+            (2, parser.Output(name="example", render=False, content="")),
+        )
+
+        error = pytest.raises(ValueError, lambda: compiler.compile(source, source_name="example.src.rst"))
+
+        assert_that(str(error.value), contains_string('File "example.src.rst:2", line 1, in <module>'))
+
+    def test_tracebacks_show_string_as_filename_by_default(self):
+        source = (
+            (1, parser.Start(name="example", language="python", render=True, content="raise Exception('bang')\n")),
+            (2, parser.Output(name="example", render=False, content="")),
+        )
+
+        error = pytest.raises(ValueError, lambda: compiler.compile(source))
+
+        assert_that(str(error.value), contains_string('File "<string>", line 1, in <module>'))
+
+    def test_outputs_with_source_name_are_run_for_each_line_number(self):
+        source = (
+            (1, parser.Start(name="example", language="python", render=True, content="print(1)\n")),
+            (2, parser.Output(name="example", render=False, content="1")),
+            (3, parser.Output(name="example", render=False, content="1")),
+        )
+        runner = CountingRunner()
+
+        compiler.compile(source, runner=runner, source_name="example.src.rst")
+
+        assert_that(runner.interpreters, equal_to(["python", "python"]))
+
+    def test_first_error_is_raised_by_default(self):
+        source = (
+            (1, parser.Start(name="example", language="python", render=True, content="print(1)")),
+            (2, parser.Output(name="example", render=False, content="2")),
+            (3, parser.Output(name="example", render=False, content="3")),
+        )
+
+        error = pytest.raises(ValueError, lambda: compiler.compile(source))
+        assert_that(str(error.value), starts_with("output on line number 2 is incorrect"))
+
+    def test_structural_errors_are_raised_before_programs_are_run(self):
+        source = (
+            (1, parser.Start(name="example", language="python", render=True, content="print(1)")),
+            (2, parser.Output(name="example", render=False, content="1")),
+            (3, parser.Diff(name="example", render=True, content=dedent("""
+                ---
+                +++
+                @@ -1 +1 @@
+                -print(2)
+                +print(3)
+
+            """))),
+        )
+
+        error = pytest.raises(ValueError, lambda: compiler.compile(source, runner=FailingRunner()))
+        assert_that(str(error.value), starts_with("cannot apply diff on line number 3, invalid patch\n"))
+
+    def test_outputs_are_checked_with_each_interpreter(self):
+        source = (
+            (1, parser.Start(name="example", language="python", render=True, content="print(1)")),
+            (2, parser.Output(name="example", render=False, content="2")),
+        )
+
+        error = pytest.raises(
+            compiler.CompileError,
+            lambda: compiler.compile(source, interpreters=["python", sys.executable]),
+        )
+        assert_that(error.value.errors, is_sequence(
+            has_str(starts_with("output on line number 2 is incorrect with python\n")),
+            has_str(starts_with("output on line number 2 is incorrect with {}\n".format(sys.executable))),
+        ))
+
+    def test_program_is_run_once_per_interpreter_when_output_is_checked_repeatedly(self):
+        source = (
+            (1, parser.Start(name="example", language="python", render=True, content="print(1)")),
+            (2, parser.Output(name="example", render=False, content="1")),
+            (3, parser.Output(name="example", render=False, content="1")),
+        )
+        runner = CountingRunner()
+
+        compiler.compile(source, runner=runner, interpreters=["python", sys.executable])
+
+        assert_that(sorted(runner.interpreters), equal_to(sorted(["python", sys.executable])))
+
+    def test_when_keep_going_then_all_errors_are_raised_together(self):
+        source = (
+            (1, parser.Start(name="example", language="python", render=False, content="print(1)")),
+            (2, parser.Output(name="example", render=False, content="2")),
+            (3, parser.Diff(name="example", render=True, content=dedent("""
+                ---
+                +++
+                @@ -1 +1 @@
+                -print(2)
+                +print(3)
+
+            """))),
+            (4, parser.Output(name="example", render=False, content="3")),
+            (5, parser.Start(name="other", language="python", render=True, content="print(1)")),
+            (6, parser.Output(name="other", render=False, content="4")),
+        )
+
+        error = pytest.raises(compiler.CompileError, lambda: compiler.compile(source, keep_going=True))
+        assert_that(error.value.errors, is_sequence(
+            has_str("cannot render output on line number 2, pending lines:\nprint(1)"),
+            has_str(starts_with("output on line number 2 is incorrect")),
+            has_str(starts_with("cannot apply diff on line number 3, invalid patch\n")),
+            has_str(starts_with("output on line number 6 is incorrect")),
+        ))
+
+    def test_when_keep_going_then_blocks_for_unknown_names_are_reported(self):
+        source = (
+            (1, parser.Output(name="example", render=False, content="1")),
+            (2, parser.Diff(name="other", render=True, content=dedent("""
+                ---
+                +++
+                @@ -1 +1 @@
+                -print(1)
+                +print(2)
+
+            """))),
+        )
+
+        error = pytest.raises(compiler.CompileError, lambda: compiler.compile(source, keep_going=True))
+        assert_that(error.value.errors, is_sequence(
+            has_str("unknown name example on line number 1, there is no earlier start block for it"),
+            has_str("unknown name other on line number 2, there is no earlier start block for it"),
+        ))
+
+    def test_when_keep_going_then_replace_after_failed_diff_is_checked(self):
+        source = (
+            (1, parser.Start(name="example", language="python", render=True, content="print(1)")),
+            (2, parser.Diff(name="example", render=True, content=dedent("""
+                ---
+                +++
+                @@ -1 +1 @@
+                -print(2)
+                +print(3)
+
+            """))),
+            (3, parser.Output(name="example", render=False, content="3")),
+            (4, parser.Replace(name="example", render=True, content="print(4)")),
+            (5, parser.Output(name="example", render=False, content="5")),
+        )
+
+        error = pytest.raises(compiler.CompileError, lambda: compiler.compile(source, keep_going=True))
+        assert_that(error.value.errors, is_sequence(
+            has_str(starts_with("cannot apply diff on line number 2, invalid patch\n")),
+            has_str(starts_with("output on line number 5 is incorrect")),
+        ))
+
+
 class TestConvertBlock(object):
     def test_converting_from_diff_to_replace_generates_replace_block(self):
         start = parser.Start(
@@ -559,6 +1000,62 @@ class TestConvertBlock(object):
             ),
         ))
 
+    def test_converting_from_diff_changing_other_files_to_replace_raises_error(self):
+        start = parser.Start(name="example", language="python", render=True, content="import util\n", path="main.py")
+        diff = parser.Diff(name="example", render=False, content=dedent("""
+            --- /dev/null
+            +++ b/util.py
+            @@ -0,0 +1 @@
+            +x = 1
+
+        """))
+
+        error = pytest.raises(ValueError, lambda: compiler.convert_block(
+            source=(
+                (1, start),
+                (2, diff),
+            ),
+            line_number=2,
+            block_type="replace",
+        ))
+
+        assert_that(str(error.value), equal_to(
+            "cannot convert diff on line number 2 to replace, diff changes other files: util.py"
+        ))
+
+    def test_converting_from_replace_to_diff_for_code_with_files_generates_file_headers(self):
+        start = parser.Start(name="example", language="python", render=True, content="x = 1\n", path="main.py")
+        replace = parser.Replace(name="example", render=False, content="x = 2\n")
+
+        output = compiler.convert_block(
+            source=(
+                (1, start),
+                (2, replace),
+            ),
+            line_number=2,
+            block_type="diff",
+        )
+
+        assert_that(output[1], is_diff(
+            name="example",
+            render=False,
+            content=dedent("""
+                --- a/main.py
+                +++ b/main.py
+                @@ -1 +1 @@
+                -x = 1
+                +x = 2
+
+            """),
+        ))
+        new_state, _ = _execute({}, start)
+        new_state, _ = _execute(new_state, output[1])
+        assert_that(new_state["example"].content, equal_to("x = 2\n"))
+
+
+def has_str(value):
+    return has_feature("str", str, value)
+
 
 def is_code(language, content):
     return has_attrs(language=language, content=content)
@@ -0,0 +1,65 @@
+from precisely import assert_that, equal_to, greater_than
+
+from diffdoc import contentstore
+from diffdoc.contentstore import ContentStore
+
+
+def test_stored_content_is_read_back():
+    store = ContentStore()
+    first = store.put("first\n")
+    second = store.put("second ☃\n")
+
+    assert_that(first.read(), equal_to("first\n"))
+    assert_that(second.read(), equal_to("second ☃\n"))
+
+
+def test_only_content_larger_than_spill_size_is_spilled():
+    store = ContentStore(spill_size=4)
+
+    assert_that(store.should_spill("abcd"), equal_to(False))
+    assert_that(store.should_spill("abcde"), equal_to(True))
+
+
+def test_lines_are_split_in_same_way_as_splitlines(monkeypatch):
+    monkeypatch.setattr(contentstore, "_chunk_size", 3)
+    content = "one\r\ntwo\n\nthree\rfour ☃\nfive"
+
+    stored_lines = ContentStore().put(content).lines()
+
+    assert_that(list(stored_lines), equal_to(content.splitlines()))
+    assert_that(bool(stored_lines), equal_to(True))
+
+
+def test_content_is_read_in_chunks(monkeypatch):
+    monkeypatch.setattr(contentstore, "_chunk_size", 3)
+    content = "one ☃\ntwo ☃☃\n"
+
+    chunks = list(ContentStore().put(content))
+
+    assert_that("".join(chunks), equal_to(content))
+    assert_that(len(chunks), greater_than(1))
+
+
+def test_space_of_unused_content_is_reused():
+    store = ContentStore()
+    first = store.put("first\n")
+    second = store.put("second\n")
+    del first
+
+    third = store.put("third\n")
+
+    assert_that(store.file_size, equal_to(len("first\nsecond\n")))
+    assert_that(second.read(), equal_to("second\n"))
+    assert_that(third.read(), equal_to("third\n"))
+
+
+def test_file_is_truncated_when_content_at_end_is_unused():
+    store = ContentStore()
+    first = store.put("first\n")
+    second = store.put("second\n")
+    del second
+
+    store.put("x")
+
+    assert_that(store.file_size, equal_to(len("first\nx")))
+    assert_that(first.read(), equal_to("first\n"))
@@ -0,0 +1,142 @@
+from precisely import assert_that, equal_to, has_attrs, is_sequence
+import pytest
+
+from diffdoc import diff
+from .dedent import dedent
+
+
+def test_hunks_are_read_with_ranges_and_lines():
+    hunks = diff.read_hunks(dedent("""
+        ---
+        +++
+        @@ -1,2 +1,3 @@
+        -x = 1
+        +x = 2
+         print(x)
+        +print(x)
+        @@ -10 +11,0 @@
+        -y = 1
+    """))
+
+    assert_that(hunks, is_sequence(
+        has_attrs(
+            old_start=1,
+            old_length=2,
+            new_start=1,
+            new_length=3,
+            removed_lines=is_sequence("x = 1"),
+            added_lines=is_sequence("x = 2", "print(x)"),
+        ),
+        has_attrs(
+            old_start=10,
+            old_length=1,
+            new_start=11,
+            new_length=0,
+            removed_lines=is_sequence("y = 1"),
+            added_lines=is_sequence(),
+        ),
+    ))
+
+
+def test_empty_lines_in_hunk_are_read_as_context():
+    hunks = diff.read_hunks(dedent("""
+        ---
+        +++
+        @@ -1,2 +1,2 @@
+
+        -x = 1
+        +x = 2
+    """))
+
+    assert_that(hunks, is_sequence(
+        has_attrs(lines=is_sequence((" ", ""), ("-", "x = 1"), ("+", "x = 2"))),
+    ))
+
+
+def test_patch_is_split_into_patch_for_each_file():
+    file_patches = diff.read_file_patches(dedent("""
+        diff --git a/main.py b/main.py
+        --- a/main.py
+        +++ b/main.py
+        @@ -1 +1,2 @@
+         import util
+        +print(util.f())
+        --- /dev/null
+        +++ b/util.py
+        @@ -0,0 +1,2 @@
+        +def f():
+        +    return 1
+    """))
+
+    assert_that(file_patches, is_sequence(
+        has_attrs(
+            path="main.py",
+            is_creation=False,
+            is_deletion=False,
+            patch="--- a/main.py\n+++ b/main.py\n@@ -1 +1,2 @@\n import util\n+print(util.f())\n",
+        ),
+        has_attrs(
+            path="util.py",
+            is_creation=True,
+            is_deletion=False,
+            patch="--- /dev/null\n+++ b/util.py\n@@ -0,0 +1,2 @@\n+def f():\n+    return 1",
+        ),
+    ))
+
+
+def test_removed_lines_that_look_like_file_headers_are_read_as_part_of_hunk():
+    file_patches = diff.read_file_patches(dedent("""
+        --- main.py
+        +++ main.py
+        @@ -1 +1 @@
+        --- x
+        +++ y
+    """))
+
+    assert_that(file_patches, is_sequence(
+        has_attrs(path="main.py", patch="--- main.py\n+++ main.py\n@@ -1 +1 @@\n--- x\n+++ y"),
+    ))
+
+
+def test_failing_hunk_is_located_at_closest_match():
+    old = "".join("x{} = {}\n".format(index, index) for index in range(1000))
+
+    error = pytest.raises(diff.PatchError, lambda: diff.apply_patch(old, dedent("""
+        ---
+        +++
+        @@ -1,2 +1,2 @@
+         x0 = 0
+        -x1 = 1
+        +x1 = -1
+        @@ -500,3 +500,3 @@
+         x503 = 503
+        -x504 = 5
+        +x504 = -504
+         x505 = 505
+
+    """)))
+
+    assert_that(str(error.value), equal_to(
+        "invalid patch\n"
+        "hunk 2 (@@ -500,3 +500,3 @@) doesn't match the content, "
+        "closest match is on line 504 (offset 4, 2 of 3 lines match):\n"
+        "  line 505:\n"
+        "    expected: x504 = 5\n"
+        "    actual:   x504 = 504"
+    ))
+
+
+def test_hunk_with_no_matching_lines_is_described():
+    error = pytest.raises(diff.PatchError, lambda: diff.apply_patch("x = 1\n", dedent("""
+        ---
+        +++
+        @@ -1 +1 @@
+        -y = 1
+        +y = 2
+
+    """)))
+
+    assert_that(str(error.value), equal_to(
+        "invalid patch\n"
+        "hunk 1 (@@ -1,1 +1,1 @@) doesn't match any lines in the content"
+    ))
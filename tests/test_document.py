@@ -0,0 +1,111 @@
+from precisely import all_of, assert_that, contains_string, equal_to, has_attrs, is_instance, is_sequence
+import pytest
+
+import diffdoc
+from diffdoc import execution, parser
+from diffdoc.includes import Includes
+from .dedent import dedent
+from .runners import CountingRunner, FailingRunner
+
+
+_source_text = dedent("""
+    .. diff-doc:: start example
+        :language: python
+        :render: True
+
+        x = 1
+        print(x)
+
+    .. diff-doc:: output example
+        :render: True
+
+        1
+
+    .. diff-doc:: diff example
+        :render: True
+
+        --- old
+        +++ new
+        @@ -1,2 +1,2 @@
+        -x = 1
+        +x = 2
+         print(x)
+
+    .. diff-doc:: output example
+        :render: True
+
+        2
+""")
+
+
+def test_state_at_replays_includes_without_running_programs(tmp_path, monkeypatch):
+    monkeypatch.setattr(execution.Runner, "run", FailingRunner.run)
+    (tmp_path / "setup.src.rst").write_text(_source_text, encoding="utf-8")
+    document = diffdoc.Document(
+        dedent("""
+            .. diff-doc-include:: setup.src.rst
+                :render: False
+
+            Text
+        """),
+        includes=Includes(base_directory=str(tmp_path)),
+    )
+
+    code = document.state_at(4, "example")
+
+    assert_that(code.content, equal_to("x = 2\nprint(x)\n"))
+
+
+def test_blocks_can_be_filtered_by_name_and_type():
+    document = diffdoc.Document(_source_text)
+
+    assert_that(document.blocks(name="example", type="output"), is_sequence(
+        is_sequence(8, has_attrs(content="1\n")),
+        is_sequence(23, has_attrs(content="2")),
+    ))
+    assert_that(document.blocks(name="other"), equal_to([]))
+
+
+def test_state_at_line_includes_blocks_starting_on_or_before_line():
+    document = diffdoc.Document(_source_text)
+
+    assert_that(document.state_at(12, "example"), has_attrs(content="x = 1\nprint(x)\n"))
+    assert_that(document.state_at(13, "example"), has_attrs(content="x = 2\nprint(x)\n"))
+    assert_that(document.state_at(1, "example"), has_attrs(content="x = 1\nprint(x)\n"))
+
+
+def test_state_at_line_before_start_raises_error():
+    document = diffdoc.Document("Text\n\n" + _source_text)
+
+    error = pytest.raises(ValueError, lambda: document.state_at(1, "example"))
+
+    assert_that(str(error.value), equal_to("no code named example on line number 1"))
+
+
+def test_converting_block_uses_state_before_block():
+    document = diffdoc.Document(_source_text)
+
+    output = document.convert_block(13, "replace")
+
+    assert_that(output, contains_string(".. diff-doc:: replace example\n    :render: True\n\n    x = 2\n    print(x)\n"))
+
+
+def test_compiled_output_is_kept_between_compiles():
+    document = diffdoc.Document(_source_text)
+    runner = CountingRunner()
+
+    first_output = document.compile(runner=runner)
+    second_output = document.compile(runner=runner)
+
+    assert_that(second_output, equal_to(first_output))
+    assert_that(len(runner.interpreters), equal_to(2))
+
+
+def test_source_is_parsed_once():
+    document = diffdoc.Document(_source_text)
+
+    assert_that(document.source is document.source, equal_to(True))
+    assert_that(document.source[0], is_sequence(
+        1,
+        all_of(is_instance(parser.Start), has_attrs(name="example")),
+    ))
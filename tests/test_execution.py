@@ -0,0 +1,305 @@
+import os
+import sys
+import time
+
+from precisely import assert_that, equal_to, greater_than, greater_than_or_equal_to, has_attrs, less_than
+import pytest
+
+from diffdoc import execution, subinterpreters
+
+
+class TestOutputMatcher(object):
+    def test_output_equal_to_expected_output_matches(self):
+        assert_that(_match("1\n2", ["1\n", "2\n"]), equal_to(True))
+
+    def test_leading_and_trailing_whitespace_is_ignored(self):
+        assert_that(_match("\n1\n2\n", ["  \n", "\n1\n2", "\n\n  \n"]), equal_to(True))
+
+    def test_output_that_is_prefix_of_expected_output_does_not_match(self):
+        assert_that(_match("1\n2", ["1\n"]), equal_to(False))
+
+    def test_output_with_extra_content_does_not_match(self):
+        assert_that(_match("1", ["1\n", "\n", "2"]), equal_to(False))
+
+    def test_mismatch_is_detected_before_output_ends(self):
+        matcher = execution.OutputMatcher("1\n2\n3")
+
+        matcher.feed("1\n")
+        assert_that(matcher.is_mismatch, equal_to(False))
+        matcher.feed("3\n")
+        assert_that(matcher.is_mismatch, equal_to(True))
+
+    def test_whitespace_inside_output_must_match(self):
+        matcher = execution.OutputMatcher("1 2")
+
+        matcher.feed("1 ")
+        assert_that(matcher.is_mismatch, equal_to(False))
+        matcher.feed("\n")
+        assert_that(matcher.is_mismatch, equal_to(True))
+
+
+class TestRun(object):
+    def test_matching_output_is_measured(self):
+        result = _run("print(1)", expected_output="1")
+
+        assert_that(result, has_attrs(matches=True, output_size=2))
+
+    @pytest.mark.skipif(not hasattr(os, "wait4"), reason="requires wait4")
+    def test_resources_used_by_program_are_measured(self):
+        program = "x = bytearray(50 * 1024 * 1024)\nprint(1)"
+
+        result = _run(program, expected_output="1")
+
+        assert_that(result.resources, has_attrs(
+            wall_time=greater_than(0),
+            user_time=greater_than_or_equal_to(0),
+            system_time=greater_than_or_equal_to(0),
+            max_rss=greater_than(50 * 1024 * 1024),
+        ))
+
+    def test_program_is_killed_once_output_cannot_match(self):
+        program = "import time\nprint('0\\n1\\n2', flush=True)\ntime.sleep(60)"
+
+        start = time.monotonic()
+        result = _run(program, expected_output="0\n2")
+
+        assert_that(time.monotonic() - start, less_than(30))
+        assert_that(result, has_attrs(
+            matches=False,
+            documented_output="0\n2",
+            actual_output="0\n1\n2\n...\n",
+        ))
+
+    def test_mismatch_shows_window_around_first_differing_line(self):
+        expected_output = "".join("{}\n".format(i) for i in range(20))
+        program = "for i in range(20):\n    print(-1 if i == 10 else i)"
+
+        result = _run(program, expected_output=expected_output)
+
+        assert_that(result, has_attrs(
+            matches=False,
+            documented_output="...\n5\n6\n7\n8\n9\n10\n11\n12\n13\n14\n15\n...\n",
+            actual_output="...\n5\n6\n7\n8\n9\n-1\n11\n12\n13\n14\n15\n...\n",
+        ))
+
+    def test_mismatch_window_is_read_from_spooled_output(self):
+        expected_output = "".join("{}\n".format(i) for i in range(1000))
+        program = "for i in range(1000):\n    print(-1 if i == 998 else i)"
+
+        result = _run(program, expected_output=expected_output, spool_size=100)
+
+        assert_that(result, has_attrs(
+            matches=False,
+            documented_output="...\n993\n994\n995\n996\n997\n998\n999\n",
+            actual_output="...\n993\n994\n995\n996\n997\n-1\n999\n",
+        ))
+
+    def test_error_is_raised_when_output_is_larger_than_maximum(self):
+        program = "while True:\n    print()"
+
+        error = pytest.raises(
+            execution.OutputTooLargeError,
+            lambda: _run(program, expected_output="", max_output_size=1000),
+        )
+        assert_that(str(error.value), equal_to("output is larger than the maximum of 1000 bytes"))
+
+
+class TestRunSource(object):
+    def test_output_matches_when_run_with_subinterpreter(self):
+        runner = execution.Runner()
+        result = runner.run_source(sys.executable, "print(1)\nprint(2)\n", expected_output="1\n2", subinterpreter=True)
+
+        assert_that(result.matches, equal_to(True))
+
+    def test_failing_program_is_run_again_in_new_process(self):
+        program = "print(1)\nraise Exception('bang')\n"
+        fresh_result = _run(program, expected_output="")
+
+        runner = execution.Runner()
+        result = runner.run_source(sys.executable, program, expected_output="", subinterpreter=True)
+
+        assert_that(result, has_attrs(
+            matches=False,
+            actual_output=fresh_result.actual_output,
+        ))
+
+    def test_program_longer_than_maximum_argument_length_is_run(self):
+        program = "x = 1\n" * 100000 + "print(x)\n"
+
+        result = execution.Runner().run_source(sys.executable, program, expected_output="1")
+
+        assert_that(result.matches, equal_to(True))
+
+    def test_program_is_run_as_if_given_on_command_line(self):
+        program = "import sys\nprint(sys.argv, __name__)\n"
+
+        result = execution.Runner().run_source(sys.executable, program, expected_output="['-c'] __main__")
+
+        assert_that(result.matches, equal_to(True))
+
+    def test_tracebacks_show_filename(self):
+        program = "print(1)\nraise Exception('bang')\n"
+
+        result = execution.Runner().run_source(sys.executable, program, expected_output="", filename="example.rst:42")
+
+        assert_that(result.actual_output, equal_to(
+            "1\n"
+            "Traceback (most recent call last):\n"
+            "  File \"example.rst:42\", line 2, in <module>\n"
+            "Exception: bang\n"
+        ))
+
+    @pytest.mark.skipif(
+        not subinterpreters.is_available(sys.executable),
+        reason="sub-interpreters are not available",
+    )
+    def test_program_is_run_in_this_process_with_subinterpreter(self):
+        runner = execution.Runner()
+        result = runner.run_source(
+            sys.executable,
+            "import os\nprint(os.getpid())\n",
+            expected_output=str(os.getpid()),
+            subinterpreter=True,
+        )
+
+        assert_that(result.matches, equal_to(True))
+
+    @pytest.mark.skipif(
+        not subinterpreters.is_available(sys.executable),
+        reason="sub-interpreters are not available",
+    )
+    def test_program_exiting_process_is_run_in_new_process_with_subinterpreter(self):
+        runner = execution.Runner()
+        result = runner.run_source(
+            sys.executable,
+            "import os\nprint(1, flush=True)\nos._exit(0)\n",
+            expected_output="1",
+            subinterpreter=True,
+        )
+
+        assert_that(result.matches, equal_to(True))
+
+    @pytest.mark.skipif(
+        not subinterpreters.is_available(sys.executable),
+        reason="sub-interpreters are not available",
+    )
+    def test_program_changing_directory_does_not_change_directory_of_this_process(self, tmp_path):
+        working_directory = os.getcwd()
+        runner = execution.Runner()
+        result = runner.run_source(
+            sys.executable,
+            "import os\nos.chdir({!r})\nprint(os.getcwd())\n".format(str(tmp_path)),
+            expected_output=str(tmp_path),
+            subinterpreter=True,
+        )
+
+        assert_that(result.matches, equal_to(True))
+        assert_that(os.getcwd(), equal_to(working_directory))
+
+    @pytest.mark.skipif(
+        not subinterpreters.is_available(sys.executable),
+        reason="sub-interpreters are not available",
+    )
+    def test_output_of_subprocesses_is_captured_with_subinterpreter(self, capfd):
+        runner = execution.Runner()
+        result = runner.run_source(
+            sys.executable,
+            "import subprocess, sys\nsubprocess.run([sys.executable, '-c', 'print(1)'])\n",
+            expected_output="1",
+            subinterpreter=True,
+        )
+
+        assert_that(result.matches, equal_to(True))
+        assert_that(capfd.readouterr().out, equal_to(""))
+
+    def test_program_is_run_in_new_process_by_default(self):
+        runner = execution.Runner()
+        result = runner.run_source(sys.executable, "import os\nprint(os.getpid())\n", expected_output=str(os.getpid()))
+
+        assert_that(result.matches, equal_to(False))
+
+
+class TestSession(object):
+    def test_output_is_output_of_whole_program_so_far(self, tmp_path):
+        session = execution.Runner().start_session()
+        try:
+            first_result = session.run("print(1)\n", expected_output="1")
+            second_result = session.run("print(1)\nprint(2)\n", expected_output="1\n2")
+        finally:
+            session.close()
+
+        assert_that(first_result.matches, equal_to(True))
+        assert_that(second_result.matches, equal_to(True))
+
+    def test_only_appended_code_is_executed(self, tmp_path):
+        log_path = str(tmp_path / "log")
+        program = "open({!r}, 'a').write('run\\n')\nx = 1\n".format(log_path)
+
+        session = execution.Runner().start_session()
+        try:
+            session.run(program, expected_output="")
+            result = session.run(program + "print(x + 1)\n", expected_output="2")
+        finally:
+            session.close()
+
+        assert_that(result.matches, equal_to(True))
+        assert_that(_read(log_path), equal_to("run\n"))
+
+    def test_program_is_executed_from_scratch_when_code_is_not_appended(self, tmp_path):
+        log_path = str(tmp_path / "log")
+        program = "open({!r}, 'a').write('run\\n')\n".format(log_path)
+
+        session = execution.Runner().start_session()
+        try:
+            session.run(program + "print(1)\n", expected_output="1")
+            result = session.run(program + "print(2)\n", expected_output="2")
+        finally:
+            session.close()
+
+        assert_that(result.matches, equal_to(True))
+        assert_that(_read(log_path), equal_to("run\nrun\n"))
+
+    def test_program_is_run_fresh_when_appended_code_raises_exception(self):
+        program = "print(1)\nraise Exception('bang')\n"
+        fresh_result = execution.Runner().run(["python", "-c", program], expected_output="")
+
+        session = execution.Runner().start_session()
+        try:
+            session.run("print(1)\n", expected_output="1")
+            result = session.run(program, expected_output="")
+        finally:
+            session.close()
+
+        assert_that(result, has_attrs(
+            matches=False,
+            actual_output=fresh_result.actual_output,
+        ))
+
+    def test_program_is_run_fresh_when_output_does_not_match(self):
+        program = "import atexit\natexit.register(print, 'exiting')\n"
+
+        session = execution.Runner().start_session()
+        try:
+            session.run("print(1)\n", expected_output="1")
+            result = session.run("print(1)\n" + program, expected_output="1\nexiting")
+        finally:
+            session.close()
+
+        assert_that(result.matches, equal_to(True))
+
+
+def _read(path):
+    with open(path, "rt", encoding="utf-8") as fileobj:
+        return fileobj.read()
+
+
+def _run(program, expected_output, **kwargs):
+    runner = execution.Runner(**kwargs)
+    return runner.run([sys.executable, "-c", program], expected_output=expected_output)
+
+
+def _match(expected_output, chunks):
+    matcher = execution.OutputMatcher(expected_output)
+    for chunk in chunks:
+        matcher.feed(chunk)
+    return matcher.finish()
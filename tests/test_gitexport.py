@@ -0,0 +1,98 @@
+import io
+import shutil
+import subprocess
+
+from precisely import assert_that, contains_string, equal_to
+import pytest
+
+from diffdoc import execution, gitexport, parser
+from diffdoc.includes import Includes
+from .dedent import dedent
+from .runners import FailingRunner
+
+
+def test_commit_is_written_for_each_block_that_changes_content():
+    fileobj = io.BytesIO()
+
+    gitexport.write_fast_import(_source(), fileobj, timestamp=1000)
+
+    assert_that(fileobj.getvalue().decode("utf-8"), equal_to(
+        "commit refs/heads/example\n"
+        "committer diff-doc <diff-doc> 1000 +0000\n"
+        "data 23\n"
+        "Start on line number 1\n\n"
+        "M 100644 inline example.py\n"
+        "data 15\n"
+        "x = 1\nprint(x)\n\n"
+        "\n"
+        "commit refs/heads/example\n"
+        "committer diff-doc <diff-doc> 1000 +0000\n"
+        "data 22\n"
+        "Diff on line number 2\n\n"
+        "M 100644 inline example.py\n"
+        "data 15\n"
+        "x = 2\nprint(x)\n\n"
+        "\n"
+    ))
+
+
+def test_included_sources_are_replayed_without_running_programs(tmp_path, monkeypatch):
+    monkeypatch.setattr(execution.Runner, "run", FailingRunner.run)
+    (tmp_path / "setup.src.rst").write_text(dedent("""
+        .. diff-doc:: start example
+            :language: python
+            :render: True
+
+            print(1)
+
+        .. diff-doc:: output example
+            :render: True
+
+            1
+    """), encoding="utf-8")
+    fileobj = io.BytesIO()
+
+    gitexport.write_fast_import(
+        [(1, parser.Include(path="setup.src.rst", render=False))],
+        fileobj,
+        includes=Includes(base_directory=str(tmp_path)),
+        timestamp=1000,
+    )
+
+    assert_that(fileobj.getvalue().decode("utf-8"), contains_string("data 9\nprint(1)\n"))
+
+
+@pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+def test_history_of_each_name_is_imported_into_repository(tmp_path):
+    repository_path = str(tmp_path / "repository")
+    subprocess.check_call(["git", "init", "--quiet", repository_path])
+
+    gitexport.export(_source(), repository_path=repository_path)
+
+    log = subprocess.check_output(
+        ["git", "log", "--format=%s", "example"],
+        cwd=repository_path,
+    ).decode("utf-8")
+    assert_that(log, equal_to("Diff on line number 2\nStart on line number 1\n"))
+    content = subprocess.check_output(
+        ["git", "show", "example:example.py"],
+        cwd=repository_path,
+    ).decode("utf-8")
+    assert_that(content, equal_to("x = 2\nprint(x)\n"))
+
+
+def _source():
+    return (
+        (1, parser.Start(name="example", language="python", render=True, content="x = 1\nprint(x)\n")),
+        (2, parser.Diff(name="example", render=True, content=dedent("""
+            --- old
+            +++ new
+            @@ -1,2 +1,2 @@
+            -x = 1
+            +x = 2
+             print(x)
+
+        """))),
+        (3, parser.Render(name="example", content="x = 2\n")),
+        (4, parser.Output(name="example", render=False, content="2")),
+    )
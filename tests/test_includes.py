@@ -0,0 +1,260 @@
+import os
+
+from precisely import assert_that, contains_string, equal_to, has_feature, is_sequence, not_, starts_with
+import pytest
+
+import diffdoc
+from diffdoc import cache
+from diffdoc.includes import Includes
+from .dedent import dedent
+from .runners import CountingRunner, FailingRunner
+
+
+def test_included_source_continues_state_of_code(tmp_path):
+    _write(tmp_path / "setup.src.rst", """
+        .. diff-doc:: start example
+            :language: python
+            :render: True
+
+            print(42)
+    """)
+    source = dedent("""
+        .. diff-doc-include:: setup.src.rst
+            :render: False
+
+        .. diff-doc:: output example
+            :render: True
+
+            42
+    """)
+
+    output = diffdoc.compile(source, includes=Includes(base_directory=str(tmp_path)))
+
+    assert_that(output, contains_string("::\n\n    42"))
+    assert_that(output, not_(contains_string("print(42)")))
+
+
+def test_when_render_is_true_then_compiled_output_of_included_source_is_inlined(tmp_path):
+    _write(tmp_path / "setup.src.rst", """
+        Setup
+
+        .. diff-doc:: start example
+            :language: python
+            :render: True
+
+            print(42)
+    """)
+    source = dedent("""
+        .. diff-doc-include:: setup.src.rst
+            :render: True
+    """)
+
+    output = diffdoc.compile(source, includes=Includes(base_directory=str(tmp_path)))
+
+    assert_that(output, contains_string("Setup\n"))
+    assert_that(output, contains_string(".. code-block:: python\n\n    print(42)"))
+
+
+def test_nested_includes_are_relative_to_including_source(tmp_path):
+    (tmp_path / "chapters").mkdir()
+    _write(tmp_path / "chapters" / "setup.src.rst", """
+        .. diff-doc-include:: start.src.rst
+            :render: False
+    """)
+    _write(tmp_path / "chapters" / "start.src.rst", """
+        .. diff-doc:: start example
+            :language: python
+            :render: True
+
+            print(42)
+    """)
+    source = dedent("""
+        .. diff-doc-include:: chapters/setup.src.rst
+            :render: False
+
+        .. diff-doc:: output example
+            :render: False
+
+            42
+    """)
+
+    diffdoc.compile(source, includes=Includes(base_directory=str(tmp_path)))
+
+
+def test_when_source_includes_itself_then_error_is_raised(tmp_path):
+    _write(tmp_path / "loop.src.rst", """
+        .. diff-doc-include:: loop.src.rst
+            :render: False
+    """)
+    source = dedent("""
+        .. diff-doc-include:: loop.src.rst
+            :render: False
+    """)
+
+    with pytest.raises(ValueError) as error:
+        diffdoc.compile(source, includes=Includes(base_directory=str(tmp_path)))
+
+    assert_that(str(error.value), contains_string("source includes itself"))
+
+
+def test_when_keep_going_then_blocks_using_names_from_failed_include_are_skipped(tmp_path):
+    _write(tmp_path / "setup.src.rst", """
+        .. diff-doc:: start example
+            :language: python
+            :render: True
+
+            print(42)
+
+        .. diff-doc:: output example
+            :render: True
+
+            43
+    """)
+    source = dedent("""
+        .. diff-doc-include:: setup.src.rst
+            :render: False
+
+        .. diff-doc:: output example
+            :render: True
+
+            42
+
+        .. diff-doc:: output other
+            :render: True
+
+            42
+    """)
+
+    error = pytest.raises(ValueError, lambda: diffdoc.compile(
+        source,
+        includes=Includes(base_directory=str(tmp_path)),
+        keep_going=True,
+    ))
+
+    assert_that(error.value.errors, is_sequence(
+        has_str(starts_with("cannot include setup.src.rst on line number 1:\n")),
+        has_str("unknown name other on line number 9, there is no earlier start block for it"),
+    ))
+
+
+def test_programs_in_included_source_are_run_after_structure_of_source_is_checked(tmp_path):
+    _write(tmp_path / "setup.src.rst", """
+        .. diff-doc:: start example
+            :language: python
+            :render: True
+
+            print(42)
+
+        .. diff-doc:: output example
+            :render: True
+
+            42
+    """)
+    source = dedent("""
+        .. diff-doc-include:: setup.src.rst
+            :render: False
+
+        .. diff-doc:: render example
+
+            print(43)
+    """)
+    runner = CountingRunner()
+
+    error = pytest.raises(ValueError, lambda: diffdoc.compile(
+        source,
+        runner=runner,
+        includes=Includes(base_directory=str(tmp_path)),
+    ))
+
+    assert_that(str(error.value), starts_with("cannot render on line number 4"))
+    assert_that(len(runner.interpreters), equal_to(0))
+
+
+def test_programs_in_included_source_before_line_range_are_not_run(tmp_path):
+    _write(tmp_path / "setup.src.rst", """
+        .. diff-doc:: start example
+            :language: python
+            :render: True
+
+            print(42)
+
+        .. diff-doc:: output example
+            :render: True
+
+            42
+    """)
+    source = dedent("""
+        .. diff-doc-include:: setup.src.rst
+            :render: False
+
+        .. diff-doc:: render example
+
+            print(42)
+    """)
+
+    output = diffdoc.compile(
+        source,
+        runner=FailingRunner(),
+        includes=Includes(base_directory=str(tmp_path)),
+        line_range=(4, 6),
+    )
+
+    assert_that(output, contains_string(".. code-block:: python\n\n    print(42)"))
+
+
+def test_included_source_is_compiled_once_when_result_is_cached(tmp_path):
+    _write(tmp_path / "setup.src.rst", """
+        .. diff-doc:: start example
+            :language: python
+            :render: True
+
+            print(42)
+
+        .. diff-doc:: output example
+            :render: False
+
+            42
+    """)
+    source = dedent("""
+        .. diff-doc-include:: setup.src.rst
+            :render: False
+    """)
+    result_cache = cache.Cache(str(tmp_path / "cache"))
+    runner = CountingRunner()
+
+    for _ in range(2):
+        diffdoc.compile(
+            source,
+            runner=runner,
+            includes=Includes(base_directory=str(tmp_path), result_cache=result_cache),
+        )
+
+    assert_that(len(runner.interpreters), equal_to(1))
+
+
+def test_document_key_changes_when_included_source_changes(tmp_path):
+    source = dedent("""
+        .. diff-doc-include:: setup.src.rst
+            :render: False
+    """)
+    includes = Includes(base_directory=str(tmp_path))
+
+    _write(tmp_path / "setup.src.rst", """
+        Text one
+    """)
+    first_key = includes.document_key(source)
+    _write(tmp_path / "setup.src.rst", """
+        Text two
+    """)
+    second_key = includes.document_key(source)
+
+    assert_that(first_key, not_(equal_to(second_key)))
+
+
+def _write(path, text):
+    with open(os.fspath(path), "wt", encoding="utf-8") as fileobj:
+        fileobj.write(dedent(text))
+
+
+def has_str(value):
+    return has_feature("str", str, value)
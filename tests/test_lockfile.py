@@ -0,0 +1,57 @@
+from precisely import assert_that, equal_to
+import pytest
+
+from diffdoc import compiler
+from diffdoc.lockfile import Lockfile
+
+
+def test_recorded_output_is_contained_in_lockfile():
+    lockfile = Lockfile()
+    lockfile.record(_code("print(1)\n"), interpreter="python", expected_output="1")
+
+    assert_that(lockfile.contains(_code("print(1)\n"), interpreter="python", expected_output="1"), equal_to(True))
+    assert_that(lockfile.contains(_code("print(2)\n"), interpreter="python", expected_output="1"), equal_to(False))
+    assert_that(lockfile.contains(_code("print(1)\n"), interpreter="python3", expected_output="1"), equal_to(False))
+    assert_that(lockfile.contains(_code("print(1)\n"), interpreter="python", expected_output="2"), equal_to(False))
+
+
+def test_filename_is_part_of_entry_when_given():
+    lockfile = Lockfile()
+    lockfile.record(_code("print(1)\n"), interpreter="python", expected_output="1", filename="example.src.rst:2")
+
+    assert_that(
+        lockfile.contains(_code("print(1)\n"), interpreter="python", expected_output="1", filename="example.src.rst:2"),
+        equal_to(True),
+    )
+    assert_that(
+        lockfile.contains(_code("print(1)\n"), interpreter="python", expected_output="1", filename="example.src.rst:3"),
+        equal_to(False),
+    )
+    assert_that(lockfile.contains(_code("print(1)\n"), interpreter="python", expected_output="1"), equal_to(False))
+
+
+def test_leading_and_trailing_whitespace_of_output_is_ignored():
+    lockfile = Lockfile()
+    lockfile.record(_code("print(1)\n"), interpreter="python", expected_output="1")
+
+    assert_that(lockfile.contains(_code("print(1)\n"), interpreter="python", expected_output="\n1\n"), equal_to(True))
+
+
+def test_entries_are_kept_when_lockfile_is_written_and_read():
+    lockfile = Lockfile()
+    lockfile.record(_code("print(1)\n"), interpreter="python", expected_output="1")
+
+    loaded_lockfile = Lockfile.loads(lockfile.dumps(), frozen=True)
+
+    assert_that(loaded_lockfile.frozen, equal_to(True))
+    assert_that(loaded_lockfile.contains(_code("print(1)\n"), interpreter="python", expected_output="1"), equal_to(True))
+
+
+def test_lockfile_with_unknown_version_cannot_be_read():
+    error = pytest.raises(ValueError, lambda: Lockfile.loads('{"version": 2, "outputs": []}'))
+
+    assert_that(str(error.value), equal_to("unsupported lockfile version: 2"))
+
+
+def _code(content):
+    return compiler.Code(language="python", content=content, pending_lines=())
@@ -0,0 +1,24 @@
+from precisely import assert_that, equal_to, is_sequence
+
+from diffdoc.merge import merge3
+
+
+def test_changes_to_different_lines_are_merged():
+    merged, conflicts = merge3("a\nb\nc\nd\n", "A\nb\nc\nd\n", "a\nb\nc\nD\n")
+
+    assert_that(merged, equal_to("A\nb\nc\nD\n"))
+    assert_that(conflicts, equal_to([]))
+
+
+def test_same_change_on_both_sides_is_not_a_conflict():
+    merged, conflicts = merge3("a\nb\n", "a\nB\n", "a\nB\n")
+
+    assert_that(merged, equal_to("a\nB\n"))
+    assert_that(conflicts, equal_to([]))
+
+
+def test_different_changes_to_same_lines_conflict():
+    merged, conflicts = merge3("a\nb\nc\n", "a\nX\nc\n", "a\nY\nc\n")
+
+    assert_that(merged, equal_to("a\nX\nc\n"))
+    assert_that(conflicts, is_sequence((1, 2)))
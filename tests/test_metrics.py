@@ -0,0 +1,56 @@
+import json
+
+from precisely import assert_that, equal_to
+
+from diffdoc.metrics import Metrics
+
+
+def test_counters_are_written_in_prometheus_format():
+    metrics = Metrics()
+    metrics.increment("elements_total", type="text")
+    metrics.increment("elements_total", type="diff")
+    metrics.increment("elements_total", type="text")
+
+    assert_that(metrics.to_prometheus(), equal_to(
+        "# TYPE diffdoc_elements_total counter\n"
+        "diffdoc_elements_total{type=\"diff\"} 1\n"
+        "diffdoc_elements_total{type=\"text\"} 2\n"
+    ))
+
+
+def test_histograms_are_written_in_prometheus_format_with_cumulative_buckets():
+    metrics = Metrics()
+    metrics.observe("program_output_bytes", 50)
+    metrics.observe("program_output_bytes", 100)
+    metrics.observe("program_output_bytes", 5000)
+
+    assert_that(metrics.to_prometheus(), equal_to(
+        "# TYPE diffdoc_program_output_bytes histogram\n"
+        "diffdoc_program_output_bytes_bucket{le=\"100\"} 2\n"
+        "diffdoc_program_output_bytes_bucket{le=\"1000\"} 2\n"
+        "diffdoc_program_output_bytes_bucket{le=\"10000\"} 3\n"
+        "diffdoc_program_output_bytes_bucket{le=\"100000\"} 3\n"
+        "diffdoc_program_output_bytes_bucket{le=\"1000000\"} 3\n"
+        "diffdoc_program_output_bytes_bucket{le=\"10000000\"} 3\n"
+        "diffdoc_program_output_bytes_bucket{le=\"100000000\"} 3\n"
+        "diffdoc_program_output_bytes_bucket{le=\"+Inf\"} 3\n"
+        "diffdoc_program_output_bytes_sum 5150\n"
+        "diffdoc_program_output_bytes_count 3\n"
+    ))
+
+
+def test_metrics_can_be_written_as_json():
+    metrics = Metrics()
+    metrics.increment("cache_hits_total")
+    metrics.observe("patch_seconds", 0.002)
+
+    result = json.loads(metrics.to_json())
+
+    assert_that(result["counters"], equal_to({
+        "diffdoc_cache_hits_total": [{"labels": {}, "value": 1}],
+    }))
+    assert_that(result["histograms"]["diffdoc_patch_seconds"][0]["count"], equal_to(1))
+    assert_that(result["histograms"]["diffdoc_patch_seconds"][0]["buckets"][:2], equal_to([
+        ["0.001", 0],
+        ["0.005", 1],
+    ]))
@@ -1,7 +1,7 @@
 from precisely import assert_that
 
 from diffdoc import parser, rst
-from .matchers import is_diff, is_output, is_render, is_replace, is_start, is_text
+from .matchers import is_diff, is_include, is_output, is_render, is_replace, is_start, is_text
 
 
 class TestReadElement(object):
@@ -77,3 +77,44 @@ class TestReadElement(object):
             render=True,
             content="CONTENT",
         ))
+
+    def test_diffdoc_start_with_session(self):
+        element = parser._read_rst_element(rst.DiffdocBlock(
+            arguments=("start", "example"),
+            options={
+                "language": "python",
+                "render": "True",
+                "session": "True",
+            },
+            content="CONTENT",
+        ))
+        assert_that(element, is_start(
+            name="example",
+            session=True,
+        ))
+
+    def test_diffdoc_start_with_subinterpreter(self):
+        element = parser._read_rst_element(rst.DiffdocBlock(
+            arguments=("start", "example"),
+            options={
+                "language": "python",
+                "render": "True",
+                "subinterpreter": "True",
+            },
+            content="CONTENT",
+        ))
+        assert_that(element, is_start(
+            name="example",
+            subinterpreter=True,
+        ))
+
+    def test_diffdoc_include(self):
+        element = parser._read_rst_element(rst.DiffdocIncludeBlock(
+            arguments=("setup.src.rst", ),
+            options={"render": "False"},
+            content="",
+        ))
+        assert_that(element, is_include(
+            path="setup.src.rst",
+            render=False,
+        ))
@@ -0,0 +1,51 @@
+from precisely import assert_that, equal_to
+
+from diffdoc.execution import Resources
+from diffdoc.profiling import ResourceProfile
+
+
+def test_report_ranks_blocks_by_wall_time_and_memory():
+    profile = ResourceProfile()
+    profile.record(
+        line_number=10,
+        name="first",
+        resources=Resources(wall_time=0.5, user_time=0.4, system_time=0.1, max_rss=200 * 1024 * 1024),
+        output_size=10,
+    )
+    profile.record(
+        line_number=20,
+        name="second",
+        resources=Resources(wall_time=1.5, user_time=1.25, system_time=0.25, max_rss=100 * 1024 * 1024),
+        output_size=20,
+    )
+
+    assert_that(profile.report(), equal_to(
+        "Programs run: 2\n"
+        "Total wall time: 2.00 s\n"
+        "\n"
+        "Slowest output blocks:\n"
+        "  line 20 (second): 1.50 s wall, 1.25 s user, 0.25 s system, 100.0 MiB max RSS, 20 bytes of output\n"
+        "  line 10 (first): 0.50 s wall, 0.40 s user, 0.10 s system, 200.0 MiB max RSS, 10 bytes of output\n"
+        "\n"
+        "Largest output blocks by maximum resident set size:\n"
+        "  line 10 (first): 0.50 s wall, 0.40 s user, 0.10 s system, 200.0 MiB max RSS, 10 bytes of output\n"
+        "  line 20 (second): 1.50 s wall, 1.25 s user, 0.25 s system, 100.0 MiB max RSS, 20 bytes of output\n"
+    ))
+
+
+def test_report_omits_memory_when_not_measured():
+    profile = ResourceProfile()
+    profile.record(
+        line_number=10,
+        name="first",
+        resources=Resources(wall_time=0.5, user_time=None, system_time=None, max_rss=None),
+        output_size=10,
+    )
+
+    assert_that(profile.report(), equal_to(
+        "Programs run: 1\n"
+        "Total wall time: 0.50 s\n"
+        "\n"
+        "Slowest output blocks:\n"
+        "  line 10 (first): 0.50 s wall, 10 bytes of output\n"
+    ))
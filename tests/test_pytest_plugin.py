@@ -0,0 +1,100 @@
+from precisely import assert_that, contains_string, equal_to
+
+from .dedent import dedent
+
+
+pytest_plugins = ["pytester"]
+
+
+_source = dedent("""
+    .. diff-doc:: start example
+        :language: python
+        :render: True
+
+        x = 1
+        print(x)
+
+    .. diff-doc:: output example
+        :render: True
+
+        1
+
+    .. diff-doc:: diff example
+        :render: True
+
+        ---
+        +++
+        @@ -1,2 +1,2 @@
+        -x = 1
+        +x = 2
+         print(x)
+
+    .. diff-doc:: output example
+        :render: True
+
+        3
+
+""")
+
+
+def test_output_and_diff_blocks_are_collected_as_items(pytester):
+    pytester.makefile(".src.rst", tutorial=_source)
+
+    result = pytester.runpytest("-p", "diffdoc.pytest_plugin", "--diff-doc", "--collect-only", "-q")
+
+    assert_that(result.outlines[:3], equal_to([
+        "tutorial.src.rst::example-output-line-8",
+        "tutorial.src.rst::example-diff-line-13",
+        "tutorial.src.rst::example-output-line-23",
+    ]))
+
+
+def test_items_report_errors_from_compiler(pytester):
+    pytester.makefile(".src.rst", tutorial=_source)
+
+    result = pytester.runpytest("-p", "diffdoc.pytest_plugin", "--diff-doc")
+
+    result.assert_outcomes(passed=2, failed=1)
+    assert_that(result.stdout.str(), contains_string("output on line number 23 is incorrect"))
+
+
+def test_items_can_be_selected_independently(pytester):
+    pytester.makefile(".src.rst", tutorial=_source)
+
+    result = pytester.runpytest("-p", "diffdoc.pytest_plugin", "--diff-doc", "-k", "line-23")
+
+    result.assert_outcomes(failed=1, deselected=2)
+
+
+def test_items_after_include_replay_included_source(pytester):
+    pytester.makefile(".rst", setup=dedent("""
+        .. diff-doc:: start example
+            :language: python
+            :render: True
+
+            x = 1
+            print(x)
+
+    """))
+    pytester.makefile(".src.rst", tutorial=dedent("""
+        .. diff-doc-include:: setup.rst
+            :render: False
+
+        .. diff-doc:: output example
+            :render: True
+
+            1
+
+    """))
+
+    result = pytester.runpytest("-p", "diffdoc.pytest_plugin", "--diff-doc")
+
+    result.assert_outcomes(passed=1)
+
+
+def test_source_files_are_not_collected_without_option(pytester):
+    pytester.makefile(".src.rst", tutorial=_source)
+
+    result = pytester.runpytest("-p", "diffdoc.pytest_plugin")
+
+    result.assert_outcomes()
@@ -0,0 +1,115 @@
+from precisely import assert_that, equal_to, has_attrs, is_sequence
+import pytest
+
+from diffdoc import parser, rebasing
+from .dedent import dedent
+
+
+_diff = dedent("""
+    --- old
+    +++ new
+    @@ -1,3 +1,3 @@
+     x = 1
+     y = 2
+    -print(x)
+    +print(x + y)
+
+""")
+
+
+def test_diff_after_edited_block_is_rederived_from_edited_code():
+    base_source = _source(start_content="x = 1\ny = 2\nprint(x)\n", diff_content=_diff)
+    source = _source(start_content="x = 10\ny = 2\nprint(x)\n", diff_content=_diff)
+
+    rebased_source, problems = rebasing.rebase(base_source, source)
+
+    assert_that(problems, equal_to([]))
+    assert_that(rebased_source[1], is_sequence(2, has_attrs(content=dedent("""
+        --- old
+        +++ new
+        @@ -1,3 +1,3 @@
+         x = 10
+         y = 2
+        -print(x)
+        +print(x + y)
+
+    """))))
+
+
+def test_diff_that_still_applies_is_unchanged():
+    base_source = _source(start_content="x = 1\ny = 2\nprint(x)\n", diff_content=_diff)
+    source = _source(start_content="x = 1\ny = 2\nprint(x)\n", diff_content=_diff)
+
+    rebased_source, problems = rebasing.rebase(base_source, source)
+
+    assert_that(problems, equal_to([]))
+    assert_that(rebased_source[1][1] is source[1][1], equal_to(True))
+
+
+def test_conflicting_diff_is_reported_and_left_unchanged():
+    diff_content = dedent("""
+        ---
+        +++
+        @@ -1,2 +1,2 @@
+        -x = 1
+        +x = 3
+         y = 2
+
+    """)
+    base_source = _source(start_content="x = 1\ny = 2\n", diff_content=diff_content)
+    source = _source(start_content="x = 10\ny = 2\n", diff_content=diff_content)
+
+    rebased_source, problems = rebasing.rebase(base_source, source)
+
+    assert_that(problems, equal_to(["diff on line number 2 conflicts with earlier changes to line 1"]))
+    assert_that(rebased_source[1][1] is source[1][1], equal_to(True))
+
+
+def test_diff_after_replace_following_conflict_is_rebased():
+    conflicting_diff = dedent("""
+        ---
+        +++
+        @@ -1,2 +1,2 @@
+        -x = 1
+        +x = 3
+         y = 2
+
+    """)
+    base_source = _source(start_content="x = 1\ny = 2\n", diff_content=conflicting_diff) + [
+        (3, parser.Replace(name="example", render=True, content="x = 1\ny = 2\nprint(x)\n")),
+        (4, parser.Diff(name="example", render=True, content=_diff)),
+    ]
+    source = _source(start_content="x = 10\ny = 2\n", diff_content=conflicting_diff) + [
+        (3, parser.Replace(name="example", render=True, content="x = 10\ny = 2\nprint(x)\n")),
+        (4, parser.Diff(name="example", render=True, content=_diff)),
+    ]
+
+    rebased_source, problems = rebasing.rebase(base_source, source)
+
+    assert_that(problems, equal_to(["diff on line number 2 conflicts with earlier changes to line 1"]))
+    assert_that(rebased_source[3], is_sequence(4, has_attrs(content=dedent("""
+        --- old
+        +++ new
+        @@ -1,3 +1,3 @@
+         x = 10
+         y = 2
+        -print(x)
+        +print(x + y)
+
+    """))))
+
+
+def test_sources_with_different_blocks_cannot_be_rebased():
+    base_source = _source(start_content="x = 1\n", diff_content=_diff)
+    source = [(1, base_source[0][1])]
+
+    error = pytest.raises(ValueError, lambda: rebasing.rebase(base_source, source))
+
+    assert_that(str(error.value), equal_to("cannot rebase, blocks were added or removed"))
+
+
+def _source(start_content, diff_content):
+    return [
+        (1, parser.Start(name="example", language="python", render=True, content=start_content)),
+        (2, parser.Diff(name="example", render=True, content=diff_content)),
+    ]
@@ -2,7 +2,7 @@ from precisely import assert_that, equal_to, is_sequence, is_sequence as is_tupl
 
 from diffdoc import rst
 from .dedent import dedent
-from .matchers import is_diffdoc_block, is_text
+from .matchers import is_diffdoc_block, is_diffdoc_include_block, is_text
 
 
 def test_can_parse_single_diffdoc_block_with_content():
@@ -193,6 +193,35 @@ def test_diffdoc_block_with_content_is_serialised():
     """)))
 
 
+def test_can_parse_diffdoc_include_block():
+    content = _load_elements(dedent("""
+        .. diff-doc-include:: setup.src.rst
+            :render: False
+    """))
+
+    assert_that(content, is_sequence(
+        is_diffdoc_include_block(
+            arguments=is_sequence("setup.src.rst"),
+            options={"render": "False"},
+            content="",
+        ),
+    ))
+
+
+def test_diffdoc_include_blocks_are_serialised():
+    include_block = rst.DiffdocIncludeBlock(
+        arguments=("setup.src.rst", ),
+        options={"render": "False"},
+        content="",
+    )
+
+    assert_that(include_block.dumps(), equal_to(dedent("""
+        .. diff-doc-include:: setup.src.rst
+            :render: False
+
+    """)))
+
+
 def test_literal_blocks_are_serialised():
     code_block = rst.LiteralBlock(content="print(1)\n\nprint(2)\nprint(3)\n")
 
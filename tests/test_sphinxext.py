@@ -0,0 +1,101 @@
+import io
+
+import pytest
+from precisely import assert_that, contains_string, equal_to
+
+from .dedent import dedent
+
+
+sphinx_application = pytest.importorskip("sphinx.application")
+
+
+def test_diffdoc_blocks_are_rendered(tmp_path):
+    _write_source(tmp_path, "print(1)", "1")
+
+    _build(tmp_path)
+
+    output = (tmp_path / "build" / "index.txt").read_text()
+    assert_that(output, contains_string("print(1)"))
+    assert_that(output, contains_string("Output:\n\n   1\n"))
+
+
+def test_incorrect_output_is_reported(tmp_path):
+    _write_source(tmp_path, "print(1)", "2")
+
+    warnings = _build(tmp_path)
+
+    assert_that(warnings, contains_string("output on line number 12 is incorrect"))
+
+
+def test_programs_are_not_run_again_when_only_text_changes(tmp_path):
+    runs_path = tmp_path / "runs"
+    program = "open({!r}, 'a').write('run\\n')\nprint(1)".format(str(runs_path))
+    _write_source(tmp_path, program, "1")
+    _build(tmp_path)
+
+    _write_source(tmp_path, program, "1", text="Changed text")
+    _build(tmp_path)
+
+    assert_that(runs_path.read_text(), equal_to("run\n"))
+    assert_that((tmp_path / "build" / "index.txt").read_text(), contains_string("Changed text"))
+
+
+def test_includes_are_reported_as_unsupported(tmp_path):
+    source_path = tmp_path / "source"
+    source_path.mkdir()
+    (source_path / "conf.py").write_text("extensions = ['diffdoc.sphinxext']\n")
+    (source_path / "index.rst").write_text(dedent("""
+        Text
+
+        .. diff-doc-include:: setup.src.rst
+            :render: True
+
+    """))
+
+    warnings = _build(tmp_path)
+
+    assert_that(warnings, contains_string(
+        "cannot include setup.src.rst on line number 3, includes are not supported by the Sphinx extension",
+    ))
+
+
+def _write_source(path, program, output, text="Text"):
+    source_path = path / "source"
+    source_path.mkdir(exist_ok=True)
+    (source_path / "conf.py").write_text("extensions = ['diffdoc.sphinxext']\n")
+    (source_path / "index.rst").write_text(dedent("""
+        {text}
+
+        .. diff-doc:: start example
+            :language: python
+            :render: True
+
+        {program}
+
+        Output:
+
+        .. diff-doc:: output example
+            :render: True
+
+            {output}
+
+    """).format(
+        text=text,
+        program="".join("    " + line + "\n" for line in program.splitlines()),
+        output=output,
+    ))
+
+
+def _build(path):
+    warnings = io.StringIO()
+    app = sphinx_application.Sphinx(
+        srcdir=str(path / "source"),
+        confdir=str(path / "source"),
+        outdir=str(path / "build"),
+        doctreedir=str(path / "doctrees"),
+        buildername="text",
+        status=None,
+        warning=warnings,
+    )
+    app.build()
+    return warnings.getvalue()
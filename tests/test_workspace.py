@@ -0,0 +1,43 @@
+import os
+
+from precisely import assert_that, equal_to
+import pytest
+
+from diffdoc.workspace import Workspace, check_path
+
+
+def test_files_are_materialised_in_working_directory():
+    workspace = Workspace()
+    try:
+        with workspace.materialise({"main.py": "import pkg.util\n", "pkg/util.py": "x = 1\n"}) as directory:
+            assert_that(_read(os.path.join(directory, "main.py")), equal_to("import pkg.util\n"))
+            assert_that(_read(os.path.join(directory, "pkg", "util.py")), equal_to("x = 1\n"))
+    finally:
+        workspace.close()
+
+    assert_that(os.path.exists(directory), equal_to(False))
+
+
+def test_unchanged_files_are_not_copied_between_working_directories():
+    workspace = Workspace()
+    try:
+        with workspace.materialise({"util.py": "x = 1\n", "main.py": "print(1)\n"}) as directory:
+            first_inode = os.stat(os.path.join(directory, "util.py")).st_ino
+        with workspace.materialise({"util.py": "x = 1\n", "main.py": "print(2)\n"}) as directory:
+            second_inode = os.stat(os.path.join(directory, "util.py")).st_ino
+    finally:
+        workspace.close()
+
+    assert_that(first_inode, equal_to(second_inode))
+
+
+@pytest.mark.parametrize("path", ["", "/etc/passwd", "../main.py", "."])
+def test_paths_outside_working_directory_are_invalid(path):
+    error = pytest.raises(ValueError, lambda: check_path(path))
+
+    assert_that(str(error.value), equal_to("invalid file path: {}".format(path)))
+
+
+def _read(path):
+    with open(path, "rt", encoding="utf-8") as fileobj:
+        return fileobj.read()